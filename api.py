@@ -6,18 +6,30 @@ from pathlib import Path
 from urllib.parse import unquote
 
 import redis
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 from http.client import HTTPException
 from shapely.geometry import shape
 
 from core.coordinates_finder import GeoProcessor
+from core.geo_service import decode_nearby_cursor
 from core.relational_service import RelationalService
 from core.search_service import SearchService
 from embedding_config import embedding_config
+from infrastructure.cache_codec import get_codec_stats
+from infrastructure.db_pool import get_pool_stats
 from infrastructure.db_utils_for_search import Slot_validator
 from infrastructure.geo_db_store import find_place_flexible, get_place
+from infrastructure.geometry_simplify import parse_precision, resolve_tolerance_m
+from infrastructure.llm_cache import get_llm_cache
+from infrastructure.llm_guard import get_llm_guard
+from infrastructure.map_artifacts import artifact_name
 from infrastructure.maps_store import get_map_links
+from infrastructure.morphology import cache_stats as get_morphology_stats
+from infrastructure.render_queue import MapRenderQueue
+from infrastructure.request_pipeline import DeadlineExceeded, RequestPipeline, get_pipeline_stats
+from infrastructure.spatial_cache import get_spatial_cache_stats
+from infrastructure.vector_tiles import InvalidTileRequest, get_vector_tiles, parse_ids_param
 from infrastructure.to_nomn import find_place_key, to_prepositional_phrase
 from utils import (
     generate_cache_key, 
@@ -25,7 +37,10 @@ from utils import (
     set_cached_result,
     clear_cache_pattern,
     get_cache_stats,
-    init_redis
+    init_redis,
+    acquire_cache_lock,
+    release_cache_lock,
+    wait_for_cached_result
 )
 
 matplotlib_logger = logging.getLogger('matplotlib')
@@ -36,7 +51,10 @@ CORS(app)
 
 MAPS_DIR = os.getenv("MAPS_DIR","/var/www/map_bot/maps")
 DOMAIN = os.getenv("","https://testecobot.ru")
-geo = GeoProcessor(maps_dir=MAPS_DIR, domain=DOMAIN)
+# Карты рисуются в фоновых процессах; MAP_RENDER_ASYNC=false - синхронно в запросе, как раньше
+MAP_RENDER_ASYNC = os.getenv("MAP_RENDER_ASYNC", "true").lower() == "true"
+render_queue = MapRenderQueue(maps_dir=MAPS_DIR, domain=DOMAIN) if MAP_RENDER_ASYNC else None
+geo = GeoProcessor(maps_dir=MAPS_DIR, domain=DOMAIN, render_queue=render_queue)
 slot_val = Slot_validator()
 init_redis(host='localhost', port=6379, db=1, decode_responses=True)
 
@@ -61,6 +79,67 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 matplotlib_logger = logging.getLogger('matplotlib')
 matplotlib_logger.setLevel(logging.WARNING)
+
+SINGLE_FLIGHT_LOCK_TTL_MS = int(os.getenv("SINGLE_FLIGHT_LOCK_TTL_MS", "60000"))
+SINGLE_FLIGHT_WAIT_S = float(os.getenv("SINGLE_FLIGHT_WAIT_S", "30"))
+
+
+def single_flight(redis_key: str, debug_info: dict):
+    """
+    Объединение одинаковых запросов при промахе кеша.
+    Первый воркер берет лок и считает результат, остальные ждут его в кеше.
+    Если владелец лока упал или не уложился в таймаут, ожидающий считает сам.
+
+    Returns:
+        Tuple[bool, Optional[Any]]: (cache_hit, cached_data) как у get_cached_result
+    """
+    token = acquire_cache_lock(redis_key, SINGLE_FLIGHT_LOCK_TTL_MS)
+    if token:
+        g.setdefault("cache_locks", []).append((redis_key, token))
+        debug_info["single_flight"] = {"role": "leader"}
+        return False, None
+
+    wait_start = time.time()
+    cache_hit, cached_result = wait_for_cached_result(redis_key, timeout=SINGLE_FLIGHT_WAIT_S)
+    debug_info["single_flight"] = {
+        "role": "follower",
+        "waited_s": round(time.time() - wait_start, 3),
+        "hit": cache_hit
+    }
+    if cache_hit:
+        return True, cached_result
+
+    # Владелец не дал результата - пробуем стать новым владельцем, иначе считаем без лока
+    token = acquire_cache_lock(redis_key, SINGLE_FLIGHT_LOCK_TTL_MS)
+    if token:
+        g.setdefault("cache_locks", []).append((redis_key, token))
+    debug_info["single_flight"]["fallback"] = True
+    return False, None
+
+
+def cache_map_result(redis_key: str, map_result: dict, map_name: str, expire_time: int) -> None:
+    """
+    Кэширует ответ с картой и регистрирует ссылку на артефакт карты.
+    render_status не кэшируется - он устаревает, как только отрисовка завершится.
+    """
+    payload = {key: value for key, value in map_result.items() if key != "render_status"}
+    set_cached_result(redis_key, payload, expire_time=expire_time)
+    geo.artifacts.add_reference(map_name, redis_key, expire_time)
+
+
+def with_render_status(result):
+    """Заполняет render_status ответа с картой по текущему состоянию отрисовки"""
+    if isinstance(result, dict) and result.get("map_name") and result.get("status") == "ok":
+        result["render_status"] = geo.render_status(result["map_name"])
+    return result
+
+
+@app.teardown_request
+def release_single_flight_locks(exc):
+    """Освобождает локи single-flight, взятые за время запроса (в том числе при ошибке)"""
+    for redis_key, token in g.pop("cache_locks", []):
+        release_cache_lock(redis_key, token)
+
     
 @app.route("/objects_in_polygon_simply", methods=["POST"])
 def objects_in_polygon_simply():
@@ -74,6 +153,12 @@ def objects_in_polygon_simply():
     buffer_radius_km = data.get("buffer_radius_km", 0)
     object_type = data.get("object_type")
     limit = data.get("limit", 20)
+    # Упрощение геометрий ответа: допуск в метрах или зум карты, число знаков координат
+    try:
+        simplify_tolerance_m = resolve_tolerance_m(data.get("simplify_tolerance"), data.get("zoom"))
+        precision = parse_precision(data.get("precision"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Параметры для кеша
     cache_params = {
@@ -82,6 +167,8 @@ def objects_in_polygon_simply():
         "object_type": object_type,
         "limit": limit,
         "in_stoplist": in_stoplist,
+        "simplify_tolerance_m": simplify_tolerance_m,
+        "precision": precision,
         "version": "v2"
     }
     
@@ -97,7 +184,14 @@ def objects_in_polygon_simply():
     if cache_hit:
         if debug_mode:
             cached_result["debug"] = debug_info
-        return jsonify(cached_result)
+        return jsonify(with_render_status(cached_result))
+
+    # Одинаковые запросы при промахе кеша считает только один воркер
+    cache_hit, cached_result = single_flight(redis_key, debug_info)
+    if cache_hit:
+        if debug_mode:
+            cached_result["debug"] = debug_info
+        return jsonify(with_render_status(cached_result))
 
     # Debug информация о параметрах
     debug_info["parameters"] = {
@@ -170,40 +264,14 @@ def objects_in_polygon_simply():
             polygon_geojson=polygon,
             buffer_radius_km=float(buffer_radius_km),
             object_type=object_type,
-            limit=int(limit)
+            limit=int(limit),
+            in_stoplist=in_stoplist,
+            simplify_tolerance_m=simplify_tolerance_m,
+            precision=precision
         )
         objects = results.get("objects", [])
         answer = results.get("answer", "")
         
-        # ФИЛЬТРАЦИЯ ПО STOPLIST для найденных объектов
-        safe_objects = []
-        stoplisted_objects = []
-        
-        for obj in objects:
-            # Проверяем feature_data объектов на in_stoplist
-            feature_data = obj.get("features", {})
-            obj_in_stoplist = feature_data.get("in_stoplist")
-            
-            try:
-                requested_level = int(in_stoplist)
-                if obj_in_stoplist is None or int(obj_in_stoplist) <= requested_level:
-                    safe_objects.append(obj)
-                else:
-                    stoplisted_objects.append(obj)
-                    logger.info(f"Исключен объект с in_stoplist={obj_in_stoplist}: {obj.get('name', 'Без имени')}")
-            except (ValueError, TypeError):
-                if obj_in_stoplist is None or int(obj_in_stoplist) <= 1:
-                    safe_objects.append(obj)
-                else:
-                    stoplisted_objects.append(obj)
-                    logger.info(f"Исключен объект с in_stoplist={obj_in_stoplist}: {obj.get('name', 'Без имени')}")
-        
-        objects = safe_objects
-        
-        # Обновляем ответ с учетом фильтрации
-        if stoplisted_objects:
-            answer = f"{answer} (исключено {len(stoplisted_objects)} объектов по уровню безопасности)"
-        
         # Debug информация о результатах поиска
         debug_info["search_results"] = {
             "total_objects": len(objects),
@@ -211,11 +279,10 @@ def objects_in_polygon_simply():
             "polygon_area": "calculated" if polygon else "unknown"
         }
         
-        # Debug информация о фильтрации stoplist
+        # Объекты выше уровня in_stoplist отсекаются в SQL (entity_geometry.in_stoplist)
         debug_info["stoplist_filter"] = {
-            "total_before_filter": len(results.get("objects", [])),
-            "safe_after_filter": len(objects),
-            "stoplisted_count": len(stoplisted_objects)
+            "applied_in_sql": True,
+            "level": in_stoplist
         }
         
         # Статистика по типам объектов
@@ -276,6 +343,7 @@ def objects_in_polygon_simply():
         if geojson_key not in grouped_by_geojson:
             grouped_by_geojson[geojson_key] = {
                 'geojson': obj['geojson'],
+                'map_content_id': obj.get('map_content_id'),
                 'type': obj_type,  # Сохраняем тип первого объекта в группе
                 'names': []
             }
@@ -329,7 +397,8 @@ def objects_in_polygon_simply():
         objects_for_map.append({
             'tooltip': tooltip_text,
             'popup': popup_html,
-            'geojson': group_data['geojson']
+            'geojson': group_data['geojson'],
+            'map_content_id': group_data.get('map_content_id')
         })
 
     # В этом эндпоинте все найденные объекты должны быть used_objects,
@@ -337,9 +406,9 @@ def objects_in_polygon_simply():
     # not_used_objects оставляем пустым
 
     try:
-        # Создаем карту с именем из redis_key (кешированное имя)
-        map_name = redis_key.replace("cache:", "map_").replace(":", "_")
-        map_result = geo.draw_custom_geometries(objects_for_map, map_name)
+        # Имя карты - хэш содержимого: одинаковые наборы объектов дают один файл
+        map_name = artifact_name(objects_for_map)
+        map_result = geo.submit_custom_geometries(objects_for_map, map_name)
         
         map_result["count"] = len(objects_for_map)
         map_result["answer"] = answer
@@ -354,7 +423,6 @@ def objects_in_polygon_simply():
         # Добавляем информацию о фильтрации по stoplist
         map_result["in_stoplist_filter_applied"] = True
         map_result["in_stoplist_level"] = in_stoplist
-        map_result["stoplisted_count"] = len(stoplisted_objects) if 'stoplisted_objects' in locals() else 0
         
         # Добавляем debug информацию
         if debug_mode:
@@ -366,7 +434,7 @@ def objects_in_polygon_simply():
             map_result["debug"] = debug_info
 
         # Сохраняем в кеш (45 минут для поиска по полигону)
-        set_cached_result(redis_key, map_result, expire_time=2700)
+        cache_map_result(redis_key, map_result, map_name, 2700)
         
         return jsonify(map_result)
         
@@ -389,6 +457,12 @@ def objects_in_polygon_simply():
 def objects_in_area_by_type():
     data = request.get_json()
     debug_mode = request.args.get("debug_mode", "false").lower() == "true"
+    # Упрощение геометрий ответа: допуск в метрах или зум карты, число знаков координат
+    try:
+        simplify_tolerance_m = resolve_tolerance_m(data.get("simplify_tolerance"), data.get("zoom"))
+        precision = parse_precision(data.get("precision"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Параметры для кеша
     cache_params = {
@@ -399,6 +473,8 @@ def objects_in_area_by_type():
         "limit": data.get("limit", 20),
         "search_around": data.get("search_around", False),
         "buffer_radius_km": data.get("buffer_radius_km", 10.0),
+        "simplify_tolerance_m": simplify_tolerance_m,
+        "precision": precision,
         "version": "v2"
     }
     
@@ -414,7 +490,14 @@ def objects_in_area_by_type():
     if cache_hit:
         if debug_mode:
             cached_result["debug"] = debug_info
-        return jsonify(cached_result)
+        return jsonify(with_render_status(cached_result))
+
+    # Одинаковые запросы при промахе кеша считает только один воркер
+    cache_hit, cached_result = single_flight(redis_key, debug_info)
+    if cache_hit:
+        if debug_mode:
+            cached_result["debug"] = debug_info
+        return jsonify(with_render_status(cached_result))
 
     logger.info(f"📦 /objects_in_area_by_type - GET params: {dict(request.args)}")
     logger.info(f"📦 /objects_in_area_by_type - POST data: {request.get_json()}")
@@ -525,12 +608,13 @@ def objects_in_area_by_type():
                 objects_for_map.append({
                     'tooltip': name,
                     'popup': popup_html,
-                    'geojson': geojson
+                    'geojson': geojson,
+                    'map_content_id': obj.get('map_content_id')
                 })
             
-            # Создаем карту с именем из redis_key (кешированное имя)
-            map_name = redis_key.replace("cache:", "map_").replace(":", "_")
-            map_result = geo.draw_custom_geometries(objects_for_map, map_name)
+            # Имя карты - хэш содержимого: одинаковые наборы объектов дают один файл
+            map_name = artifact_name(objects_for_map)
+            map_result = geo.submit_custom_geometries(objects_for_map, map_name)
             
             # Подготавливаем детальную информацию с external_id (только в данных)
             detailed_objects = []
@@ -582,7 +666,7 @@ def objects_in_area_by_type():
                 map_result["debug"] = debug_info
 
             # Сохраняем в кеш (30 минут для прямого поиска)
-            set_cached_result(redis_key, map_result, expire_time=1800)
+            cache_map_result(redis_key, map_result, map_name, 1800)
             
             return jsonify(map_result)
             
@@ -648,7 +732,9 @@ def objects_in_area_by_type():
             object_name=object_name,
             limit=int(limit),
             search_around=search_around,
-            buffer_radius_km=float(buffer_radius_km)
+            buffer_radius_km=float(buffer_radius_km),
+            simplify_tolerance_m=simplify_tolerance_m,
+            precision=precision
         )
         
         objects = results.get("objects", [])
@@ -736,12 +822,13 @@ def objects_in_area_by_type():
             objects_for_map.append({
                 'tooltip': name,
                 'popup': popup_html,
-                'geojson': geojson
+                'geojson': geojson,
+                'map_content_id': obj.get('map_content_id')
             })
         
-        # Создаем карту с именем из redis_key (кешированное имя)
-        map_name = redis_key.replace("cache:", "map_").replace(":", "_")
-        map_result = geo.draw_custom_geometries(objects_for_map, map_name)
+        # Имя карты - хэш содержимого: одинаковые наборы объектов дают один файл
+        map_name = artifact_name(objects_for_map)
+        map_result = geo.submit_custom_geometries(objects_for_map, map_name)
         
         # Подготавливаем детальную информацию об объектах
         detailed_objects = []
@@ -805,7 +892,7 @@ def objects_in_area_by_type():
             map_result["debug"] = debug_info
 
         # Сохраняем в кеш (1 час для поиска по области)
-        set_cached_result(redis_key, map_result, expire_time=3600)
+        cache_map_result(redis_key, map_result, map_name, 3600)
         
         return jsonify(map_result)
         
@@ -879,44 +966,15 @@ def search_images_by_features():
         }
         
         if species_name:
+            # Изображения выше уровня in_stoplist отсекаются в SQL
             result = search_service.search_images_by_features(
                 species_name=species_name,
-                features=features
+                features=features,
+                in_stoplist=in_stoplist
             )
-            
-            # ФИЛЬТРАЦИЯ ПО STOPLIST для изображений
-            if result.get("status") == "success" and "images" in result:
-                safe_images = []
-                stoplisted_images = []
-                
-                for image in result["images"]:
-                    feature_data = image.get("features", {})
-                    image_in_stoplist = feature_data.get("in_stoplist")
-                    
-                    # Проверяем уровень безопасности
-                    try:
-                        requested_level = int(in_stoplist)
-                        if image_in_stoplist is None or int(image_in_stoplist) <= requested_level:
-                            safe_images.append(image)
-                        else:
-                            stoplisted_images.append(image)
-                            logger.info(f"Исключено изображение с in_stoplist={image_in_stoplist}: {image.get('title', 'Без названия')}")
-                    except (ValueError, TypeError):
-                        # Если ошибка преобразования, используем уровень по умолчанию (1)
-                        if image_in_stoplist is None or int(image_in_stoplist) <= 1:
-                            safe_images.append(image)
-                        else:
-                            stoplisted_images.append(image)
-                            logger.info(f"Исключено изображение с in_stoplist={image_in_stoplist}: {image.get('title', 'Без названия')}")
-                
-                # Обновляем результат с безопасными изображениями
-                result["images"] = safe_images
-                result["count"] = len(safe_images)
-                
-                # Добавляем информацию о фильтрации
+            if result.get("status") == "success":
                 result["in_stoplist_filter_applied"] = True
                 result["in_stoplist_level"] = in_stoplist
-                result["stoplisted_count"] = len(stoplisted_images)
             
             # ============================================================================
             # ФОРМИРОВАНИЕ used_objects И not_used_objects ДЛЯ ПОИСКА ПО ВИДУ
@@ -945,9 +1003,9 @@ def search_images_by_features():
                     "feature_conditions": list(features.keys())
                 }
                 debug_info["stoplist_filter"] = {
-                    "total_before_filter": len(result.get("images", [])),
-                    "safe_after_filter": len(safe_images) if species_name else "N/A",
-                    "stoplisted_count": len(stoplisted_images) if species_name else "N/A"
+                    "applied_in_sql": True,
+                    "level": in_stoplist,
+                    "images_count": len(result.get("images", []))
                 }
                 result["debug"] = debug_info
                 
@@ -961,37 +1019,12 @@ def search_images_by_features():
         else:
             # Поиск только по признакам (без указания вида)
             result = search_service.relational_service.search_images_by_features_only(
-                features=features
+                features=features,
+                in_stoplist=in_stoplist
             )
-            
-            # ФИЛЬТРАЦИЯ ПО STOPLIST для изображений (только по признакам)
-            if result.get("status") == "success" and "images" in result:
-                safe_images = []
-                stoplisted_images = []
-                
-                for image in result["images"]:
-                    feature_data = image.get("features", {})
-                    image_in_stoplist = feature_data.get("in_stoplist")
-                    
-                    try:
-                        requested_level = int(in_stoplist)
-                        if image_in_stoplist is None or int(image_in_stoplist) <= requested_level:
-                            safe_images.append(image)
-                        else:
-                            stoplisted_images.append(image)
-                            logger.info(f"Исключено изображение с in_stoplist={image_in_stoplist}: {image.get('title', 'Без названия')}")
-                    except (ValueError, TypeError):
-                        if image_in_stoplist is None or int(image_in_stoplist) <= 1:
-                            safe_images.append(image)
-                        else:
-                            stoplisted_images.append(image)
-                            logger.info(f"Исключено изображение с in_stoplist={image_in_stoplist}: {image.get('title', 'Без названия')}")
-                
-                result["images"] = safe_images
-                result["count"] = len(safe_images)
+            if result.get("status") == "success":
                 result["in_stoplist_filter_applied"] = True
                 result["in_stoplist_level"] = in_stoplist
-                result["stoplisted_count"] = len(stoplisted_images)
             
             # ============================================================================
             # ФОРМИРОВАНИЕ used_objects И not_used_objects ДЛЯ ПОИСКА ТОЛЬКО ПО ПРИЗНАКАМ
@@ -1026,9 +1059,9 @@ def search_images_by_features():
                     "feature_conditions": list(features.keys())
                 }
                 debug_info["stoplist_filter"] = {
-                    "total_before_filter": len(result.get("images", [])),
-                    "safe_after_filter": len(safe_images),
-                    "stoplisted_count": len(stoplisted_images)
+                    "applied_in_sql": True,
+                    "level": in_stoplist,
+                    "images_count": len(result.get("images", []))
                 }
                 result["debug"] = debug_info
                 
@@ -1052,8 +1085,20 @@ def search_images_by_features():
             error_response["debug"] = debug_info
         return jsonify(error_response), 500
     
+def sse_event(event: str, data: dict) -> str:
+    """Событие Server-Sent Events с JSON в data"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
 @app.route("/object/description/", methods=["GET", "POST"])
+@app.route("/object/description/stream", methods=["GET", "POST"])
 def get_object_description():
+    """
+    Описание объекта. Вариант /object/description/stream всегда генерирует ответ GigaChat
+    и отдает его потоком Server-Sent Events: сначала событие context (источники,
+    used_objects и т.д.), затем token по мере генерации, при отказе модели - fallback
+    с безопасными описаниями и в конце done. Ошибки до генерации - обычный JSON.
+    """
     # Обработка GET параметров
     logger.info(f"📦 /object/description - GET params: {dict(request.args)}")
     logger.info(f"📦 /object/description - POST data: {request.get_json()}")
@@ -1062,6 +1107,7 @@ def get_object_description():
     query = request.args.get("query")
     limit = int(request.args.get("limit", 0))
     similarity_threshold = float(request.args.get("similarity_threshold", 0.35))
+    ef_search = request.args.get("ef_search", type=int)
     include_similarity = request.args.get("include_similarity", "false").lower() == "true"
     use_gigachat_filter = request.args.get("use_gigachat_filter", "false").lower() == "true"
     use_gigachat_answer = request.args.get("use_gigachat_answer", "false").lower() == "true"
@@ -1069,6 +1115,9 @@ def get_object_description():
     object_type = request.args.get("object_type", "all")
     save_prompt = request.args.get("save_prompt", "false").lower() == "true"
     in_stoplist = request.args.get("in_stoplist", "1")
+    stream_answer = request.path.rstrip("/").endswith("/stream")
+    if stream_answer:
+        use_gigachat_answer = True
 
     # Обработка POST body
     filter_data = None
@@ -1084,21 +1133,33 @@ def get_object_description():
             "query": query,
             "limit": limit,
             "similarity_threshold": similarity_threshold,
+            "ef_search": ef_search,
             "include_similarity": include_similarity,
             "use_gigachat_filter": use_gigachat_filter,
             "use_gigachat_answer": use_gigachat_answer,
             "filter_data": filter_data,
             "save_prompt": save_prompt,
-            "in_stoplist": in_stoplist
+            "in_stoplist": in_stoplist,
+            "stream": stream_answer
         },
         "timestamp": time.time(),
-        "steps": []
+        "steps": [],
+        "stage_timings_ms": {}
     }
 
+    # Этапы запроса выполняются с общим дедлайном, время этапов - в debug_info
+    pipeline = RequestPipeline(timings=debug_info["stage_timings_ms"])
+
+    # Эмбеддинг запроса не зависит от разрешения синонимов - считаем параллельно
+    embedding_future = None
+    if query and not filter_data:
+        embedding_future = pipeline.submit("embedding", search_service.embedding_model.embed_query, query)
+
     # РАЗРЕШЕНИЕ СИНОНИМОВ ОБЪЕКТОВ
     resolved_object_info = None
     if object_name:
-        resolved_object_info = search_service.resolve_object_synonym(object_name, object_type)
+        with pipeline.stage("synonym_resolution"):
+            resolved_object_info = search_service.resolve_object_synonym(object_name, object_type)
         
         debug_info["synonym_resolution"] = {
             "original_name": object_name,
@@ -1210,13 +1271,88 @@ def get_object_description():
         
         return f"Описание {index}"
 
+    def format_descriptions(descs):
+        """Описания в формате ответа: заголовок, external_id, по убыванию similarity"""
+        formatted_descriptions = []
+        for i, desc in enumerate(descs, 1):
+            if isinstance(desc, dict):
+                content = desc.get("content", "")
+                similarity = desc.get("similarity")
+                source = desc.get("source", "unknown")
+                
+                # ИЗВЛЕКАЕМ EXTERNAL_ID (только для данных)
+                external_id = extract_external_id(desc)
+                
+                # ИСПОЛЬЗУЕМ ПРАВИЛЬНУЮ ФУНКЦИЮ ДЛЯ ЗАГОЛОВКА
+                title = get_proper_title(desc, object_name, i)
+                
+                formatted_desc = {
+                    "id": i,
+                    "title": title,  # ПРАВИЛЬНЫЙ ЗАГОЛОВОК
+                    "content": content,
+                    "source": source,
+                    "feature_data": desc.get("feature_data", {}),
+                    "structured_data": desc.get("structured_data", {})
+                }
+                
+                # ДОБАВЛЯЕМ EXTERNAL_ID В ДАННЫЕ
+                if external_id:
+                    formatted_desc["external_id"] = external_id
+                
+                if similarity is not None:
+                    formatted_desc["similarity"] = round(similarity, 4)
+                    
+                formatted_descriptions.append(formatted_desc)
+            else:
+                formatted_descriptions.append({
+                    "id": i,
+                    "title": get_proper_title(None, object_name, i),  # ЗАГОЛОВОК ПО УМОЛЧАНИЮ
+                    "content": desc,
+                    "source": "content"
+                })
+
+        # Сортируем по similarity если есть
+        if all('similarity' in desc for desc in formatted_descriptions):
+            formatted_descriptions.sort(key=lambda x: x.get('similarity', 0), reverse=True)
+        return formatted_descriptions
+
+    def summarize_sources(context_descriptions):
+        """Список external_id и краткая информация об описаниях из контекста GigaChat"""
+        external_ids = []
+        source_descriptions_summary = []
+
+        for desc in context_descriptions:
+            if isinstance(desc, dict):
+                # ИЗВЛЕКАЕМ EXTERNAL_ID
+                external_id = extract_external_id(desc)
+                
+                # ИСПОЛЬЗУЕМ ПРАВИЛЬНУЮ ФУНКЦИЮ ДЛЯ ЗАГОЛОВКА
+                title = get_proper_title(desc, object_name, len(source_descriptions_summary) + 1)
+                
+                desc_summary = {
+                    "title": title,  # ПРАВИЛЬНЫЙ ЗАГОЛОВОК
+                    "content_preview": desc.get("content", "")[:200] + "..." if len(desc.get("content", "")) > 200 else desc.get("content", ""),
+                    "source": desc.get("source", "unknown"),
+                    "similarity": round(desc.get("similarity", 0), 4) if desc.get("similarity") else None
+                }
+                
+                if external_id:
+                    desc_summary["external_id"] = external_id
+                    if external_id not in external_ids:
+                        external_ids.append(external_id)
+                        
+                source_descriptions_summary.append(desc_summary)
+        return external_ids, source_descriptions_summary
+
     try:
         # Определяем лимиты для разных случаев
         search_limit = limit if limit > 0 else 100
         context_limit = 5
         
         if filter_data:
-            descriptions = search_service.get_object_descriptions_by_filters(
+            descriptions = pipeline.run(
+                "db_search",
+                search_service.get_object_descriptions_by_filters,
                 filter_data=filter_data,
                 object_type=object_type,
                 limit=search_limit,
@@ -1226,7 +1362,7 @@ def get_object_description():
             search_method = "filter_search"
             
         elif query:
-            embedding = search_service.embedding_model.embed_query(query)
+            embedding = pipeline.result(embedding_future)
             
             if not isinstance(embedding, list):
                 logger.error(f"Embedding должен быть списком, получен: {type(embedding)}")
@@ -1237,27 +1373,40 @@ def get_object_description():
                 return jsonify({"error": "Internal embedding error"}), 500
                 
             if object_name:
-                descriptions = search_service.get_object_descriptions_with_embedding(
+                descriptions = pipeline.run(
+                    "db_search",
+                    search_service.get_object_descriptions_with_embedding,
                     object_name=object_name,
                     object_type=object_type,
                     query_embedding=embedding,
                     limit=search_limit,
                     similarity_threshold=similarity_threshold,
-                    in_stoplist=in_stoplist
+                    in_stoplist=in_stoplist,
+                    ef_search=ef_search
                 )
                 search_method = "object_with_embedding"
             else:
-                descriptions = search_service.search_objects_by_embedding(
+                grouped = pipeline.run(
+                    "db_search",
+                    search_service.search_objects_by_embedding_grouped,
                     query_embedding=embedding,
                     object_type=object_type,
                     limit=search_limit,
                     similarity_threshold=similarity_threshold,
-                    in_stoplist=in_stoplist
+                    in_stoplist=in_stoplist,
+                    ef_search=ef_search
                 )
+                descriptions = grouped["results"]
+                if debug_mode:
+                    debug_info["results_by_type"] = {
+                        entity_type: len(items) for entity_type, items in grouped["by_type"].items()
+                    }
                 search_method = "semantic_search"
                 
         else:
-            descriptions_text = search_service.get_object_descriptions(
+            descriptions_text = pipeline.run(
+                "db_search",
+                search_service.get_object_descriptions,
                 object_name, 
                 object_type,
                 in_stoplist=in_stoplist
@@ -1350,10 +1499,20 @@ def get_object_description():
                     "filter_query": filter_query
                 }
             
-            filtered_descriptions = search_service.filter_text_descriptions_with_gigachat(
-                filter_query, 
-                descriptions
-            )
+            try:
+                filtered_descriptions = pipeline.run(
+                    "gigachat_filter",
+                    search_service.filter_text_descriptions_with_gigachat,
+                    filter_query,
+                    descriptions,
+                    # Досрочный выход фильтрации частями, когда релевантных набралось на limit ответа
+                    limit=limit or None
+                )
+            except DeadlineExceeded:
+                # Фильтрация не уложилась в дедлайн - продолжаем с нефильтрованными описаниями
+                logger.warning("⏱️ Фильтрация GigaChat не уложилась в дедлайн, описания не фильтруются")
+                filtered_descriptions = descriptions
+                debug_info["gigachat_filter_deadline_exceeded"] = True
             
             if debug_mode:
                 debug_info["after_gigachat_filter"] = {
@@ -1489,10 +1648,99 @@ def get_object_description():
                     logger.info(f"✅ Полный промпт сохранен в: {prompt_filename}")
                 except Exception as e:
                     logger.error(f"❌ Ошибка сохранения промпта: {e}")
+
+            # Потоковый ответ: контекст отправляется сразу после поиска, затем токены GigaChat
+            if stream_answer:
+                external_ids, source_descriptions_summary = summarize_sources(context_descriptions)
+                context_event = {
+                    "external_ids": external_ids,
+                    "source_descriptions": source_descriptions_summary,
+                    "context_used": {
+                        "descriptions_count": len(context_descriptions),
+                        "total_descriptions": total_count,
+                        "blacklisted_excluded": len(blacklisted_descriptions),
+                        "external_ids_count": len(external_ids)
+                    },
+                    "query": query,
+                    "object_name": object_name if object_name else "semantic_search",
+                    "object_type": object_type,
+                    "in_stoplist_level": in_stoplist,
+                    "used_objects": used_objects,
+                    "not_used_objects": not_used_objects
+                }
+                if resolved_object_info and resolved_object_info.get("resolved", False):
+                    context_event["synonym_resolution"] = {
+                        "original_name": resolved_object_info["original_name"],
+                        "resolved_name": object_name,
+                        "original_type": resolved_object_info.get("original_type", object_type)
+                    }
+
+                def generate():
+                    yield sse_event("context", context_event)
+
+                    started = time.perf_counter()
+                    first_token_ms = None
+                    gigachat_result = None
+                    # Дедлайн соблюдается при ожидании каждого фрагмента (finish_reason "deadline")
+                    events = search_service.stream_gigachat_answer(query, context, remaining=pipeline.remaining)
+                    try:
+                        for event in events:
+                            if event["type"] == "token":
+                                if first_token_ms is None:
+                                    first_token_ms = round((time.perf_counter() - started) * 1000, 1)
+                                yield sse_event("token", {"content": event["content"]})
+                            else:
+                                gigachat_result = event
+                    finally:
+                        events.close()
+
+                    gigachat_result = gigachat_result or {"success": False, "finish_reason": "error"}
+                    is_blacklist = gigachat_result.get("finish_reason") == "blacklist" or not gigachat_result.get("success", True)
+                    if is_blacklist:
+                        # Как в обычном ответе: отказ модели - возвращаем безопасные описания
+                        formatted_descriptions = format_descriptions(descriptions_for_context)
+                        yield sse_event("fallback", {
+                            "count": len(formatted_descriptions),
+                            "descriptions": formatted_descriptions,
+                            "gigachat_restricted": True,
+                            "message": "GigaChat не смог сгенерировать ответ, поэтому возвращены исходные безопасные описания"
+                        })
+
+                    done_event = {
+                        "finish_reason": gigachat_result.get("finish_reason"),
+                        "gigachat_restricted": is_blacklist
+                    }
+                    if debug_mode:
+                        debug_info["gigachat_generation"] = {
+                            "response_length": len(gigachat_result.get("content", "")),
+                            "finish_reason": gigachat_result.get("finish_reason"),
+                            "blacklist_detected": is_blacklist,
+                            "first_token_ms": first_token_ms,
+                            "generation_ms": round((time.perf_counter() - started) * 1000, 1),
+                            "prompt_saved": save_prompt
+                        }
+                        done_event["debug"] = debug_info
+                    yield sse_event("done", done_event)
+
+                response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+                response.headers["Cache-Control"] = "no-cache"
+                # nginx не должен буферизовать поток
+                response.headers["X-Accel-Buffering"] = "no"
+                return response
             
             # Генерируем ответ с помощью GigaChat
             try:
-                gigachat_result = search_service._generate_gigachat_answer(query, context)
+                try:
+                    gigachat_result = pipeline.run(
+                        "gigachat_answer",
+                        search_service._generate_gigachat_answer,
+                        query,
+                        context
+                    )
+                except DeadlineExceeded:
+                    # Ответ не уложился в дедлайн - отдаем безопасные описания, как при blacklist
+                    logger.warning("⏱️ Генерация ответа GigaChat не уложилась в дедлайн")
+                    gigachat_result = {"success": False, "finish_reason": "deadline"}
                 
                 # Проверяем, был ли ответ заблокирован
                 is_blacklist = gigachat_result.get("finish_reason") == "blacklist" or not gigachat_result.get("success", True)
@@ -1502,47 +1750,7 @@ def get_object_description():
                     logger.info("🚫 GigaChat вернул blacklist, возвращаем форматированные безопасные описания")
                     
                     # Форматируем безопасные описания с ПРАВИЛЬНЫМИ ЗАГОЛОВКАМИ
-                    formatted_descriptions = []
-                    for i, desc in enumerate(descriptions_for_context, 1):
-                        if isinstance(desc, dict):
-                            content = desc.get("content", "")
-                            similarity = desc.get("similarity")
-                            source = desc.get("source", "unknown")
-                            
-                            # ИЗВЛЕКАЕМ EXTERNAL_ID (только для данных)
-                            external_id = extract_external_id(desc)
-                            
-                            # ИСПОЛЬЗУЕМ ПРАВИЛЬНУЮ ФУНКЦИЮ ДЛЯ ЗАГОЛОВКА
-                            title = get_proper_title(desc, object_name, i)
-                            
-                            formatted_desc = {
-                                "id": i,
-                                "title": title,  # ПРАВИЛЬНЫЙ ЗАГОЛОВОК
-                                "content": content,
-                                "source": source,
-                                "feature_data": desc.get("feature_data", {}),
-                                "structured_data": desc.get("structured_data", {})
-                            }
-                            
-                            # ДОБАВЛЯЕМ EXTERNAL_ID В ДАННЫЕ
-                            if external_id:
-                                formatted_desc["external_id"] = external_id
-                            
-                            if similarity is not None:
-                                formatted_desc["similarity"] = round(similarity, 4)
-                                
-                            formatted_descriptions.append(formatted_desc)
-                        else:
-                            formatted_descriptions.append({
-                                "id": i,
-                                "title": get_proper_title(None, object_name, i),  # ЗАГОЛОВОК ПО УМОЛЧАНИЮ
-                                "content": desc,
-                                "source": "content"
-                            })
-
-                    # Сортируем по similarity если есть
-                    if all('similarity' in desc for desc in formatted_descriptions):
-                        formatted_descriptions.sort(key=lambda x: x.get('similarity', 0), reverse=True)
+                    formatted_descriptions = format_descriptions(descriptions_for_context)
 
                     response_data = {
                         "count": len(formatted_descriptions),
@@ -1591,30 +1799,7 @@ def get_object_description():
                 gigachat_response = gigachat_result.get("content", "")
 
                 # СОБИРАЕМ EXTERNAL_ID ИЗ КОНТЕКСТНЫХ ОПИСАНИЙ
-                external_ids = []
-                source_descriptions_summary = []
-
-                for desc in context_descriptions:
-                    if isinstance(desc, dict):
-                        # ИЗВЛЕКАЕМ EXTERNAL_ID
-                        external_id = extract_external_id(desc)
-                        
-                        # ИСПОЛЬЗУЕМ ПРАВИЛЬНУЮ ФУНКЦИЮ ДЛЯ ЗАГОЛОВКА
-                        title = get_proper_title(desc, object_name, len(source_descriptions_summary) + 1)
-                        
-                        desc_summary = {
-                            "title": title,  # ПРАВИЛЬНЫЙ ЗАГОЛОВОК
-                            "content_preview": desc.get("content", "")[:200] + "..." if len(desc.get("content", "")) > 200 else desc.get("content", ""),
-                            "source": desc.get("source", "unknown"),
-                            "similarity": round(desc.get("similarity", 0), 4) if desc.get("similarity") else None
-                        }
-                        
-                        if external_id:
-                            desc_summary["external_id"] = external_id
-                            if external_id not in external_ids:
-                                external_ids.append(external_id)
-                                
-                        source_descriptions_summary.append(desc_summary)
+                external_ids, source_descriptions_summary = summarize_sources(context_descriptions)
 
                 response_data = {
                     "gigachat_answer": gigachat_response,
@@ -1688,47 +1873,7 @@ def get_object_description():
             return jsonify(response), 404
 
         # Форматируем описания с ПРАВИЛЬНЫМИ ЗАГОЛОВКАМИ
-        formatted_descriptions = []
-        for i, desc in enumerate(descriptions, 1):
-            if isinstance(desc, dict):
-                content = desc.get("content", "")
-                similarity = desc.get("similarity")
-                source = desc.get("source", "unknown")
-                
-                # ИЗВЛЕКАЕМ EXTERNAL_ID (только для данных)
-                external_id = extract_external_id(desc)
-                
-                # ИСПОЛЬЗУЕМ ПРАВИЛЬНУЮ ФУНКЦИЮ ДЛЯ ЗАГОЛОВКА
-                title = get_proper_title(desc, object_name, i)
-                
-                formatted_desc = {
-                    "id": i,
-                    "title": title,  # ПРАВИЛЬНЫЙ ЗАГОЛОВОК
-                    "content": content,
-                    "source": source,
-                    "feature_data": desc.get("feature_data", {}),
-                    "structured_data": desc.get("structured_data", {})
-                }
-                
-                # ДОБАВЛЯЕМ EXTERNAL_ID В ДАННЫЕ
-                if external_id:
-                    formatted_desc["external_id"] = external_id
-                
-                if similarity is not None:
-                    formatted_desc["similarity"] = round(similarity, 4)
-                    
-                formatted_descriptions.append(formatted_desc)
-            else:
-                formatted_descriptions.append({
-                    "id": i,
-                    "title": get_proper_title(None, object_name, i),  # ЗАГОЛОВОК ПО УМОЛЧАНИЮ
-                    "content": desc,
-                    "source": "content"
-                })
-
-        # Сортируем по similarity если есть
-        if all('similarity' in desc for desc in formatted_descriptions):
-            formatted_descriptions.sort(key=lambda x: x.get('similarity', 0), reverse=True)
+        formatted_descriptions = format_descriptions(descriptions)
 
         response_data = {
             "count": len(formatted_descriptions),
@@ -1767,6 +1912,14 @@ def get_object_description():
 
         return jsonify(response_data)
         
+    except DeadlineExceeded as e:
+        logger.error(f"Превышен дедлайн получения описания: {str(e)}")
+        error_response = {"error": "Превышено время обработки запроса"}
+        if debug_mode:
+            debug_info["error"] = str(e)
+            error_response["debug"] = debug_info
+        return jsonify(error_response), 504
+
     except Exception as e:
         logger.error(f"Ошибка получения описания: {str(e)}", exc_info=True)
         error_response = {"error": "Внутренняя ошибка сервера"}
@@ -1781,6 +1934,7 @@ def get_species_description():
     query = request.args.get("query")
     limit = int(request.args.get("limit", 5))
     similarity_threshold = float(request.args.get("similarity_threshold", 0.1))
+    ef_search = request.args.get("ef_search", type=int)
     include_similarity = request.args.get("include_similarity", "false").lower() == "true"
     use_gigachat_filter = request.args.get("use_gigachat_filter", "false").lower() == "true"
     debug_mode = request.args.get("debug_mode", "false").lower() == "true"
@@ -1801,16 +1955,21 @@ def get_species_description():
             "query": query,
             "limit": limit,
             "similarity_threshold": similarity_threshold,
+            "ef_search": ef_search,
             "include_similarity": include_similarity,
             "use_gigachat_filter": use_gigachat_filter,
             "in_stoplist": in_stoplist
         },
-        "timestamp": time.time()
+        "timestamp": time.time(),
+        "stage_timings_ms": {}
     }
 
+    # Этапы запроса выполняются с общим дедлайном, время этапов - в debug_info
+    pipeline = RequestPipeline(timings=debug_info["stage_timings_ms"])
+
     try:
         if query:
-            embedding = search_service.embedding_model.embed_query(query)
+            embedding = pipeline.run("embedding", search_service.embedding_model.embed_query, query)
             
             if not isinstance(embedding, list):
                 logger.error(f"Embedding должен быть списком, получен: {type(embedding)}")
@@ -1837,12 +1996,15 @@ def get_species_description():
             logger.info(f"   - limit: {limit}")
             
             # ИСПРАВЛЕНИЕ: Используем relational_service вместо search_service
-            descriptions = search_service.relational_service.get_text_descriptions_with_embedding(
+            descriptions = pipeline.run(
+                "db_search",
+                search_service.relational_service.get_text_descriptions_with_embedding,
                 species_name=species_name,
                 query_embedding=embedding,
                 limit=limit,
                 similarity_threshold=similarity_threshold,
-                in_stoplist=in_stoplist
+                in_stoplist=in_stoplist,
+                ef_search=ef_search
             )
             
             # ДЕТАЛЬНОЕ ЛОГИРОВАНИЕ РЕЗУЛЬТАТОВ
@@ -1872,7 +2034,9 @@ def get_species_description():
             
         else:
             # ИСПРАВЛЕНИЕ: Используем search_service.get_text_descriptions
-            descriptions = search_service.get_text_descriptions(species_name, in_stoplist=in_stoplist)
+            descriptions = pipeline.run(
+                "db_search", search_service.get_text_descriptions, species_name, in_stoplist=in_stoplist
+            )
             
             # Debug информация
             if debug_mode:
@@ -1972,10 +2136,20 @@ def get_species_description():
                     "filter_query": filter_query
                 }
             
-            filtered_descriptions = search_service.filter_text_descriptions_with_gigachat(
-                filter_query, 
-                descriptions
-            )
+            try:
+                filtered_descriptions = pipeline.run(
+                    "gigachat_filter",
+                    search_service.filter_text_descriptions_with_gigachat,
+                    filter_query,
+                    descriptions,
+                    # Лимит применяется только к поиску по эмбеддингу
+                    limit=limit if query else None
+                )
+            except DeadlineExceeded:
+                # Фильтрация не уложилась в дедлайн - продолжаем с нефильтрованными описаниями
+                logger.warning("⏱️ Фильтрация GigaChat не уложилась в дедлайн, описания не фильтруются")
+                filtered_descriptions = descriptions
+                debug_info["gigachat_filter_deadline_exceeded"] = True
             
             # Debug информация после фильтрации
             if debug_mode:
@@ -2046,6 +2220,18 @@ def get_species_description():
         logger.info(f"✅ УСПЕШНЫЙ ОТВЕТ для '{species_name}': {len(descriptions)} описаний")
         return jsonify(response_data)
         
+    except DeadlineExceeded as e:
+        logger.error(f"Превышен дедлайн получения описания для '{species_name}': {str(e)}")
+        error_response = {
+            "error": "Превышено время обработки запроса",
+            "used_objects": [],
+            "not_used_objects": []
+        }
+        if debug_mode:
+            debug_info["error"] = str(e)
+            error_response["debug"] = debug_info
+        return jsonify(error_response), 504
+
     except Exception as e:
         logger.error(f"Ошибка получения описания для '{species_name}': {str(e)}", exc_info=True)
         error_response = {
@@ -2107,6 +2293,9 @@ def api_coords_to_map():
     radius = data.get("radius_km", 30)
     object_type = data.get("object_type")
     species_name = data.get("species_name")
+    limit = data.get("limit", 20)
+    # Курсор следующей страницы (более дальние объекты) из next_cursor прошлого ответа
+    cursor = data.get("cursor")
     debug_mode = request.args.get("debug_mode", "false").lower() == "true"
     in_stoplist_param = request.args.get("in_stoplist", "1")
     try:
@@ -2125,7 +2314,9 @@ def api_coords_to_map():
         "object_type": object_type,
         "species_name": species_name,
         "in_stoplist": in_stoplist,
-        "version": "v2"
+        "limit": limit,
+        "cursor": cursor,
+        "version": "v3"
     }
     
     redis_key = f"cache:coords_search:{generate_cache_key(cache_params)}"
@@ -2141,7 +2332,14 @@ def api_coords_to_map():
     if cache_hit:
         if debug_mode:
             cached_result["debug"] = debug_info
-        return jsonify(cached_result)
+        return jsonify(with_render_status(cached_result))
+
+    # Одинаковые запросы при промахе кеша считает только один воркер
+    cache_hit, cached_result = single_flight(redis_key, debug_info)
+    if cache_hit:
+        if debug_mode:
+            cached_result["debug"] = debug_info
+        return jsonify(with_render_status(cached_result))
 
     logger.debug(f"""Параметры:{data}""")
     if not lat or not lon:
@@ -2155,6 +2353,20 @@ def api_coords_to_map():
             response["debug"] = debug_info
         return jsonify(response), 400
 
+    if cursor:
+        try:
+            decode_nearby_cursor(cursor)
+        except ValueError as e:
+            response = {
+                "status": "error",
+                "message": str(e),
+                "used_objects": [],
+                "not_used_objects": []
+            }
+            if debug_mode:
+                response["debug"] = debug_info
+            return jsonify(response), 400
+
     # Initialize t3 in case visualization fails
     t3 = time.perf_counter()
     
@@ -2166,11 +2378,14 @@ def api_coords_to_map():
             radius_km=float(radius),
             object_type=object_type,
             species_name=species_name,
-            in_stoplist=in_stoplist
+            in_stoplist=in_stoplist,
+            limit=int(limit),
+            cursor=cursor
         )
         t2 = time.perf_counter()
         objects = result.get("objects", [])
         answer = result.get("answer", "")
+        next_cursor = result.get("next_cursor")
         
         # Debug информация
         debug_info["search_time"] = round(t2 - t1, 3)
@@ -2180,7 +2395,9 @@ def api_coords_to_map():
             "radius_km": radius,
             "object_type": object_type,
             "species_name": species_name,
-            "in_stoplist": in_stoplist
+            "in_stoplist": in_stoplist,
+            "limit": limit,
+            "cursor": cursor
         }
         debug_info["objects_count"] = len(objects)
         debug_info["search_query_details"] = result.get("debug_info", {})
@@ -2196,54 +2413,11 @@ def api_coords_to_map():
                 response["debug"] = debug_info
             return jsonify(response)
 
-        # ФИЛЬТРАЦИЯ ПО STOPLIST для найденных объектов
-        safe_objects = []
-        stoplisted_objects = []
-        
-        for obj in objects:
-            # Проверяем feature_data объектов на in_stoplist
-            feature_data = obj.get("features", {})
-            obj_in_stoplist = feature_data.get("in_stoplist")
-            
-            try:
-                requested_level = int(in_stoplist)
-                if obj_in_stoplist is None or int(obj_in_stoplist) <= requested_level:
-                    safe_objects.append(obj)
-                else:
-                    stoplisted_objects.append(obj)
-                    logger.info(f"Исключен объект с in_stoplist={obj_in_stoplist}: {obj.get('name', 'Без имени')}")
-            except (ValueError, TypeError):
-                if obj_in_stoplist is None or int(obj_in_stoplist) <= 1:
-                    safe_objects.append(obj)
-                else:
-                    stoplisted_objects.append(obj)
-                    logger.info(f"Исключен объект с in_stoplist={obj_in_stoplist}: {obj.get('name', 'Без имени')}")
-        
-        objects = safe_objects
-        
-        # Обновляем ответ с учетом фильтрации
-        if stoplisted_objects:
-            answer = f"{answer} (исключено {len(stoplisted_objects)} объектов по уровню безопасности)"
-        
-        # Debug информация о фильтрации stoplist
+        # Объекты выше уровня in_stoplist отсекаются в SQL (entity_geometry.in_stoplist)
         debug_info["stoplist_filter"] = {
-            "total_before_filter": len(result.get("objects", [])),
-            "safe_after_filter": len(objects),
-            "stoplisted_count": len(stoplisted_objects)
+            "applied_in_sql": True,
+            "level": in_stoplist
         }
-        
-        if not objects:
-            response = {
-                "status": "no_objects", 
-                "message": answer,
-                "used_objects": [],
-                "not_used_objects": []
-            }
-            if debug_mode:
-                response["debug"] = debug_info
-                response["in_stoplist_filter_applied"] = True
-                response["in_stoplist_level"] = in_stoplist
-            return jsonify(response)
 
         # Filter out invalid geometries before visualization
         valid_objects = []
@@ -2351,13 +2525,14 @@ def api_coords_to_map():
 
         # 2. Визуализируем только валидные объекты
         try:
-            # Создаем карту с именем из redis_key (кешированное имя)
-            map_name = redis_key.replace("cache:", "map_").replace(":", "_")
-            map_result = geo.draw_custom_geometries(valid_objects, map_name)
+            # Имя карты - хэш содержимого: одинаковые наборы объектов дают один файл
+            map_name = artifact_name(valid_objects)
+            map_result = geo.submit_custom_geometries(valid_objects, map_name)
             t3 = time.perf_counter()
             map_result["count"] = len(valid_objects)
             map_result["answer"] = answer
             map_result["names"] = [obj.get("name", "Без имени") for obj in valid_objects]
+            map_result["next_cursor"] = next_cursor
             
             # ДОБАВЛЯЕМ used_objects и not_used_objects К СУЩЕСТВУЮЩЕЙ СТРУКТУРЕ
             map_result["used_objects"] = used_objects
@@ -2366,7 +2541,6 @@ def api_coords_to_map():
             # Добавляем информацию о фильтрации по stoplist
             map_result["in_stoplist_filter_applied"] = True
             map_result["in_stoplist_level"] = in_stoplist
-            map_result["stoplisted_count"] = len(stoplisted_objects)
             
             # Добавляем debug информацию
             debug_info["render_time"] = round(t3 - t2, 3)
@@ -2381,7 +2555,7 @@ def api_coords_to_map():
                 map_result["debug"] = debug_info
 
             # Сохраняем в кеш (30 минут для поиска по координатам)
-            set_cached_result(redis_key, map_result, expire_time=1800)
+            cache_map_result(redis_key, map_result, map_name, 1800)
                 
             return jsonify(map_result)
         except Exception as e:
@@ -2428,8 +2602,10 @@ def find_species_with_description():
     name = data.get("name")
     limit = data.get("limit", 5)
     offset = data.get("offset", 0)
+    # Курсор следующей страницы (next_cursor прошлого ответа); offset - для старых клиентов
+    cursor = data.get("cursor")
     
-    logger.info(f"POST /find_species_with_description - name: {name}, limit: {limit}, offset: {offset}")
+    logger.info(f"POST /find_species_with_description - name: {name}, limit: {limit}, offset: {offset}, cursor: {cursor}")
     
     if not name:
         return jsonify({
@@ -2439,7 +2615,11 @@ def find_species_with_description():
             "not_used_objects": []
         }), 400
     
-    result = slot_val.find_species_with_description(name, limit, offset)
+    result = slot_val.find_species_with_description(name, int(limit), int(offset), cursor=cursor)
+    if result.get("status") == "error":
+        result["used_objects"] = []
+        result["not_used_objects"] = []
+        return jsonify(result), 400
     
     # Добавляем информацию об объектах
     used_objects = []
@@ -2465,6 +2645,78 @@ def find_species_with_description():
     
     return jsonify(result)
 
+@app.route("/names/search", methods=["GET"])
+def names_search():
+    """
+    Поиск сущностей по названию: точные совпадения, затем по префиксу,
+    затем похожие (pg_trgm). Параметры: q, types (через запятую), limit, min_similarity
+    """
+    query = request.args.get("q", "").strip()
+    types_param = request.args.get("types")
+    limit = min(request.args.get("limit", 10, type=int), 100)
+    min_similarity = request.args.get("min_similarity", 0.3, type=float)
+
+    if not query:
+        return jsonify({"status": "error", "message": "Параметр 'q' обязателен"}), 400
+
+    entity_types = [t.strip() for t in types_param.split(",") if t.strip()] if types_param else None
+    results = search_service.relational_service.search_names(
+        query,
+        entity_types=entity_types,
+        limit=limit,
+        min_similarity=min_similarity
+    )
+    return jsonify({
+        "status": "found" if results else "not_found",
+        "query": query,
+        "count": len(results),
+        "results": results
+    })
+
+@app.route("/maps/status/<map_name>", methods=["GET"])
+def map_render_status(map_name):
+    """Статус фоновой отрисовки карты по ее имени"""
+    if render_queue is None:
+        return jsonify({"map_name": map_name, "status": "done", "message": "Фоновая отрисовка отключена"})
+    return jsonify(render_queue.get_status(map_name))
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.mvt", methods=["GET"])
+def vector_tile(z, x, y):
+    """Векторный тайл геометрий map_content (ids=1,2,3 - только указанные геометрии)"""
+    try:
+        ids = parse_ids_param(request.args.get("ids"))
+        tile = get_vector_tiles().get_tile(z, x, y, ids)
+    except InvalidTileRequest as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Ошибка построения векторного тайла {z}/{x}/{y}: {e}")
+        return jsonify({"error": "Ошибка построения тайла"}), 500
+    if not tile:
+        return Response(status=204)
+    response = Response(tile, mimetype="application/vnd.mapbox-vector-tile")
+    response.headers["Cache-Control"] = "public, max-age=3600"
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Метрики текущего воркера gunicorn (у каждого воркера свои значения)"""
+    return jsonify({
+        "pid": os.getpid(),
+        "db_pool": get_pool_stats(),
+        "embedding_cache": search_service.embedding_model.stats(),
+        "morphology": get_morphology_stats(),
+        "cache_codec": get_codec_stats(),
+        "render_queue": render_queue.stats() if render_queue else {"enabled": False},
+        "spatial_cache": get_spatial_cache_stats(),
+        "vector_tiles": get_vector_tiles().stats(),
+        "map_artifacts": geo.artifacts.stats(),
+        "llm_cache": get_llm_cache().stats(),
+        "llm_guard": get_llm_guard().stats(),
+        "request_pipeline": get_pipeline_stats()
+    })
+
 @app.route("/")
 def home():
     return "SalutBot API works!"
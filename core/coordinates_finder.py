@@ -2,7 +2,7 @@ import os
 import time
 import traceback
 from urllib.parse import quote
-from typing import Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Optional
 
 import requests
 import geopandas as gpd
@@ -11,23 +11,49 @@ import matplotlib.pyplot as plt
 import contextily as ctx
 import folium
 import pyproj
+import shapely
+from folium.plugins import VectorGridProtobuf
 from shapely.geometry import shape, Point, GeometryCollection, mapping
 from shapely.geometry.base import BaseGeometry
 from shapely.ops import transform
 
 from infrastructure.geo_db_store import get_place, add_place
+from infrastructure.map_artifacts import MapArtifactStore
 from infrastructure.maps_store import set_map_links
+from infrastructure.tile_cache import TILE_PROVIDERS, get_tile_cache
+from infrastructure.vector_tiles import LAYER_NAME, VECTOR_TILE_MAX_IDS, tile_url_template
 
 matplotlib.use('Agg')
 
+# Геометрии map_content крупнее стольких точек подключаются к интерактивной карте
+# векторными тайлами (/tiles/{z}/{x}/{y}.mvt), а не встраиваются в HTML как GeoJSON
+MVT_INLINE_MAX_POINTS = int(os.getenv("MVT_INLINE_MAX_POINTS", "500"))
+
 
 class GeoProcessor:
-    def __init__(self, maps_dir: str, domain: str):
+    def __init__(self, maps_dir: str, domain: str, render_queue: Optional[Any] = None):
         self.maps_dir = maps_dir
         self.domain = domain
+        # Очередь фоновой отрисовки (infrastructure.render_queue.MapRenderQueue); None - рисуем в запросе
+        self.render_queue = render_queue
+        # Карты по содержимому (infrastructure.map_artifacts): готовые не перерисовываются
+        self.artifacts = MapArtifactStore(maps_dir)
         os.makedirs(self.maps_dir, exist_ok=True)
 
     def add_basemap(self, ax: matplotlib.axes.Axes) -> None:
+        # Сначала локальный кэш тайлов (он же докачивает недостающие тайлы)
+        tile_cache = get_tile_cache()
+        for provider in TILE_PROVIDERS:
+            try:
+                tile_cache.render(ax, provider)
+                return
+            except Exception as e:
+                print(f"Подложка {provider} из кэша тайлов недоступна: {e}")
+                continue
+
+        if tile_cache.offline:
+            return
+
         for source in [
             ctx.providers.Esri.WorldImagery,
             ctx.providers.CartoDB.Positron,
@@ -69,7 +95,7 @@ class GeoProcessor:
         m.save(filepath_html)
         return f"{self.domain}/maps/{filename_html}"
 
-    def draw_geometry(self, geometry: BaseGeometry, place_name: str) -> Tuple[str, str]:
+    def draw_geometry(self, geometry: BaseGeometry, place_name: str, with_webapp: bool = True) -> Tuple[str, str]:
         # Распаковываем GeometryCollection
         if isinstance(geometry, GeometryCollection):
             geometries = list(geometry.geoms)
@@ -96,9 +122,12 @@ class GeoProcessor:
         # Сохранение карты
         filename = f"{place_name}.jpeg"  # 1. Меняем расширение файла на .jpeg
         image_path = os.path.join(self.maps_dir, filename)
+        # Пишем во временный файл и атомарно подменяем: при фоновой отрисовке
+        # по ссылке никогда не отдается недописанная картинка
+        tmp_path = f"{image_path}.{os.getpid()}.tmp"
         try:
             # 1. Открываем файл для записи в бинарном режиме
-            with open(image_path, 'wb') as f:
+            with open(tmp_path, 'wb') as f:
                 # 2. Передаем в savefig не путь, а файловый объект f
                 plt.savefig(
                     f,
@@ -110,12 +139,17 @@ class GeoProcessor:
                 # 3. Принудительно сбрасываем буферы на диск, чтобы гарантировать запись
                 f.flush()
                 os.fsync(f.fileno())
+            os.replace(tmp_path, image_path)
         finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
             # 4. Гарантированно закрываем фигуру, чтобы освободить память
             plt.close()
         # --- КОНЕЦ ИСПРАВЛЕНИЙ ---
 
         static_map_url = f"{self.domain}/maps/{filename}"
+        if not with_webapp:
+            return static_map_url, None
         web_app_url = self.generate_folium_map(geometry, place_name)
 
         set_map_links(place_name, {
@@ -266,15 +300,11 @@ class GeoProcessor:
     
     # In coordinates_finder.py
 
-    def draw_custom_geometries(self, objects: List[dict], name: str) -> dict:
-        from shapely.geometry import shape, GeometryCollection, mapping
-
-        if not objects:
-            return {"status": "error", "message": "Нет объектов для отрисовки"}
-
+    def _collect_custom_geometries(self, objects: List[dict]) -> Tuple[list, list, list, list]:
         geometries = []
         tooltips = []
         popups = []
+        map_content_ids = []
 
         for obj in objects:
             geojson = obj.get("geojson")
@@ -289,36 +319,139 @@ class GeoProcessor:
                 # Используем 'tooltip' и 'popup', если они есть, иначе 'name'.
                 tooltips.append(obj.get("tooltip", obj.get("name", "Без имени")))
                 popups.append(obj.get("popup", obj.get("name", "Без имени")))
+                map_content_ids.append(obj.get("map_content_id"))
 
             except Exception as e:
                 print(f"Ошибка в geojson или при его обработке: {e}")
 
+        return geometries, tooltips, popups, map_content_ids
+
+    def add_vector_tile_layer(self, m: folium.Map, map_content_ids: List[int]) -> None:
+        """Слой векторных тайлов с указанными геометриями map_content"""
+        options = {
+            "vectorTileLayerStyles": {
+                LAYER_NAME: {
+                    "color": "#3388ff",
+                    "weight": 3,
+                    "fill": True,
+                    "fillColor": "#3388ff",
+                    "fillOpacity": 0.2
+                }
+            }
+        }
+        ids = sorted(set(map_content_ids))
+        # Длина списка ids в URL тайла ограничена - при необходимости несколько слоев
+        for start in range(0, len(ids), VECTOR_TILE_MAX_IDS):
+            chunk = ids[start:start + VECTOR_TILE_MAX_IDS]
+            VectorGridProtobuf(tile_url_template(self.domain, chunk), LAYER_NAME, options).add_to(m)
+
+    def submit_custom_geometries(self, objects: List[dict], name: str) -> dict:
+        """
+        Как draw_custom_geometries, но при наличии очереди отрисовки не ждет рендера:
+        ссылки возвращаются сразу, а render_status показывает готовность карты на момент
+        ответа (для закэшированных ответов его пересчитывает render_status()).
+        Уже отрисованная карта с тем же именем (map_artifacts.artifact_name) не перерисовывается.
+        """
+        if objects and self.artifacts.is_complete(name):
+            self.artifacts.record_submit(name, reused=True)
+            return {
+                "status": "ok",
+                "map_name": name,
+                "static_map": f"{self.domain}/maps/{name}.jpeg",
+                "interactive_map": f"{self.domain}/maps/webapp_{name}.html",
+                "render_status": "done"
+            }
+
+        if objects:
+            self.artifacts.record_submit(name, reused=False)
+
+        if self.render_queue is None:
+            result = self.draw_custom_geometries(objects, name)
+            if result.get("status") == "ok":
+                result["map_name"] = name
+                result["render_status"] = "done"
+            return result
+
+        if not objects:
+            return {"status": "error", "message": "Нет объектов для отрисовки"}
+
+        geometries, _, _, _ = self._collect_custom_geometries(objects)
         if not geometries:
             return {"status": "error", "message": "Нет валидных геометрий для отрисовки"}
 
-        # --- Создание статической карты (без изменений) ---
+        render_status = self.render_queue.submit_custom_geometries(objects, name)
+        return {
+            "status": "ok",
+            "map_name": name,
+            "static_map": f"{self.domain}/maps/{name}.jpeg",
+            "interactive_map": f"{self.domain}/maps/webapp_{name}.html",
+            "render_status": render_status,
+            "render_status_path": f"/maps/status/{name}"
+        }
+
+    def render_status(self, name: str) -> str:
+        """Текущая готовность карты: полностью отрисованный артефакт - done, иначе статус очереди"""
+        if self.artifacts.is_complete(name):
+            return "done"
+        if self.render_queue is None:
+            return "unknown"
+        return self.render_queue.get_status(name).get("status", "unknown")
+
+    def draw_custom_geometries(self, objects: List[dict], name: str) -> dict:
+        from shapely.geometry import GeometryCollection, mapping
+
+        if not objects:
+            return {"status": "error", "message": "Нет объектов для отрисовки"}
+
+        geometries, tooltips, popups, map_content_ids = self._collect_custom_geometries(objects)
+
+        if not geometries:
+            return {"status": "error", "message": "Нет валидных геометрий для отрисовки"}
+
+        # --- Создание статической карты (интерактивная строится ниже) ---
         combined_static = GeometryCollection(geometries)
-        static_map, _ = self.draw_geometry(combined_static, name)
+        static_map, _ = self.draw_geometry(combined_static, name, with_webapp=False)
 
         # --- Создание интерактивной карты Folium ---
         centroid = combined_static.centroid
         m = folium.Map(location=[centroid.y, centroid.x], zoom_start=9, tiles="OpenStreetMap", attributionControl=False)
 
         # Добавляем геометрии с кастомными tooltip и popup
-        for geom, tooltip_text, popup_html in zip(geometries, tooltips, popups):
+        tiled_ids = []
+        for geom, tooltip_text, popup_html, map_content_id in zip(geometries, tooltips, popups, map_content_ids):
             # Folium.Popup позволяет рендерить HTML
             popup = folium.Popup(popup_html, max_width=400)
 
+            # Крупная геометрия из map_content рисуется тайлами, в HTML остается
+            # только маркер с подсказкой и всплывающим окном
+            if map_content_id is not None and shapely.get_num_coordinates(geom) > MVT_INLINE_MAX_POINTS:
+                tiled_ids.append(map_content_id)
+                anchor = geom.representative_point()
+                folium.CircleMarker(
+                    [anchor.y, anchor.x],
+                    radius=6,
+                    tooltip=tooltip_text,
+                    popup=popup
+                ).add_to(m)
+                continue
+
             folium.GeoJson(
                 mapping(geom),
                 tooltip=tooltip_text, # Текст при наведении
                 popup=popup           # Окно с HTML при клике
             ).add_to(m)
 
+        if tiled_ids:
+            self.add_vector_tile_layer(m, tiled_ids)
+
         filename_html = f"webapp_{name}.html"
         filepath_html = os.path.join(self.maps_dir, filename_html)
-        m.save(filepath_html)
+        # Атомарная замена (в том числе заглушки, оставленной очередью отрисовки)
+        tmp_html = f"{filepath_html}.{os.getpid()}.tmp"
+        m.save(tmp_html)
+        os.replace(tmp_html, filepath_html)
         interactive_map_url = f"{self.domain}/maps/{filename_html}"
+        self.artifacts.write_manifest(name, len(geometries))
 
         return {
             "status": "ok",
@@ -1,12 +1,13 @@
 import os
+import base64
 import logging
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 from typing import List, Dict,Optional,Union,Tuple
 import json
 import time
-from functools import lru_cache
+from infrastructure.db_pool import get_db_config, get_db_connection
+from infrastructure.spatial_cache import get_spatial_cache
+from infrastructure.geometry_simplify import DEFAULT_PRECISION, geojson_sql, simplify_params
 load_dotenv()
 
 logging.basicConfig(
@@ -15,15 +16,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Сколько геометрий-кандидатов брать на одну запрашиваемую сущность в KNN-запросе
+NEARBY_CANDIDATE_FACTOR = int(os.getenv("NEARBY_CANDIDATE_FACTOR", "4"))
+NEARBY_MAX_CANDIDATES = int(os.getenv("NEARBY_MAX_CANDIDATES", "5000"))
+# Использовать предрасчитанные кандидаты по сетке (scripts/precompute_nearby_grid.py)
+NEARBY_GRID_ENABLED = os.getenv("NEARBY_GRID_ENABLED", "true").lower() == "true"
+
+
+def parse_in_stoplist(in_stoplist: Union[str, int, None]) -> int:
+    """Уровень in_stoplist числом; "true"/"false" и некорректные значения - уровень по умолчанию (1)"""
+    try:
+        return int(in_stoplist)
+    except (ValueError, TypeError):
+        return 1
+
+
+def encode_nearby_cursor(row: Dict) -> str:
+    """Курсор следующей страницы по последнему объекту: (расстояние в метрах, тип, id)"""
+    payload = json.dumps([row["distance_m"], row["type"], row["id"]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_nearby_cursor(cursor: str) -> Tuple[float, str, int]:
+    """Разбирает курсор encode_nearby_cursor; ValueError для некорректного значения"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        distance_m, entity_type, entity_id = json.loads(base64.urlsafe_b64decode(padded))
+        return float(distance_m), str(entity_type), int(entity_id)
+    except Exception as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
 class GeoService:
     def __init__(self):
-        self.db_config = {
-            "dbname": os.getenv("DB_NAME", "eco"),
-            "user": os.getenv("DB_USER", "postgres"),
-            "password": os.getenv("DB_PASSWORD", "Fdf78yh0a4b!"),
-            "host": os.getenv("DB_HOST", "localhost"),
-            "port": os.getenv("DB_PORT", "5432")
-        }
+        self.db_config = get_db_config()
         self.species_synonyms = {
             "копеечник зундукский": ["Hedysarum zundukii","копеечник зундукский"],
             "астрагал ольхонский": ["Astragalus olchonensis","астрагал ольхонский"],
@@ -37,9 +63,11 @@ class GeoService:
             "овсяница ленская": ["Festuca lenensis","овсяница ленская"],
             "кедр сибирский": ["сибирский кедр","кедр сибирский","сосна сибирская кедровая"],
         }
-        self._get_nearby_objects_cached.cache_clear()
+        # Общий для воркеров кэш результатов по ячейкам ~10 м (L1 в процессе + Redis)
+        self.nearby_cache = get_spatial_cache("nearby")
+        self._nearby_grid_available: Optional[bool] = None
     def clear_cache(self):
-        self._get_nearby_objects_cached.cache_clear()
+        self.nearby_cache.clear()
     def _expand_species_names(self, species_names: Union[str, List[str]]) -> List[str]:
         """Приводит все синонимы к основному названию вида"""
         if isinstance(species_names, str):
@@ -64,46 +92,12 @@ class GeoService:
         
         return list(canonical_names)
     
-    @lru_cache(maxsize=1000)
-    def _get_nearby_objects_cached(
-            self, 
-            lat_key: float, 
-            lon_key: float, 
-            radius_km: float, 
-            limit: int,
-            obj_type: Optional[str],
-            species_tuple: Optional[Tuple[str]],
-            in_stoplist: int  # Добавить параметр
-        ) -> List[Dict]:
-        """
-        Кэшированная версия запроса объектов поблизости
-        Использует округленные координаты для ключа кэша
-        """
-        # Преобразуем кортеж обратно в список
-        species_list = list(species_tuple) if species_tuple else None
-        if self._get_nearby_objects_cached.cache_info().hits > 0:
-            logger.debug(f"Cache hit for {lat_key},{lon_key}")
-        else:
-            logger.debug(f"Cache miss for {lat_key},{lon_key}")
-        
-        # Вызываем основной метод
-        return self._get_nearby_objects_uncached(
-            latitude=lat_key,
-            longitude=lon_key,
-            radius_km=radius_km,
-            limit=limit,
-            object_type=obj_type,
-            species_name=species_list,
-            in_stoplist=in_stoplist  # Передать параметр
-        )
-        
     def create_buffer_geometry(self, original_geometry: dict, buffer_radius_km: float) -> Optional[dict]:
         """
         Создает буферную геометрию вокруг исходной геометрии используя PostGIS
         """
-        conn = psycopg2.connect(**self.db_config, cursor_factory=RealDictCursor)
         try:
-            with conn.cursor() as cursor:
+            with get_db_connection() as conn, conn.cursor() as cursor:
                 original_geojson_str = json.dumps(original_geometry)
                 
                 query = """
@@ -125,9 +119,33 @@ class GeoService:
         except Exception as e:
             logger.error(f"Ошибка создания буферной геометрии: {str(e)}")
             return None
-        finally:
-            conn.close()
         
+    def _get_grid_candidates(self, db_cursor, latitude: float, longitude: float, radius_km: float) -> Optional[Tuple[List[str], List[int]]]:
+        """
+        Предрасчитанные кандидаты ячейки сетки, содержащей точку, для наименьшего
+        подходящего стандартного радиуса. None - ячейки нет, нужен обычный KNN-запрос.
+        """
+        if not NEARBY_GRID_ENABLED:
+            return None
+        if self._nearby_grid_available is None:
+            db_cursor.execute("SELECT to_regclass('nearby_grid_candidates') IS NOT NULL AS available")
+            self._nearby_grid_available = db_cursor.fetchone()['available']
+        if not self._nearby_grid_available:
+            return None
+
+        db_cursor.execute("""
+            SELECT entity_types, entity_ids
+            FROM nearby_grid_candidates
+            WHERE radius_km >= %s
+            AND ST_Intersects(cell, ST_SetSRID(ST_MakePoint(%s, %s), 4326))
+            ORDER BY radius_km
+            LIMIT 1
+        """, (radius_km, longitude, latitude))
+        row = db_cursor.fetchone()
+        if row is None:
+            return None
+        return list(row['entity_types']), list(row['entity_ids'])
+
     def _get_nearby_objects_uncached(
     self, 
     latitude: float, 
@@ -136,27 +154,19 @@ class GeoService:
     limit: int = 20,
     object_type: str = None,
     species_name: Optional[Union[str, List[str]]] = None,
-    in_stoplist: Union[str, int] = 1  # Принимаем и строку и число
+    in_stoplist: Union[str, int] = 1,  # Принимаем и строку и число
+    cursor: Optional[Tuple[float, str, int]] = None
 ) -> List[Dict]:
         """
-        Основная реализация поиска объектов (без кэширования)
+        Основная реализация поиска объектов (без кэширования).
+        Возвращает limit ближайших различных сущностей в порядке удаления
+        (KNN-оператор <-> по GiST-индексу entity_geometry.geography).
+        cursor - (расстояние, тип, id) последнего объекта предыдущей страницы.
         """
-        conn = psycopg2.connect(**self.db_config, cursor_factory=RealDictCursor)
         try:
-            with conn.cursor() as cursor:
+            with get_db_connection() as conn, conn.cursor() as db_cursor:
                 # ПРЕОБРАЗОВАНИЕ in_stoplist в число с обработкой строковых значений
-                try:
-                    if isinstance(in_stoplist, str):
-                        if in_stoplist.lower() in ['false', 'true']:
-                            # Если пришло "false" или "true", используем значение по умолчанию
-                            in_stoplist_int = 1
-                        else:
-                            in_stoplist_int = int(in_stoplist)
-                    else:
-                        in_stoplist_int = int(in_stoplist)
-                except (ValueError, TypeError):
-                    # В случае ошибки используем значение по умолчанию
-                    in_stoplist_int = 1
+                in_stoplist_int = parse_in_stoplist(in_stoplist)
                 
                 # Подготовка параметров запроса
                 params = {
@@ -172,107 +182,152 @@ class GeoService:
                     expanded_species = self._expand_species_names(species_name)
                     params['species_patterns'] = [f"%{name}%" for name in expanded_species]
 
-                # Основной запрос с проверкой in_stoplist для биологических видов
-                query = """
-                WITH user_point AS (
-                    SELECT ST_SetSRID(ST_MakePoint(%(longitude)s, %(latitude)s), 4326)::geography AS geom
-                )
-                SELECT DISTINCT ON (entities.id)
-                    entities.id,
-                    entities.name,
-                    entities.description,
-                    entities.type,
-                    ST_AsGeoJSON(mc.geometry)::json AS geojson,
-                    ST_Distance(mc.geometry, up.geom) / 1000 AS distance_km
-                FROM ("""
-                
-                # Собираем части запроса для разных типов объектов
-                entity_parts = []
-                
-                # Биологические сущности (с учетом синонимов)
-                if object_type is None or object_type == "biological_entity":
-                    biological_part = """
-                        SELECT 
-                            be.id,
-                            be.common_name_ru AS name,
-                            be.description,
-                            'biological_entity' AS type,
-                            eg.geographical_entity_id
-                        FROM biological_entity be
-                        JOIN entity_geo eg ON be.id = eg.entity_id 
-                            AND eg.entity_type = 'biological_entity'
-                    """
-                    entity_parts.append(biological_part)
-                
-                # Географические объекты
-                if object_type is None or object_type == "geographical_entity":
-                    geographical_part = """
-                        SELECT 
-                            ge.id,
-                            ge.name_ru AS name,
-                            ge.description,
-                            'geographical_entity' AS type,
-                            ge.id AS geographical_entity_id
-                        FROM geographical_entity ge
-                    """
-                    entity_parts.append(geographical_part)
-                
-                # Комбинируем все части запроса
-                entities_query = " UNION ALL ".join(entity_parts)
-                
-                # Условия для фильтрации по виду (с учетом синонимов И in_stoplist)
-                species_join = ""
-                species_condition = ""
+                # Типы объектов: биологические сущности и географические объекты
+                if object_type in ("biological_entity", "geographical_entity"):
+                    params['entity_types'] = [object_type]
+                elif object_type is None:
+                    params['entity_types'] = ["biological_entity", "geographical_entity"]
+                else:
+                    return []
+
+                # Условие по виду (с учетом синонимов И in_stoplist) для геометрии с псевдонимом {alias}
+                species_filter = ""
                 if species_name:
-                    species_join = """
-                        JOIN entity_geo eg_species ON entities.geographical_entity_id = eg_species.geographical_entity_id
-                        JOIN biological_entity be_species ON eg_species.entity_id = be_species.id 
-                            AND eg_species.entity_type = 'biological_entity'
-                    """
-                    species_condition = """
-                        AND (
-                            be_species.common_name_ru ILIKE ANY(%(species_patterns)s) 
-                            OR be_species.scientific_name ILIKE ANY(%(species_patterns)s)
-                        )
-                        -- ФИЛЬТРАЦИЯ ПО STOPLIST: используем переданный параметр с обработкой строковых значений
-                        AND (
-                            be_species.feature_data->>'in_stoplist' IS NULL 
-                            OR be_species.feature_data->>'in_stoplist' = 'false'
-                            OR be_species.feature_data->>'in_stoplist' = 'true'
-                            OR (be_species.feature_data->>'in_stoplist')::integer <= %(in_stoplist)s
+                    species_filter = """
+                        AND EXISTS (
+                            SELECT 1
+                            FROM entity_geo eg_species
+                            JOIN biological_entity be_species ON eg_species.entity_id = be_species.id 
+                                AND eg_species.entity_type = 'biological_entity'
+                            WHERE eg_species.geographical_entity_id = {alias}.geographical_entity_id
+                            AND (
+                                be_species.common_name_ru ILIKE ANY(%(species_patterns)s) 
+                                OR be_species.scientific_name ILIKE ANY(%(species_patterns)s)
+                            )
+                            -- ФИЛЬТРАЦИЯ ПО STOPLIST: типизированная колонка biological_entity.in_stoplist
+                            AND (be_species.in_stoplist IS NULL OR be_species.in_stoplist <= %(in_stoplist)s)
                         )
                     """
-                
-                # Формируем окончательный запрос
-                final_query = query + entities_query + f"""
-                ) entities
-                {species_join}
-                JOIN map_content mc ON mc.id IN (
-                    SELECT entity_id 
-                    FROM entity_geo 
-                    WHERE geographical_entity_id = entities.geographical_entity_id
-                    AND entity_type = 'map_content'
+
+                # Следующая страница: только объекты дальше курсора. Сущность, у которой
+                # есть геометрия ближе курсора, уже была на предыдущих страницах
+                cursor_candidate = ""
+                cursor_condition = ""
+                if cursor:
+                    params['cursor_distance'], params['cursor_type'], params['cursor_id'] = cursor
+                    cursor_candidate = "AND (eo.geography <-> up.geom) >= %(cursor_distance)s"
+                    cursor_condition = f"""
+                    WHERE (n.distance_m, n.type, n.id) > (%(cursor_distance)s, %(cursor_type)s, %(cursor_id)s)
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM entity_geometry prev
+                        CROSS JOIN user_point up
+                        WHERE prev.entity_type = n.type
+                        AND prev.entity_id = n.id
+                        AND (prev.geography <-> up.geom) < %(cursor_distance)s
+                        AND (prev.in_stoplist IS NULL OR prev.in_stoplist <= %(in_stoplist)s)
+                        {species_filter.format(alias='prev')}
+                    )
+                    """
+
+                # Если точка попала в предрасчитанную ячейку сетки, источник кандидатов -
+                # только сущности ячейки (точные расстояния по первичному ключу entity_geometry)
+                grid = self._get_grid_candidates(db_cursor, latitude, longitude, radius_km)
+                candidate_source = "entity_geometry eo"
+                if grid is not None:
+                    params['grid_types'], params['grid_ids'] = grid
+                    candidate_source = """unnest(%(grid_types)s::varchar[], %(grid_ids)s::int[]) AS g(entity_type, entity_id)
+                    JOIN entity_geometry eo ON eo.entity_type = g.entity_type AND eo.entity_id = g.entity_id"""
+                    logger.debug(f"Nearby grid hit: {len(grid[1])} candidates")
+
+                # Кандидаты - ближайшие геометрии в порядке KNN (index scan без полной сортировки),
+                # затем одна строка на сущность и итоговая сортировка только кандидатов
+                final_query = f"""
+                WITH user_point AS (
+                    SELECT ST_SetSRID(ST_MakePoint(%(longitude)s, %(latitude)s), 4326)::geography AS geom
+                ),
+                candidates AS (
+                    SELECT
+                        eo.entity_id,
+                        eo.entity_type,
+                        eo.name,
+                        eo.description,
+                        eo.geometry,
+                        eo.map_content_id,
+                        eo.geography <-> up.geom AS distance_m
+                    FROM {candidate_source}
+                    CROSS JOIN user_point up
+                    WHERE eo.entity_type = ANY(%(entity_types)s)
+                        AND ST_DWithin(eo.geography, up.geom, %(radius_km)s * 1000)
+                        AND (eo.in_stoplist IS NULL OR eo.in_stoplist <= %(in_stoplist)s)
+                        {cursor_candidate}
+                        {species_filter.format(alias='eo')}
+                    ORDER BY eo.geography <-> up.geom
+                    LIMIT %(candidate_limit)s
+                ),
+                nearest AS (
+                    SELECT DISTINCT ON (c.entity_type, c.entity_id)
+                        c.entity_id AS id,
+                        c.name,
+                        c.description,
+                        c.entity_type AS type,
+                        c.geometry,
+                        c.map_content_id,
+                        c.distance_m
+                    FROM candidates c
+                    ORDER BY c.entity_type, c.entity_id, c.distance_m
+                ),
+                page AS (
+                    SELECT
+                        n.id,
+                        n.name,
+                        n.description,
+                        n.type,
+                        ST_AsGeoJSON(n.geometry)::json AS geojson,
+                        n.map_content_id,
+                        n.distance_m / 1000 AS distance_km,
+                        n.distance_m
+                    FROM nearest n
+                    {cursor_condition}
+                    ORDER BY n.distance_m, n.type, n.id
+                    LIMIT %(limit)s
                 )
-                CROSS JOIN user_point up
-                WHERE ST_DWithin(mc.geometry, up.geom, %(radius_km)s * 1000)
-                {species_condition}
-                ORDER BY entities.id, distance_km 
-                LIMIT %(limit)s;
+                -- Число кандидатов возвращается и при пустой странице (строка с NULL вместо объекта):
+                -- на странице курсора все кандидаты могут принадлежать уже показанным сущностям
+                SELECT p.*, cc.candidate_count
+                FROM (SELECT COUNT(*) AS candidate_count FROM candidates) cc
+                LEFT JOIN page p ON TRUE
+                ORDER BY p.distance_m, p.type, p.id;
                 """
                 
-                logger.debug(f"Executing query with params: {params}")
-                debug_query = cursor.mogrify(final_query, params).decode('utf-8')
-                logger.debug(f"Full SQL query:\n{debug_query}")
-                start_time = time.time()
-                cursor.execute(final_query, params)
-                execution_time = time.time() - start_time
-                logger.debug(f"Query executed in {execution_time:.4f} seconds")
-                
-                results = cursor.fetchall()
+                # Если у сущностей много геометрий, кандидатов может не хватить на limit
+                # различных сущностей - тогда увеличиваем выборку кандидатов
+                candidate_limit = min(max(limit * NEARBY_CANDIDATE_FACTOR, 50), NEARBY_MAX_CANDIDATES)
+                if grid is not None:
+                    # Кандидатов ячейки немного - берем все за один проход
+                    candidate_limit = NEARBY_MAX_CANDIDATES
+                while True:
+                    params['candidate_limit'] = candidate_limit
+                    logger.debug(f"Executing query with params: {params}")
+                    debug_query = db_cursor.mogrify(final_query, params).decode('utf-8')
+                    logger.debug(f"Full SQL query:\n{debug_query}")
+                    start_time = time.time()
+                    db_cursor.execute(final_query, params)
+                    execution_time = time.time() - start_time
+                    logger.debug(f"Query executed in {execution_time:.4f} seconds")
+
+                    rows = db_cursor.fetchall()
+                    candidates_exhausted = rows[0]['candidate_count'] < candidate_limit
+                    results = [row for row in rows if row['id'] is not None]
+                    if len(results) >= limit or candidates_exhausted or candidate_limit >= NEARBY_MAX_CANDIDATES:
+                        break
+                    candidate_limit = min(candidate_limit * 4, NEARBY_MAX_CANDIDATES)
+
                 # Преобразование результатов в более удобный формат
                 formatted_results = []
                 for row in results:
                     formatted_row = dict(row)
+                    formatted_row.pop('candidate_count', None)
                     # Преобразование GeoJSON в Python-объект, если нужно
                     if isinstance(formatted_row['geojson'], str):
                         formatted_row['geojson'] = json.loads(formatted_row['geojson'])
@@ -283,8 +338,6 @@ class GeoService:
         except Exception as e:
             logger.error(f"Ошибка поиска объектов: {str(e)}", exc_info=True)
             return []
-        finally:
-            conn.close()
             
     def get_nearby_objects(
     self, 
@@ -294,37 +347,57 @@ class GeoService:
     limit: int = 20,
     object_type: str = None,
     species_name: Optional[Union[str, List[str]]] = None,
-    in_stoplist: int = 1  # Новый параметр
+    in_stoplist: int = 1,  # Новый параметр
+    cursor: Optional[str] = None
 ) -> List[Dict]:
         """
-        Поиск объектов в радиусе от заданной точки с кэшированием
+        Поиск ближайших объектов в радиусе от заданной точки с кэшированием.
+        cursor - курсор следующей страницы (encode_nearby_cursor по последнему объекту)
         """
-        # Округляем координаты для ключа кэша (4 знака ≈ 10 метров)
-        lat_key = round(latitude, 4)
-        lon_key = round(longitude, 4)
-        
+        cursor_key = None
+        if cursor:
+            try:
+                cursor_key = decode_nearby_cursor(cursor)
+            except ValueError as e:
+                logger.warning(str(e))
+                return []
+
         # Округляем радиус для ключа кэша
         radius_key = round(radius_km, 1)
         
-        # Преобразуем species_name в кортеж для хеширования
-        species_tuple = None
+        # Нормализуем species_name для ключа кэша
+        species_key = None
         if species_name:
             if isinstance(species_name, str):
-                species_tuple = (species_name.lower(),)
+                species_key = [species_name.lower()]
             else:
-                species_tuple = tuple(sorted(name.lower() for name in species_name))
-        else:
-            species_tuple = None
-        
-        # Вызываем кэшированную версию с учетом in_stoplist
-        return self._get_nearby_objects_cached(
-            lat_key=lat_key,
-            lon_key=lon_key,
-            radius_km=radius_key,
-            limit=limit,
-            obj_type=object_type,
-            species_tuple=species_tuple,
-            in_stoplist=in_stoplist  # Передаем уровень стоплиста
+                species_key = sorted(name.lower() for name in species_name)
+
+        params = {
+            "limit": limit,
+            "object_type": object_type,
+            "species": species_key,
+            "in_stoplist": in_stoplist,
+            "cursor": list(cursor_key) if cursor_key else None
+        }
+
+        # Запрос выполняется от центра ячейки сетки, поэтому точки в пределах
+        # ячейки (~10 м) получают один результат во всех воркерах
+        return self.nearby_cache.get_or_compute(
+            latitude,
+            longitude,
+            radius_key,
+            params,
+            lambda lat, lon: self._get_nearby_objects_uncached(
+                latitude=lat,
+                longitude=lon,
+                radius_km=radius_key,
+                limit=limit,
+                object_type=object_type,
+                species_name=species_key,
+                in_stoplist=in_stoplist,
+                cursor=cursor_key
+            )
         )
             
     def get_objects_in_polygon(
@@ -332,124 +405,67 @@ class GeoService:
     polygon_geojson: dict,
     buffer_radius_km: float = 0,
     limit: int = 20,
-    object_type: str = None
+    object_type: str = None,
+    in_stoplist: Union[str, int] = 1,
+    simplify_tolerance_m: Optional[float] = None,
+    precision: int = DEFAULT_PRECISION
 ) -> List[Dict]:
-        """Поиск объектов внутри полигона и в буферной зоне вокруг него"""
-        conn = psycopg2.connect(**self.db_config, cursor_factory=RealDictCursor)
+        """
+        Поиск объектов внутри полигона и в буферной зоне вокруг него.
+        simplify_tolerance_m/precision - упрощение и точность возвращаемых геометрий.
+        """
         try:
-            with conn.cursor() as cursor:
+            with get_db_connection() as conn, conn.cursor() as cursor:
                 polygon_str = json.dumps(polygon_geojson)
                 
-                query = """
+                # Без типа - био, гео, изображения и тексты; с типом - он вместе с биологическими
+                if not object_type:
+                    entity_types = ["biological_entity", "geographical_entity", "image_content", "text_content"]
+                elif object_type == "biological_entity":
+                    entity_types = ["biological_entity"]
+                else:
+                    entity_types = ["biological_entity", object_type]
+
+                query = f"""
                 WITH area AS (
                     SELECT 
                         ST_Buffer(
                             ST_GeomFromGeoJSON(%(polygon_str)s)::geography,
                             %(buffer_radius_km)s * 1000
                         ) AS geom
-                ),
-                entities AS (
-                    SELECT 
-                        be.id,
-                        be.common_name_ru AS name,
-                        be.description,
-                        'biological_entity' AS type,
-                        eg.geographical_entity_id
-                    FROM biological_entity be
-                    JOIN entity_geo eg ON be.id = eg.entity_id 
-                        AND eg.entity_type = 'biological_entity'
-                    {additional_entities}
                 )
                 SELECT
-                    entities.id,
-                    entities.name,
-                    entities.description,
-                    entities.type,
-                    ST_AsGeoJSON(mc.geometry)::json AS geojson,  -- Возвращаем полную геометрию
-                    ST_Distance(
-                        CASE 
-                            WHEN ST_GeometryType(mc.geometry) = 'ST_Point' 
-                            THEN mc.geometry 
-                            ELSE ST_Centroid(mc.geometry)
-                        END,
-                        ST_Centroid(a.geom)
-                    ) / 1000 AS distance_km
-                FROM entities
-                JOIN map_content mc ON mc.id IN (
-                    SELECT entity_id 
-                    FROM entity_geo 
-                    WHERE geographical_entity_id = entities.geographical_entity_id
-                    AND entity_type = 'map_content'
-                )
+                    eo.entity_id AS id,
+                    eo.name,
+                    eo.description,
+                    eo.entity_type AS type,
+                    {geojson_sql('eo.geometry', 'eo.map_content_id', simplify_tolerance_m)} AS geojson,
+                    eo.map_content_id,
+                    ST_Distance(eo.centroid, ST_Centroid(a.geom)) / 1000 AS distance_km
+                FROM entity_geometry eo
                 CROSS JOIN area a
-                WHERE ST_Intersects(mc.geometry, a.geom)
+                WHERE eo.entity_type = ANY(%(entity_types)s)
+                    AND ST_Intersects(eo.geography, a.geom)
+                    AND (eo.in_stoplist IS NULL OR eo.in_stoplist <= %(in_stoplist)s)
                 ORDER BY distance_km
                 LIMIT %(limit)s;
                 """
                 
-                additional_entities = ""
-                if not object_type:
-                    additional_entities = """
-                    UNION ALL
-                    SELECT 
-                        ge.id,
-                        ge.name_ru AS name,
-                        ge.description,
-                        'geographical_entity' AS type,
-                        ge.id AS geographical_entity_id
-                    FROM geographical_entity ge
-                    
-                    UNION ALL
-                    SELECT 
-                        ic.id,
-                        ic.title AS name,
-                        ic.description,
-                        'image_content' AS type,
-                        eg.geographical_entity_id
-                    FROM image_content ic
-                    JOIN entity_geo eg ON ic.id = eg.entity_id 
-                        AND eg.entity_type = 'image_content'
-                    
-                    UNION ALL
-                    SELECT 
-                        tc.id,
-                        tc.title AS name,
-                        tc.description,
-                        'text_content' AS type,
-                        eg.geographical_entity_id
-                    FROM text_content tc
-                    JOIN entity_geo eg ON tc.id = eg.entity_id 
-                        AND eg.entity_type = 'text_content'
-                    """
-                elif object_type != "biological_entity":
-                    additional_entities = f"""
-                    UNION ALL
-                    SELECT 
-                        e.id,
-                        e.name,
-                        e.description,
-                        '{object_type}' AS type,
-                        eg.geographical_entity_id
-                    FROM {object_type} e
-                    JOIN entity_geo eg ON e.id = eg.entity_id 
-                        AND eg.entity_type = '{object_type}'
-                    """
-                
-                final_query = query.format(additional_entities=additional_entities)
                 params = {
                     'polygon_str': polygon_str,
                     'buffer_radius_km': buffer_radius_km,
-                    'limit': limit
+                    'entity_types': entity_types,
+                    'in_stoplist': parse_in_stoplist(in_stoplist),
+                    'limit': limit,
+                    **simplify_params(simplify_tolerance_m, precision)
                 }
                 
-                cursor.execute(final_query, params)
+                cursor.execute(query, params)
                 return cursor.fetchall()
                 
         except Exception as e:
             logger.error(f"Ошибка поиска объектов по полигону: {str(e)}")
             return []
-        finally:
-            conn.close()
                     
     def get_radius_intersection(
         self, 
@@ -458,9 +474,8 @@ class GeoService:
         radius_km: float = 10.0
     ) -> Optional[Dict]:
         """Возвращает пересечение круга с заданным радиусом с полигонами и регионы"""
-        conn = psycopg2.connect(**self.db_config, cursor_factory=RealDictCursor)
         try:
-            with conn.cursor() as cursor:
+            with get_db_connection() as conn, conn.cursor() as cursor:
                 query = """
                         WITH user_point AS (
                             SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography AS point_geog
@@ -514,6 +529,4 @@ class GeoService:
                 return None
         except Exception as e:
             logger.error(f"Ошибка вычисления пересечения: {str(e)}")
-            return None
-        finally:
-            conn.close()
\ No newline at end of file
+            return None
\ No newline at end of file
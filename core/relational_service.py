@@ -5,11 +5,11 @@ from pathlib import Path
 import re
 from langchain_gigachat import GigaChat
 from langchain_core.prompts import ChatPromptTemplate
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
-from typing import Any, List, Dict, Optional
+from typing import Any, List, Dict, Optional, Union
 from infrastructure.llm_integration import get_gigachat
+from infrastructure.db_pool import get_db_config, get_db_connection
+from infrastructure.geometry_simplify import DEFAULT_PRECISION, geojson_sql, simplify_params
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -22,20 +22,15 @@ class RelationalService:
                 species_synonyms_path: Optional[str] = None
     ):
         self.llm = get_gigachat()
-        self.db_config = {
-            "dbname": os.getenv("DB_NAME", "eco"),
-            "user": os.getenv("DB_USER", "postgres"),
-            "password": os.getenv("DB_PASSWORD", "Fdf78yh0a4b!"),
-            "host": os.getenv("DB_HOST", "localhost"),
-            "port": os.getenv("DB_PORT", "5432")
-        }
+        self.db_config = get_db_config()
         self.species_synonyms = self._load_species_synonyms(species_synonyms_path)
 
     def search_images_by_features(
     self,
     species_name: str,
     features: Dict[str, Any],
-    synonyms_data: Optional[Dict[str, Any]] = None 
+    synonyms_data: Optional[Dict[str, Any]] = None,
+    in_stoplist: str = "1"
 ) -> Dict[str, Any]:
         """
         Поиск изображений по названию вида и признакам
@@ -44,6 +39,7 @@ class RelationalService:
             species_name: Название биологического вида
             features: Словарь с признаками для фильтрации
             synonyms_data: Данные синонимов (опционально)
+            in_stoplist: Максимальный уровень in_stoplist изображений
             
         Returns:
             Результаты поиска изображений
@@ -97,6 +93,7 @@ class RelationalService:
                 AND eil.entity_type = 'image_content'
             JOIN entity_identifier ei ON ei.id = eil.identifier_id
             WHERE (""" + " OR ".join(species_conditions) + ")"
+            sql_query += self._in_stoplist_condition(in_stoplist, alias="ic")
             
             feature_conditions = []
             for key, value in features.items():
@@ -176,12 +173,13 @@ class RelationalService:
                 "message": f"Ошибка при поиске изображений: {str(e)}"
             }
             
-    def search_images_by_features_only(self, features: Dict[str, Any]) -> Dict[str, Any]:
+    def search_images_by_features_only(self, features: Dict[str, Any], in_stoplist: str = "1") -> Dict[str, Any]:
         """
         Поиск изображений только по признакам (без привязки к виду)
         
         Args:
             features: Словарь с признаками для фильтрации
+            in_stoplist: Максимальный уровень in_stoplist изображений
             
         Returns:
             Результаты поиска изображений
@@ -205,6 +203,7 @@ class RelationalService:
                 AND er.target_type = 'biological_entity'
             WHERE 1=1
             """
+            sql_query += self._in_stoplist_condition(in_stoplist, alias="ic")
             
             params = []
             feature_conditions = []
@@ -337,18 +336,8 @@ class RelationalService:
         WHERE {name_field} ILIKE %(object_name)s
         """
         
-        # Гибкая фильтрация по in_stoplist
-        try:
-            if in_stoplist == "0":
-                # Только самые безопасные записи (уровень 0 или null)
-                query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer = 0)"
-            else:
-                # Для уровней 1, 2, 3... - все записи с уровнем <= запрошенному
-                requested_level = int(in_stoplist)
-                query += f" AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= {requested_level})"
-        except ValueError:
-            # Если передано не число, используем уровень по умолчанию (1)
-            query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= 1)"
+        # Фильтрация по in_stoplist по типизированной колонке
+        query += self._in_stoplist_condition(in_stoplist)
         try:
             # Определяем таблицу и поле имени в зависимости от типа объекта
             table_map = {
@@ -469,18 +458,8 @@ class RelationalService:
         WHERE 1=1
         """
         
-        # Гибкая фильтрация по in_stoplist
-        try:
-            if in_stoplist == "0":
-                # Только самые безопасные записи (уровень 0 или null)
-                query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer = 0)"
-            else:
-                # Для уровней 1, 2, 3... - все записи с уровнем <= запрошенному
-                requested_level = int(in_stoplist)
-                query += f" AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= {requested_level})"
-        except ValueError:
-            # Если передано не число, используем уровень по умолчанию (1)
-            query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= 1)"
+        # Фильтрация по in_stoplist по типизированной колонке
+        query += self._in_stoplist_condition(in_stoplist)
         
         params = {
             'object_type': object_type,
@@ -642,56 +621,110 @@ class RelationalService:
     object_type: str,
     limit: int = 10,
     similarity_threshold: float = 0.05,
-    in_stoplist: str = "1"
+    in_stoplist: str = "1",
+    ef_search: Optional[int] = None
 ) -> List[Dict]:
         """
         Поиск объектов только по эмбеддингу запроса (без указания конкретного имени объекта)
         с учетом in_stoplist
         """
-        query = """
-        SELECT 
-            tc.content, 
-            tc.structured_data, 
-            tc.feature_data,
-            1 - (tc.embedding <=> %(embedding)s::vector) as similarity,
-            be.common_name_ru as object_name,
-            'biological_entity' as object_type
-        FROM text_content tc
-        JOIN entity_relation er ON tc.id = er.source_id 
-            AND er.source_type = 'text_content'
-            AND er.relation_type = 'описание объекта'
-        JOIN biological_entity be ON be.id = er.target_id 
-            AND er.target_type = 'biological_entity'
-        WHERE 1 - (tc.embedding <=> %(embedding)s::vector) > %(similarity_threshold)s
+        return self.search_objects_by_embedding_multi_type(
+            query_embedding=query_embedding,
+            object_types=[object_type],
+            limit=limit,
+            similarity_threshold=similarity_threshold,
+            in_stoplist=in_stoplist,
+            ef_search=ef_search
+        )["results"]
+
+    def search_objects_by_embedding_multi_type(
+    self,
+    query_embedding: List[float],
+    object_types: List[str],
+    limit: int = 10,
+    similarity_threshold: float = 0.05,
+    in_stoplist: str = "1",
+    ef_search: Optional[int] = None
+) -> Dict[str, Any]:
         """
-        # Гибкая фильтрация по in_stoplist
-        try:
-            if in_stoplist == "0":
-                # Только самые безопасные записи (уровень 0 или null)
-                query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer = 0)"
-            else:
-                # Для уровней 1, 2, 3... - все записи с уровнем <= запрошенному
-                requested_level = int(in_stoplist)
-                query += f" AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= {requested_level})"
-        except ValueError:
-            # Если передано не число, используем уровень по умолчанию (1)
-            query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= 1)"
-        query += " ORDER BY similarity DESC LIMIT %(limit)s;"
-        
+        Семантический поиск сразу по нескольким типам объектов одним запросом.
+
+        Кандидаты выбираются из text_content через ORDER BY расстояния (индекс HNSW),
+        затем связываются с объектами через представление entity_text_description.
+        Для каждого типа оставляется не более limit лучших описаний (оконная функция),
+        порог схожести применяется к уже отобранным кандидатам.
+
+        Возвращает {"results": глобальный top-limit, "by_type": {тип: список}}
+        """
+        empty = {"results": [], "by_type": {t: [] for t in object_types}}
+        if not object_types:
+            return empty
+
+        # Фильтрация по in_stoplist по типизированной колонке
+        stoplist_condition = self._in_stoplist_condition(in_stoplist)
+
+        query = f"""
+        WITH candidates AS (
+            SELECT 
+                tc.id,
+                tc.content, 
+                tc.structured_data, 
+                tc.feature_data,
+                tc.embedding <=> %(embedding)s::vector AS distance
+            FROM text_content tc
+            WHERE tc.embedding IS NOT NULL
+            {stoplist_condition}
+              AND EXISTS (
+                  SELECT 1 FROM entity_text_description d
+                  WHERE d.text_content_id = tc.id
+                    AND d.entity_type = ANY(%(object_types)s)
+              )
+            ORDER BY tc.embedding <=> %(embedding)s::vector
+            LIMIT %(candidate_limit)s
+        ),
+        ranked AS (
+            SELECT 
+                c.content,
+                c.structured_data,
+                c.feature_data,
+                1 - c.distance AS similarity,
+                d.object_name,
+                d.entity_type AS object_type,
+                ROW_NUMBER() OVER (PARTITION BY d.entity_type ORDER BY c.distance, d.entity_id) AS type_rank
+            FROM candidates c
+            JOIN entity_text_description d ON d.text_content_id = c.id
+            WHERE d.entity_type = ANY(%(object_types)s)
+        )
+        SELECT content, structured_data, feature_data, similarity, object_name, object_type
+        FROM ranked
+        WHERE type_rank <= %(limit)s
+          AND similarity > %(similarity_threshold)s
+        ORDER BY similarity DESC;
+        """
+
+        # Пул кандидатов рассчитан так, чтобы каждый тип мог набрать limit описаний
+        candidate_limit = min(limit * len(object_types), 1000)
+
         try:
             embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
             
             params = {
                 'embedding': embedding_str,
+                'object_types': list(object_types),
+                'candidate_limit': candidate_limit,
                 'similarity_threshold': similarity_threshold,
                 'limit': limit
             }
             
-            results = self.execute_query(query, params)
+            results = self.execute_query(
+                query, params,
+                local_settings=self._vector_search_settings(candidate_limit, ef_search)
+            )
             
             if not results:
-                return []
+                return empty
             
+            by_type: Dict[str, List[Dict]] = {t: [] for t in object_types}
             formatted_results = []
             for row in results:
                 try:
@@ -717,54 +750,53 @@ class RelationalService:
                         if structured_data:
                             item["structured_data"] = structured_data
                         formatted_results.append(item)
+                        by_type.setdefault(item["object_type"], []).append(item)
                 except Exception as e:
                     logger.error(f"Ошибка обработки строки результата: {str(e)}")
                     continue
             
-            return formatted_results
+            return {"results": formatted_results[:limit], "by_type": by_type}
             
         except Exception as e:
             logger.error(f"Ошибка семантического поиска объектов: {str(e)}")
-            return []
+            return empty
         
     def get_object_descriptions_with_embedding(self, object_name: str, object_type: str, 
                                             query_embedding: List[float],
                                             limit: int = 10, 
                                             similarity_threshold: float = 0.1,
-                                            in_stoplist: str = "1") -> List[Dict]:
+                                            in_stoplist: str = "1",
+                                            ef_search: Optional[int] = None) -> List[Dict]:
         """
         УНИВЕРСАЛЬНАЯ функция для получения текстовых описаний объектов 
         с учетом схожести эмбеддингов и in_stoplist (ФИНАЛЬНАЯ ИСПРАВЛЕННАЯ ВЕРСИЯ).
+        Порог схожести применяется после выборки top-k по расстоянию.
         """
-        
+        # Фильтрация по in_stoplist по типизированной колонке
+        stoplist_condition = self._in_stoplist_condition(in_stoplist)
+
         query = """
-        SELECT 
-            tc.content, 
-            tc.structured_data, 
-            tc.feature_data,
-            1 - (tc.embedding <=> %(embedding)s::vector) as similarity
-        FROM {table_name} be
-        JOIN entity_relation er ON be.id = er.target_id 
-            AND er.target_type = %(object_type)s
-            AND er.relation_type = 'описание объекта'
-        JOIN text_content tc ON tc.id = er.source_id 
-            AND er.source_type = 'text_content'
-        WHERE {name_field} ILIKE %(object_name)s
-          AND 1 - (tc.embedding <=> %(embedding)s::vector) > %(similarity_threshold)s
+        SELECT * FROM (
+            SELECT 
+                tc.content, 
+                tc.structured_data, 
+                tc.feature_data,
+                1 - (tc.embedding <=> %(embedding)s::vector) as similarity
+            FROM {table_name} be
+            JOIN entity_relation er ON be.id = er.target_id 
+                AND er.target_type = %(object_type)s
+                AND er.relation_type = 'описание объекта'
+            JOIN text_content tc ON tc.id = er.source_id 
+                AND er.source_type = 'text_content'
+            WHERE {name_field} ILIKE %(object_name)s
+              AND tc.embedding IS NOT NULL
+            {stoplist_condition}
+            ORDER BY tc.embedding <=> %(embedding)s::vector
+            LIMIT %(limit)s
+        ) candidates
+        WHERE similarity > %(similarity_threshold)s
+        ORDER BY similarity DESC;
         """
-        # Гибкая фильтрация по in_stoplist
-        try:
-            if in_stoplist == "0":
-                # Только самые безопасные записи (уровень 0 или null)
-                query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer = 0)"
-            else:
-                # Для уровней 1, 2, 3... - все записи с уровнем <= запрошенному
-                requested_level = int(in_stoplist)
-                query += f" AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= {requested_level})"
-        except ValueError:
-            # Если передано не число, используем уровень по умолчанию (1)
-            query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= 1)"
-        query += " ORDER BY similarity DESC LIMIT %(limit)s;"
         
         try:
             # <-- ВАЖНО: Добавляем лог, чтобы видеть, для какого типа объекта мы работаем
@@ -788,7 +820,8 @@ class RelationalService:
             # Используем именованные параметры для надежности, как и в функции без эмбеддингов
             formatted_query = query.format(
                 table_name=table_info["table"], 
-                name_field=table_info["name_field"]
+                name_field=table_info["name_field"],
+                stoplist_condition=stoplist_condition
             )
             
             embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
@@ -804,7 +837,10 @@ class RelationalService:
             # <-- ВАЖНО: Логируем сам запрос и параметры перед выполнением
             logger.debug(f"Сформированный SQL-запрос:\n{formatted_query}")
             logger.debug(f"Параметры запроса: {params}")
-            results = self.execute_query(formatted_query, params)
+            results = self.execute_query(
+                formatted_query, params,
+                local_settings=self._vector_search_settings(limit, ef_search)
+            )
             
             if not results:
                 logger.debug(f"Для типа '{object_type}' не найдено результатов в БД.")
@@ -857,18 +893,8 @@ class RelationalService:
         WHERE be.common_name_ru ILIKE %s
         """
         
-        # Гибкая фильтрация по in_stoplist
-        try:
-            if in_stoplist == "0":
-                # Только самые безопасные записи (уровень 0 или null)
-                query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer = 0)"
-            else:
-                # Для уровней 1, 2, 3... - все записи с уровнем <= запрошенному
-                requested_level = int(in_stoplist)
-                query += f" AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= {requested_level})"
-        except ValueError:
-            # Если передано не число, используем уровень по умолчанию (1)
-            query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= 1)"
+        # Фильтрация по in_stoplist по типизированной колонке
+        query += self._in_stoplist_condition(in_stoplist)
         
         query += ";"
         
@@ -904,47 +930,45 @@ class RelationalService:
     
     def get_text_descriptions_with_embedding(self, species_name: str, query_embedding: List[float], 
                                limit: int = 10, similarity_threshold: float = 0.5,
-                               in_stoplist: str = "1") -> List[Dict]:
+                               in_stoplist: str = "1",
+                               ef_search: Optional[int] = None) -> List[Dict]:
         """Получает текстовые описания с учетом схожести эмбеддингов и in_stoplist"""
-        query = """
-        SELECT tc.content, tc.structured_data, tc.feature_data, 
-            1 - (tc.embedding <=> %s::vector) as similarity
-        FROM biological_entity be
-        JOIN entity_relation er ON be.id = er.target_id 
-            AND er.target_type = 'biological_entity'
-            AND er.relation_type = 'описание объекта'
-        JOIN text_content tc ON tc.id = er.source_id 
-            AND er.source_type = 'text_content'
-        WHERE be.common_name_ru ILIKE %s
-        AND 1 - (tc.embedding <=> %s::vector) > %s
-        """
         logger.info(f"🔍 ВЫПОЛНЯЕТСЯ ВЕКТОРНЫЙ ПОИСК:")
         logger.info(f"   - species_name: {species_name}")
         logger.info(f"   - similarity_threshold: {similarity_threshold}")
         logger.info(f"   - in_stoplist: {in_stoplist}")
         logger.info(f"   - limit: {limit}")
         logger.info(f"   - Длина embedding: {len(query_embedding)}")
-        # Гибкая фильтрация по in_stoplist
-        try:
-            if in_stoplist == "0":
-                # Только самые безопасные записи (уровень 0 или null)
-                query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer = 0)"
-            else:
-                # Для уровней 1, 2, 3... - все записи с уровнем <= запрошенному
-                requested_level = int(in_stoplist)
-                query += f" AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= {requested_level})"
-        except ValueError:
-            # Если передано не число, используем уровень по умолчанию (1)
-            query += " AND (tc.feature_data->>'in_stoplist' IS NULL OR (tc.feature_data->>'in_stoplist')::integer <= 1)"
-        
-        query += " ORDER BY similarity DESC LIMIT %s;"
+        # Фильтрация по in_stoplist по типизированной колонке
+        stoplist_condition = self._in_stoplist_condition(in_stoplist)
+
+        query = f"""
+        SELECT * FROM (
+            SELECT tc.content, tc.structured_data, tc.feature_data, 
+                1 - (tc.embedding <=> %s::vector) as similarity
+            FROM biological_entity be
+            JOIN entity_relation er ON be.id = er.target_id 
+                AND er.target_type = 'biological_entity'
+                AND er.relation_type = 'описание объекта'
+            JOIN text_content tc ON tc.id = er.source_id 
+                AND er.source_type = 'text_content'
+            WHERE be.common_name_ru ILIKE %s
+            AND tc.embedding IS NOT NULL
+            {stoplist_condition}
+            ORDER BY tc.embedding <=> %s::vector
+            LIMIT %s
+        ) candidates
+        WHERE similarity > %s
+        ORDER BY similarity DESC;
+        """
         
         try:
             embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
             
             results = self.execute_query(
                 query, 
-                (embedding_str, f'%{species_name}%', embedding_str, similarity_threshold, limit)
+                (embedding_str, f'%{species_name}%', embedding_str, limit, similarity_threshold),
+                local_settings=self._vector_search_settings(limit, ef_search)
             )
             
             if not results:
@@ -1105,6 +1129,90 @@ class RelationalService:
             object_name, object_type, object_subtype, limit, table_info
         )
 
+    NAME_SEARCH_TYPES = (
+        "biological_entity", "geographical_entity", "modern_human_made",
+        "ancient_human_made", "organization", "research_project", "volunteer_initiative"
+    )
+
+    def search_names(
+        self,
+        query: str,
+        entity_types: Optional[List[str]] = None,
+        limit: int = 10,
+        min_similarity: float = 0.3
+    ) -> List[Dict]:
+        """
+        Поиск сущностей по названию одним индексным запросом к entity_name_search:
+        сначала точные совпадения, затем по префиксу, затем по подстроке
+        и по триграммной похожести (pg_trgm), внутри групп - по убыванию похожести.
+        """
+        query = (query or "").strip()
+        if not query:
+            return []
+
+        if entity_types:
+            entity_types = [t for t in entity_types if t in self.NAME_SEARCH_TYPES]
+            if not entity_types:
+                return []
+        else:
+            entity_types = list(self.NAME_SEARCH_TYPES)
+
+        # Экранируем спецсимволы LIKE во вводе пользователя
+        like_query = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+        sql_query = """
+        SELECT
+            ens.entity_id AS id,
+            ens.entity_type AS type,
+            ens.name,
+            CASE
+                WHEN lower(ens.name) = lower(%(query)s) THEN 'exact'
+                WHEN ens.name ILIKE %(prefix)s THEN 'prefix'
+                WHEN ens.name ILIKE %(substring)s THEN 'substring'
+                ELSE 'similar'
+            END AS match_type,
+            similarity(ens.name, %(query)s) AS similarity
+        FROM entity_name_search ens
+        WHERE ens.entity_type = ANY(%(entity_types)s)
+            AND (ens.name ILIKE %(substring)s OR ens.name %% %(query)s)
+        ORDER BY
+            CASE
+                WHEN lower(ens.name) = lower(%(query)s) THEN 0
+                WHEN ens.name ILIKE %(prefix)s THEN 1
+                WHEN ens.name ILIKE %(substring)s THEN 2
+                ELSE 3
+            END,
+            similarity DESC,
+            length(ens.name),
+            ens.name
+        LIMIT %(limit)s;
+        """
+        params = {
+            "query": query,
+            "prefix": f"{like_query}%",
+            "substring": f"%{like_query}%",
+            "entity_types": entity_types,
+            "limit": limit
+        }
+        # Порог оператора % задается только для этого запроса
+        settings = {"pg_trgm.similarity_threshold": str(min_similarity)}
+
+        try:
+            results = self.execute_query(sql_query, params, local_settings=settings)
+            return [
+                {
+                    "id": row["id"],
+                    "type": row["type"],
+                    "name": row["name"],
+                    "match_type": row["match_type"],
+                    "similarity": round(float(row["similarity"]), 4)
+                }
+                for row in results
+            ]
+        except Exception as e:
+            logger.error(f"Ошибка поиска по названию '{query}': {str(e)}")
+            return []
+
     def _search_objects_by_name_and_type(
         self,
         object_name: str,
@@ -1195,15 +1303,18 @@ class RelationalService:
     object_name: Optional[str] = None,
     limit: int = 70,
     search_around: bool = False,  # Новый параметр
-    buffer_radius_km: float = 10.0  # Новый параметр
+    buffer_radius_km: float = 10.0,  # Новый параметр
+    simplify_tolerance_m: Optional[float] = None,
+    precision: int = DEFAULT_PRECISION
 ) -> List[Dict]:
         """
-        Поиск географических объектов в заданной области с фильтрацией
+        Поиск географических объектов в заданной области с фильтрацией.
+        simplify_tolerance_m/precision - упрощение и точность возвращаемых геометрий.
         """
         area_geojson_str = json.dumps(area_geometry)
         
         # Базовый запрос
-        query = """
+        query = f"""
         WITH search_area AS (
     SELECT 
         CASE 
@@ -1214,36 +1325,37 @@ class RelationalService:
         END AS geom
 )
 SELECT
-    ge.id,
-    ge.name_ru AS name,
+    ge.entity_id AS id,
+    ge.name,
     ge.description,
     ge.feature_data,
     'geographical_entity' AS type,
-    ST_AsGeoJSON(mc.geometry)::json AS geojson,
-    ST_GeometryType(mc.geometry) AS geometry_type,
+    {geojson_sql('ge.geometry', 'ge.map_content_id', simplify_tolerance_m)} AS geojson,
+    ge.map_content_id,
+    ST_GeometryType(ge.geometry) AS geometry_type,
     CASE 
-        WHEN ST_Within(mc.geometry::geometry, ST_GeomFromGeoJSON(%(area_geojson)s)::geometry) THEN 'inside'
+        WHEN ST_Within(ge.geometry, ST_GeomFromGeoJSON(%(area_geojson)s)::geometry) THEN 'inside'
         ELSE 'around'
     END AS location_type
-FROM geographical_entity ge
-JOIN entity_geo eg ON ge.id = eg.geographical_entity_id
-JOIN map_content mc ON eg.entity_id = mc.id AND eg.entity_type = 'map_content'
+FROM entity_geometry ge
 CROSS JOIN search_area sa
-WHERE ST_Intersects(mc.geometry, sa.geom)
+WHERE ge.entity_type = 'geographical_entity'
+    AND ST_Intersects(ge.geography, sa.geom)
         """
         
         params = {
             'area_geojson': area_geojson_str,
             'search_around': search_around,
             'buffer_radius_km': buffer_radius_km,
-            'limit': limit
+            'limit': limit,
+            **simplify_params(simplify_tolerance_m, precision)
         }
         
         conditions = []
         
         # Фильтрация по имени объекта
         if object_name:
-            conditions.append("ge.name_ru ILIKE %(object_name)s")
+            conditions.append("ge.name ILIKE %(object_name)s")
             params['object_name'] = f'%{object_name}%'
         
         # Фильтрация по типу объекта
@@ -1265,7 +1377,7 @@ WHERE ST_Intersects(mc.geometry, sa.geom)
         if conditions:
             query += " AND " + " AND ".join(conditions)
         
-        query += " ORDER BY ge.name_ru LIMIT %(limit)s;"
+        query += " ORDER BY ge.name LIMIT %(limit)s;"
         
         try:
             results = self.execute_query(query, params)
@@ -1282,6 +1394,7 @@ WHERE ST_Intersects(mc.geometry, sa.geom)
                     "type": row['type'],
                     "geometry_type": row['geometry_type'],
                     "geojson": row['geojson'],
+                    "map_content_id": row['map_content_id'],
                     "features": features,
                     "primary_types": geo_type.get('primary_type', []),
                     "specific_types": geo_type.get('specific_types', []),
@@ -1461,24 +1574,52 @@ WHERE ST_Intersects(mc.geometry, sa.geom)
         
         return "\n\n".join(content_sections) if content_sections else ""
             
-    def execute_query(self, sql_query: str, params: tuple = None) -> List[Dict]:
-        """Выполняет SQL-запрос в PostgreSQL с поддержкой параметров"""
-        conn = psycopg2.connect(**self.db_config, cursor_factory=RealDictCursor)
+    @staticmethod
+    def _in_stoplist_condition(in_stoplist: Union[str, int, None], alias: str = "tc") -> str:
+        """
+        Условие фильтрации по уровню in_stoplist (колонка smallint с индексом).
+        Возвращаются записи без уровня или с уровнем не выше запрошенного;
+        нечисловое значение трактуется как уровень по умолчанию (1).
+        """
         try:
-            with conn.cursor() as cursor:
-                logger.debug(f"Executing SQL: {sql_query}")
-                logger.debug(f"With params: {params}")
-                
-                if params:
-                    cursor.execute(sql_query, params)
-                else:
-                    cursor.execute(sql_query)
+            requested_level = int(in_stoplist)
+        except (ValueError, TypeError):
+            requested_level = 1
+        return f" AND ({alias}.in_stoplist IS NULL OR {alias}.in_stoplist <= {requested_level})"
+
+    def _vector_search_settings(self, limit: int, ef_search: Optional[int] = None) -> Dict[str, str]:
+        """
+        Параметры HNSW для одного запроса. ef_search не может быть меньше limit,
+        иначе индекс вернет меньше limit кандидатов.
+        """
+        if not ef_search:
+            ef_search = int(os.getenv("HNSW_EF_SEARCH", "40"))
+        ef_search = min(max(int(ef_search), int(limit)), 1000)
+        return {"hnsw.ef_search": str(ef_search)}
+
+    def execute_query(self, sql_query: str, params: tuple = None,
+                      local_settings: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """
+        Выполняет SQL-запрос в PostgreSQL с поддержкой параметров.
+        local_settings применяются через SET LOCAL и действуют только в рамках запроса.
+        """
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    for name, value in (local_settings or {}).items():
+                        cursor.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+
+                    logger.debug(f"Executing SQL: {sql_query}")
+                    logger.debug(f"With params: {params}")
                     
-                results = cursor.fetchall()
-                #logger.debug(f"Raw results from DB: {results}")
-                return results
+                    if params:
+                        cursor.execute(sql_query, params)
+                    else:
+                        cursor.execute(sql_query)
+                        
+                    results = cursor.fetchall()
+                    #logger.debug(f"Raw results from DB: {results}")
+                    return results
         except Exception as e:
             logger.error(f"Database error: {str(e)}", exc_info=True)
-            return []
-        finally:
-            conn.close()
\ No newline at end of file
+            return []
\ No newline at end of file
@@ -1,7 +1,10 @@
 import os
+import queue
 import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
 from pathlib import Path
-from typing import Dict, List, Any, Optional,Union
+from typing import Callable, Dict, Iterator, List, Any, Optional,Union
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage,SystemMessage
 from langchain_core.output_parsers import JsonOutputParser
@@ -9,14 +12,29 @@ from langchain_core.documents import Document
 from core.relational_service import RelationalService
 import json
 from infrastructure.llm_integration import get_gigachat
-from .geo_service import GeoService
+from .geo_service import GeoService, encode_nearby_cursor
 import time
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from infrastructure.embedding_cache import CachedEmbeddings
+from embedding_config import embedding_config
+from infrastructure.llm_cache import get_llm_cache, model_name
+from infrastructure.llm_guard import LLMUnavailable, get_llm_guard
+from infrastructure.request_pipeline import get_executor
+from infrastructure.geometry_simplify import DEFAULT_PRECISION
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+# Версии шаблонов промптов для ключей кэша LLM: увеличивать при изменении текста промпта
+FILTER_PROMPT_VERSION = 1
+ANSWER_PROMPT_VERSION = 1
+# Фильтрация описаний частями: размер части (0 - одним промптом) и число одновременных частей на запрос
+GIGACHAT_FILTER_CHUNK_SIZE = int(os.getenv("GIGACHAT_FILTER_CHUNK_SIZE", "10"))
+GIGACHAT_FILTER_CONCURRENCY = int(os.getenv("GIGACHAT_FILTER_CONCURRENCY", "4"))
+# Потоковый ответ: буфер фрагментов между генерацией GigaChat и клиентом
+GIGACHAT_STREAM_BUFFER = int(os.getenv("GIGACHAT_STREAM_BUFFER", "256"))
+
 class SearchService:
     def __init__(
     self, 
@@ -36,10 +54,14 @@ class SearchService:
         self.geo_service = GeoService()
         self.species_synonyms = self._load_species_synonyms(species_synonyms_path)
         self._build_reverse_synonyms_index()
-        self.embedding_model = HuggingFaceEmbeddings(
-            model_name=embedding_model_path,
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': False}
+        # embed_query кэшируется в памяти и в Redis (см. infrastructure/embedding_cache.py)
+        self.embedding_model = CachedEmbeddings(
+            HuggingFaceEmbeddings(
+                model_name=embedding_model_path,
+                model_kwargs={'device': 'cpu'},
+                encode_kwargs={'normalize_embeddings': False}
+            ),
+            model_name=embedding_config.get_model_name(embedding_model_path)
         )
         self.object_synonyms = self._load_object_synonyms(species_synonyms_path)
         self._build_reverse_object_synonyms_index()
@@ -341,7 +363,8 @@ class SearchService:
                                         query_embedding: List[float], 
                                         limit: int = 10, 
                                         similarity_threshold: float = 0.05,
-                                        in_stoplist: str = "1") -> List[Dict]:
+                                        in_stoplist: str = "1",
+                                        ef_search: Optional[int] = None) -> List[Dict]:
         """Получает текстовые описания объектов с учетом схожести эмбеддингов и in_stoplist"""
         try:
             all_descriptions = []
@@ -356,7 +379,8 @@ class SearchService:
             for entity_type in search_types:
                 # Для всех типов объектов используем реляционный сервис
                 descriptions = self.relational_service.get_object_descriptions_with_embedding(
-                    object_name, entity_type, query_embedding, limit, similarity_threshold, in_stoplist
+                    object_name, entity_type, query_embedding, limit, similarity_threshold, in_stoplist,
+                    ef_search=ef_search
                 )
                 if descriptions:
                     all_descriptions.extend(descriptions)
@@ -374,49 +398,193 @@ class SearchService:
         object_type: str = "all",
         limit: int = 10,
         similarity_threshold: float = 0.05,
-        in_stoplist: str = "1"
+        in_stoplist: str = "1",
+        ef_search: Optional[int] = None
     ) -> List[Dict]:
         """
         Поиск объектов по семантическому сходству с запросом с учетом in_stoplist
         """
+        return self.search_objects_by_embedding_grouped(
+            query_embedding=query_embedding,
+            object_type=object_type,
+            limit=limit,
+            similarity_threshold=similarity_threshold,
+            in_stoplist=in_stoplist,
+            ef_search=ef_search
+        )["results"]
+
+    def search_objects_by_embedding_grouped(
+        self,
+        query_embedding: List[float],
+        object_type: str = "all",
+        limit: int = 10,
+        similarity_threshold: float = 0.05,
+        in_stoplist: str = "1",
+        ef_search: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        Семантический поиск по всем запрошенным типам одним запросом к БД.
+        Возвращает {"results": глобальный top-limit, "by_type": {тип: список}}
+        """
         try:
-            all_descriptions = []
-            
             # Определяем типы объектов для поиска
-            search_types = []
             if object_type == "all":
                 search_types = ["biological_entity", "geographical_entity", "modern_human_made", 
                             "organization", "research_project", "volunteer_initiative", "ancient_human_made"]
             else:
                 search_types = [object_type]
             
-            for entity_type in search_types:
-                # Используем существующий метод реляционного сервиса для поиска по эмбеддингу
-                descriptions = self.relational_service.search_objects_by_embedding_only(
-                    query_embedding=query_embedding,
-                    object_type=entity_type,
-                    limit=limit,
-                    similarity_threshold=similarity_threshold,
-                    in_stoplist=in_stoplist
-                )
-                if descriptions:
-                    all_descriptions.extend(descriptions)
-            
-            # Сортируем по схожести и ограничиваем количество
-            all_descriptions.sort(key=lambda x: x.get("similarity", 0), reverse=True)
-            return all_descriptions[:limit]
+            return self.relational_service.search_objects_by_embedding_multi_type(
+                query_embedding=query_embedding,
+                object_types=search_types,
+                limit=limit,
+                similarity_threshold=similarity_threshold,
+                in_stoplist=in_stoplist,
+                ef_search=ef_search
+            )
                 
         except Exception as e:
             logger.error(f"Ошибка семантического поиска объектов: {str(e)}")
-            return []
+            return {"results": [], "by_type": {}}
     def _generate_gigachat_answer(self, question: str, context: str) -> Dict[str, Any]:
         """
         Генерирует ответ GigaChat на основе вопроса и контекста
-        Возвращает словарь с ответом и метаданными
+        Возвращает словарь с ответом и метаданными.
+        Ответы кэшируются по вопросу и контексту (infrastructure/llm_cache.py), ошибки
+        и отказы LLMGuard (finish_reason "unavailable") - нет.
         """
         llm = self._get_llm()
-        
-        prompt = ChatPromptTemplate.from_messages([
+        return get_llm_cache().get_or_call(
+            "answer",
+            model_name(llm),
+            ANSWER_PROMPT_VERSION,
+            {"question": question, "context": context},
+            lambda: self._call_gigachat_answer(llm, question, context),
+            cacheable=lambda result: result.get("finish_reason") not in ("error", "unavailable")
+        )
+
+    def stream_gigachat_answer(
+        self,
+        question: str,
+        context: str,
+        remaining: Optional[Callable[[], float]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковая генерация ответа GigaChat. События: {"type": "token", "content": ...}
+        по мере генерации, затем {"type": "done", ...} с тем же результатом, что у
+        _generate_gigachat_answer. Ответ из кэша отдается одним фрагментом;
+        собранный поток кэшируется так же, как обычный ответ.
+
+        Поток модели читается в пуле "llm" под LLMGuard в ограниченный буфер, клиенту
+        фрагменты отдаются из буфера уже вне LLMGuard - медленный клиент не держит
+        место LLM и не удлиняет время вызова. remaining - остаток дедлайна запроса:
+        если очередной фрагмент не пришел за это время, поток завершается
+        событием done с finish_reason "deadline".
+        """
+        llm = self._get_llm()
+        cache = get_llm_cache()
+        key, cached = cache.lookup(
+            "answer",
+            model_name(llm),
+            ANSWER_PROMPT_VERSION,
+            {"question": question, "context": context}
+        )
+        if cached is not None:
+            if cached.get("content"):
+                yield {"type": "token", "content": cached["content"]}
+            yield {"type": "done", **cached}
+            return
+
+        buffer: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=GIGACHAT_STREAM_BUFFER)
+        stop = threading.Event()
+        get_executor("llm").submit(self._produce_gigachat_stream, llm, question, context, key, buffer, stop)
+
+        parts = []
+        try:
+            while True:
+                try:
+                    event = buffer.get(timeout=remaining() if remaining else None)
+                except queue.Empty:
+                    logger.warning("⏱️ Потоковая генерация ответа GigaChat не уложилась в дедлайн")
+                    yield {
+                        "type": "done",
+                        "content": "".join(parts).strip(),
+                        "finish_reason": "deadline",
+                        "success": False
+                    }
+                    return
+                if event["type"] == "token":
+                    parts.append(event["content"])
+                yield event
+                if event["type"] == "done":
+                    return
+        finally:
+            # Клиент ушел или дедлайн истек - генерация прекращается на следующем фрагменте
+            stop.set()
+
+    def _produce_gigachat_stream(
+        self,
+        llm: Any,
+        question: str,
+        context: str,
+        key: str,
+        buffer: "queue.Queue[Dict[str, Any]]",
+        stop: threading.Event
+    ) -> None:
+        """Чтение потока GigaChat под LLMGuard в буфер; при stop поток модели закрывается"""
+        def put(event: Dict[str, Any]) -> bool:
+            while not stop.is_set():
+                try:
+                    buffer.put(event, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        start = time.perf_counter()
+        parts = []
+        finish_reason = None
+        try:
+            chain = self._answer_prompt(question, context) | llm
+            with get_llm_guard().call("answer_stream"):
+                stream = chain.stream({"question": question, "context": context})
+                try:
+                    for chunk in stream:
+                        metadata = getattr(chunk, "response_metadata", None) or {}
+                        finish_reason = metadata.get("finish_reason") or finish_reason
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            if not put({"type": "token", "content": chunk.content}):
+                                return
+                finally:
+                    close = getattr(stream, "close", None)
+                    if close:
+                        close()
+        except LLMUnavailable as e:
+            logger.warning(f"Потоковая генерация ответа без GigaChat: {str(e)}")
+            put({"type": "done", "content": "", "finish_reason": "unavailable", "success": False})
+            return
+        except Exception as e:
+            logger.error(f"Ошибка потоковой генерации ответа GigaChat: {str(e)}")
+            put({
+                "type": "done",
+                "content": "".join(parts).strip(),
+                "finish_reason": "error",
+                "success": False
+            })
+            return
+
+        result = {
+            "content": "".join(parts).strip(),
+            "finish_reason": finish_reason,
+            "success": finish_reason != 'blacklist'
+        }
+        get_llm_cache().store("answer", key, result, (time.perf_counter() - start) * 1000)
+        put({"type": "done", **result})
+
+    def _answer_prompt(self, question: str, context: str) -> ChatPromptTemplate:
+        """Промпт ответа на вопрос по контексту (версия - ANSWER_PROMPT_VERSION)"""
+        return ChatPromptTemplate.from_messages([
             ("system", (
                 "Ты эксперт по Байкальской природной территории. "
                 "Используй твою базу знаний для точных ответов на вопросы пользователя.\n\n"
@@ -430,12 +598,16 @@ class SearchService:
                 "Ответ:"
             ))
         ])
+
+    def _call_gigachat_answer(self, llm: Any, question: str, context: str) -> Dict[str, Any]:
+        """Запрос ответа у GigaChat без кэша"""
         
         try:
-            chain = prompt | llm
+            chain = self._answer_prompt(question, context) | llm
             
             # Получаем полный ответ с метаданными
-            response = chain.invoke({"question": question, "context": context})
+            with get_llm_guard().call("answer"):
+                response = chain.invoke({"question": question, "context": context})
             
             # ДИАГНОСТИКА: Логируем всю структуру ответа
             logger.debug(f"Полный ответ GigaChat: {response}")
@@ -472,6 +644,15 @@ class SearchService:
                 "finish_reason": finish_reason,
                 "success": finish_reason != 'blacklist'
             }
+
+        except LLMUnavailable as e:
+            # GigaChat перегружен или недоступен - без ожидания переходим на ответ без LLM
+            logger.warning(f"Генерация ответа без GigaChat: {str(e)}")
+            return {
+                "content": "Извините, не удалось сгенерировать ответ на основе доступной информации.",
+                "finish_reason": "unavailable",
+                "success": False
+            }
             
         except Exception as e:
             logger.error(f"Ошибка генерации ответа GigaChat: {str(e)}")
@@ -494,7 +675,8 @@ class SearchService:
     def search_images_by_features(
     self,
     species_name: str,
-    features: Dict[str, Any]
+    features: Dict[str, Any],
+    in_stoplist: str = "1"
 ) -> Dict[str, Any]:
         """
         Поиск изображений по названию вида и признакам
@@ -502,6 +684,7 @@ class SearchService:
         Args:
             species_name: Название биологического вида
             features: Словарь с признаками для фильтрации
+            in_stoplist: Максимальный уровень in_stoplist изображений
             
         Returns:
             Результаты поиска изображений
@@ -512,7 +695,8 @@ class SearchService:
             return self.relational_service.search_images_by_features(
                 species_name=species_name,
                 features=features,
-                synonyms_data=synonyms_data
+                synonyms_data=synonyms_data,
+                in_stoplist=in_stoplist
             )
         except Exception as e:
             logger.error(f"Ошибка поиска изображений по признакам: {str(e)}")
@@ -550,17 +734,106 @@ class SearchService:
             logger.error(f"Ошибка получения описания через RelationalService: {str(e)}")
             return []
         
-    def filter_text_descriptions_with_gigachat(self, user_query: str, descriptions: List[Dict]) -> List[Dict]:
-        """Фильтрация текстовых описаний видов через GigaChat"""
+    def filter_text_descriptions_with_gigachat(
+        self,
+        user_query: str,
+        descriptions: List[Dict],
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Фильтрация текстовых описаний видов через GigaChat.
+        Индексы релевантных описаний кэшируются по запросу и текстам описаний
+        (infrastructure/llm_cache.py); при ошибке возвращаются все описания.
+
+        Больше GIGACHAT_FILTER_CHUNK_SIZE описаний фильтруются частями параллельно
+        (_filter_chunks_parallel); limit - сколько релевантных описаний достаточно для ответа.
+        """
         llm = self._get_llm()
         
         if not descriptions:
             return []
+
+        chunk_size = GIGACHAT_FILTER_CHUNK_SIZE
+        if chunk_size > 0 and len(descriptions) > chunk_size:
+            return self._filter_chunks_parallel(llm, user_query, descriptions, chunk_size, limit)
+
+        try:
+            return [descriptions[i] for i in self._filter_chunk(llm, user_query, descriptions)]
+        except Exception as e:
+            logger.error(f"Ошибка фильтрации описаний через GigaChat: {str(e)}")
+            return descriptions
+
+    def _filter_chunk(self, llm: Any, user_query: str, descriptions: List[Dict]) -> List[int]:
+        """Индексы релевантных описаний одного промпта (с кэшем, исключения пробрасываются)"""
         descriptions_text = "\n\n".join(
             f"Описание {i+1}:\n{desc.get('content', '')[:800]}..."
             for i, desc in enumerate(descriptions)
         )
-        
+        relevant_indices = get_llm_cache().get_or_call(
+            "filter",
+            model_name(llm),
+            FILTER_PROMPT_VERSION,
+            {"query": user_query, "descriptions": descriptions_text},
+            lambda: self._gigachat_relevant_indices(llm, user_query, descriptions_text, len(descriptions))
+        )
+        return [i for i in relevant_indices if 0 <= i < len(descriptions)]
+
+    def _filter_chunks_parallel(
+        self,
+        llm: Any,
+        user_query: str,
+        descriptions: List[Dict],
+        chunk_size: int,
+        limit: Optional[int]
+    ) -> List[Dict]:
+        """
+        Фильтрация частями по chunk_size описаний, не больше GIGACHAT_FILTER_CONCURRENCY
+        частей одновременно. Ошибка части оставляет только ее описания нефильтрованными.
+        Описания отсортированы по релевантности поиска, поэтому досрочный выход - когда
+        в готовом префиксе частей набралось limit релевантных: следующие части уже
+        не попадут в ответ, их запросы отменяются.
+        """
+        chunks = [descriptions[start:start + chunk_size] for start in range(0, len(descriptions), chunk_size)]
+        executor = get_executor("llm")
+        results: Dict[int, List[Dict]] = {}
+        pending = {}
+        next_chunk = 0
+        done_prefix = 0
+        found_in_prefix = 0
+
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < max(1, GIGACHAT_FILTER_CONCURRENCY):
+                future = executor.submit(self._filter_chunk, llm, user_query, chunks[next_chunk])
+                pending[future] = next_chunk
+                next_chunk += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                chunk = chunks[index]
+                try:
+                    results[index] = [chunk[i] for i in sorted(set(future.result()))]
+                except Exception as e:
+                    logger.error(f"Ошибка фильтрации части {index + 1}/{len(chunks)} через GigaChat: {str(e)}")
+                    results[index] = chunk
+
+            while done_prefix in results:
+                found_in_prefix += len(results[done_prefix])
+                done_prefix += 1
+
+            if limit and found_in_prefix >= limit and done_prefix < len(chunks):
+                for future in pending:
+                    future.cancel()
+                logger.info(
+                    f"Фильтрация GigaChat: найдено {found_in_prefix} релевантных описаний "
+                    f"в {done_prefix} из {len(chunks)} частей, остальные части пропущены"
+                )
+                break
+
+        return [desc for index in range(done_prefix) for desc in results[index]]
+
+    def _gigachat_relevant_indices(self, llm: Any, user_query: str, descriptions_text: str, count: int) -> List[int]:
+        """Запрос к GigaChat: индексы релевантных описаний (без кэша, исключения пробрасываются)"""
         prompt = ChatPromptTemplate.from_messages([
             SystemMessage(content=(
                 "Ты эксперт по биологическим видам Байкальского региона. Фильтруй текстовые описания СТРОГО по релевантности запросу.\n\n"
@@ -597,67 +870,65 @@ class SearchService:
                 "ПРОАНАЛИЗИРУЙ и ВЕРНИ JSON ОТВЕТ БЕЗ КОММЕНТАРИЕВ:"
             ))
         ])
-        try:
-            chain = prompt | llm | JsonOutputParser()
-            response = chain.invoke({"user_query": user_query, "descriptions": descriptions_text})
-            logger.debug(response)
-            if response.get("no_relevant_descriptions", False):
-                return []
-                
-            # Безопасная обработка индексов
-            relevant_indices = []
-            raw_indices = response.get("relevant_descriptions", [])
-            
-            logger.debug(f"Raw indices from LLM: {raw_indices}, type: {type(raw_indices)}")
-            
-            # Обработка различных форматов ответа
-            if isinstance(raw_indices, (int, str)):
-                raw_indices = [raw_indices]
-                
-            for idx in raw_indices:
-                try:
-                    # Если это строка, пытаемся преобразовать в число
-                    if isinstance(idx, str):
-                        # Обработка строковых представлений срезов
-                        if ':' in idx:
-                            try:
-                                parts = idx.split(':')
-                                start = int(parts[0]) if parts[0] else 0
-                                stop = int(parts[1]) if parts[1] else len(descriptions)
-                                step = int(parts[2]) if len(parts) > 2 and parts[2] else 1
-                                slice_indices = list(range(start, stop, step))
-                                for slice_idx in slice_indices:
-                                    if 0 <= slice_idx < len(descriptions):
-                                        relevant_indices.append(slice_idx)
-                            except ValueError:
-                                continue
-                        else:
-                            # Обычное число в строке
-                            try:
-                                num_idx = int(idx)
-                                if 0 <= num_idx < len(descriptions):
-                                    relevant_indices.append(num_idx)
-                            except ValueError:
-                                continue
-                    # Если это число
-                    elif isinstance(idx, int):
-                        if 0 <= idx < len(descriptions):
-                            relevant_indices.append(idx)
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"Invalid index '{idx}': {e}")
-                    continue
-            # Убираем дубликаты и сортируем
-            relevant_indices = sorted(set(relevant_indices))
-            if not relevant_indices:
-                logger.debug("No relevant indices found after processing")
-                return []
-            logger.debug(f"Processed indices: {relevant_indices}")
+        chain = prompt | llm
+        with get_llm_guard().call("filter"):
+            message = chain.invoke({"user_query": user_query, "descriptions": descriptions_text})
+        # Разбор JSON вне LLMGuard: невалидный JSON - ошибка ответа, а не доступности GigaChat
+        response = JsonOutputParser().invoke(message)
+        logger.debug(response)
+        if response.get("no_relevant_descriptions", False):
+            return []
             
-            return [descriptions[i] for i in relevant_indices]
+        # Безопасная обработка индексов
+        relevant_indices = []
+        raw_indices = response.get("relevant_descriptions", [])
+        
+        logger.debug(f"Raw indices from LLM: {raw_indices}, type: {type(raw_indices)}")
+        
+        # Обработка различных форматов ответа
+        if isinstance(raw_indices, (int, str)):
+            raw_indices = [raw_indices]
             
-        except Exception as e:
-            logger.error(f"Ошибка фильтрации описаний через GigaChat: {str(e)}")
-            return descriptions
+        for idx in raw_indices:
+            try:
+                # Если это строка, пытаемся преобразовать в число
+                if isinstance(idx, str):
+                    # Обработка строковых представлений срезов
+                    if ':' in idx:
+                        try:
+                            parts = idx.split(':')
+                            start = int(parts[0]) if parts[0] else 0
+                            stop = int(parts[1]) if parts[1] else count
+                            step = int(parts[2]) if len(parts) > 2 and parts[2] else 1
+                            slice_indices = list(range(start, stop, step))
+                            for slice_idx in slice_indices:
+                                if 0 <= slice_idx < count:
+                                    relevant_indices.append(slice_idx)
+                        except ValueError:
+                            continue
+                    else:
+                        # Обычное число в строке
+                        try:
+                            num_idx = int(idx)
+                            if 0 <= num_idx < count:
+                                relevant_indices.append(num_idx)
+                        except ValueError:
+                            continue
+                # Если это число
+                elif isinstance(idx, int):
+                    if 0 <= idx < count:
+                        relevant_indices.append(idx)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Invalid index '{idx}': {e}")
+                continue
+        # Убираем дубликаты и сортируем
+        relevant_indices = sorted(set(relevant_indices))
+        if not relevant_indices:
+            logger.debug("No relevant indices found after processing")
+            return []
+        logger.debug(f"Processed indices: {relevant_indices}")
+        
+        return relevant_indices
 
     def get_objects_in_area_by_type(
     self,
@@ -667,7 +938,9 @@ class SearchService:
     object_name: Optional[str] = None,
     limit: int = 70,
     search_around: bool = False,  # Новый параметр
-    buffer_radius_km: float = 10.0  # Новый параметр
+    buffer_radius_km: float = 10.0,  # Новый параметр
+    simplify_tolerance_m: Optional[float] = None,
+    precision: int = DEFAULT_PRECISION
 ) -> Dict[str, Any]:
         """
         Поиск объектов в заданной области с фильтрацией по типу и имени
@@ -681,7 +954,9 @@ class SearchService:
                 object_name=object_name,
                 limit=limit,
                 search_around=search_around,
-                buffer_radius_km=buffer_radius_km
+                buffer_radius_km=buffer_radius_km,
+                simplify_tolerance_m=simplify_tolerance_m,
+                precision=precision
             )
             
             if not results:
@@ -791,7 +1066,10 @@ class SearchService:
     polygon_geojson: dict,
     buffer_radius_km: float = 0,
     object_type: str = None,
-    limit: int = 70
+    limit: int = 70,
+    in_stoplist: Union[str, int] = 1,
+    simplify_tolerance_m: Optional[float] = None,
+    precision: int = DEFAULT_PRECISION
 ) -> Dict[str, Any]:
         """Поиск объектов внутри полигона и в буферной зоне"""
         try:
@@ -799,7 +1077,10 @@ class SearchService:
                 polygon_geojson=polygon_geojson,
                 buffer_radius_km=buffer_radius_km,
                 object_type=object_type,
-                limit=limit
+                limit=limit,
+                in_stoplist=in_stoplist,
+                simplify_tolerance_m=simplify_tolerance_m,
+                precision=precision
             )
             
             if not results:
@@ -822,7 +1103,8 @@ class SearchService:
                     "name": obj["name"],
                     "distance": f"{obj['distance_km']:.1f} км от центра",
                     "type": obj_type,
-                    "geojson": obj["geojson"]
+                    "geojson": obj["geojson"],
+                    "map_content_id": obj.get("map_content_id")
                 }
                 
                 if obj_type == "biological_entity":
@@ -865,7 +1147,8 @@ class SearchService:
     limit: int = 20,
     object_type: str = None,
     species_name: Optional[Union[str, List[str]]] = None,
-    in_stoplist: int = 1  # Добавить параметр
+    in_stoplist: int = 1,  # Добавить параметр
+    cursor: Optional[str] = None
 ) -> Dict[str, Any]:
         try:
             # Исправленный вызов GeoService
@@ -877,7 +1160,8 @@ class SearchService:
                 limit=limit,
                 object_type=object_type,
                 species_name=species_name,
-                in_stoplist=in_stoplist  # Передать параметр
+                in_stoplist=in_stoplist,  # Передать параметр
+                cursor=cursor
             )
             logger.info(f"Nearby objects search took: {time.perf_counter() - start:.2f}s")
             if not results:
@@ -897,7 +1181,8 @@ class SearchService:
                     "name": obj["name"],
                     "distance": f"{obj['distance_km']:.1f} км",
                     "type": obj_type,
-                    "geojson": obj["geojson"]
+                    "geojson": obj["geojson"],
+                    "map_content_id": obj.get("map_content_id")
                 }
                 # Добавляем описание, если есть
                 if obj.get("description"):
@@ -909,9 +1194,13 @@ class SearchService:
             type_summary = ", ".join([f"{count} {type_name}" for type_name, count in type_counts.items()])
             answer = f"Найдено {total_count} объектов поблизости ({type_summary})"
             
+            # Полная страница - возможно, есть объекты дальше
+            next_cursor = encode_nearby_cursor(results[-1]) if len(results) >= limit else None
+            
             return {
                 "answer": answer,
-                "objects": formatted_results
+                "objects": formatted_results,
+                "next_cursor": next_cursor
             }
  
         except Exception as e:
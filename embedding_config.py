@@ -92,6 +92,14 @@ class EmbeddingConfig:
         else:
             raise ValueError(f"Модель {model_name} не найдена в конфигурации")
     
+    def get_model_name(self, model_path: str) -> str:
+        """Имя модели по пути, из которого она загружена (неизвестный путь - сам путь)"""
+        normalized = os.path.normpath(str(model_path))
+        for model_name, path in self.MODEL_PATHS.items():
+            if os.path.normpath(path) == normalized:
+                return model_name
+        return normalized
+
     def get_active_model(self) -> tuple:
         """Получить текущую активную модель и путь"""
         return self.current_model, self.current_model_path
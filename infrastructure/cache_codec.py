@@ -0,0 +1,215 @@
+"""
+Кодек значений Redis-кэша ответов API.
+
+Формат записи: заголовок MAGIC + версия + сериализатор + сжатие, затем данные.
+Сериализация - orjson или ormsgpack, крупные значения дополнительно сжимаются zstd.
+Записи без заголовка считаются старым форматом (json.dumps) и читаются как раньше.
+
+Настройки через переменные окружения:
+    CACHE_CODEC                 - "orjson" (по умолчанию) или "msgpack"
+    CACHE_COMPRESSION           - "zstd" (по умолчанию) или "none"
+    CACHE_COMPRESS_THRESHOLD    - сжимать значения больше стольких байт (4096)
+    CACHE_ZSTD_LEVEL            - уровень сжатия zstd (3)
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ormsgpack
+except ImportError:  # pragma: no cover
+    ormsgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"\x00ec"
+VERSION = 1
+
+SERIALIZER_JSON = ord("j")
+SERIALIZER_ORJSON = ord("o")
+SERIALIZER_MSGPACK = ord("m")
+
+COMPRESSION_NONE = ord("n")
+COMPRESSION_ZSTD = ord("z")
+
+HEADER_SIZE = len(MAGIC) + 3
+
+COMPRESS_THRESHOLD = int(os.getenv("CACHE_COMPRESS_THRESHOLD", "4096"))
+ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+
+
+class CacheCodecError(Exception):
+    """Запись кэша не удалось декодировать"""
+
+
+def _select_serializer() -> int:
+    name = os.getenv("CACHE_CODEC", "orjson").lower()
+    if name == "msgpack" and ormsgpack is not None:
+        return SERIALIZER_MSGPACK
+    if name in ("orjson", "msgpack") and orjson is not None:
+        return SERIALIZER_ORJSON
+    logger.warning(f"Кодек кэша '{name}' недоступен, используется json")
+    return SERIALIZER_JSON
+
+
+def _select_compression() -> int:
+    if os.getenv("CACHE_COMPRESSION", "zstd").lower() == "zstd" and zstandard is not None:
+        return COMPRESSION_ZSTD
+    return COMPRESSION_NONE
+
+
+_serializer = _select_serializer()
+_compression = _select_compression()
+
+# zstd-компрессоры не потокобезопасны - держим по экземпляру на поток
+_local = threading.local()
+
+
+def _zstd_compressor():
+    if not hasattr(_local, "compressor"):
+        _local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return _local.compressor
+
+
+def _zstd_decompressor():
+    if not hasattr(_local, "decompressor"):
+        _local.decompressor = zstandard.ZstdDecompressor()
+    return _local.decompressor
+
+
+def _serialize(value: Any, serializer: int) -> bytes:
+    if serializer == SERIALIZER_ORJSON:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    if serializer == SERIALIZER_MSGPACK:
+        return ormsgpack.packb(value, option=ormsgpack.OPT_NON_STR_KEYS)
+    return json.dumps(value).encode("utf-8")
+
+
+def _deserialize(payload: bytes, serializer: int) -> Any:
+    if serializer == SERIALIZER_ORJSON:
+        return orjson.loads(payload)
+    if serializer == SERIALIZER_MSGPACK:
+        return ormsgpack.unpackb(payload)
+    if serializer == SERIALIZER_JSON:
+        return json.loads(payload)
+    raise CacheCodecError(f"Неизвестный сериализатор: {serializer}")
+
+
+class CodecStats:
+    """Статистика кодека по пространствам имен ключей (cache:<namespace>:...)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    def record(self, namespace: str, **values: float) -> None:
+        with self._lock:
+            ns = self._stats[namespace]
+            for name, value in values.items():
+                ns[name] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for namespace, ns in self._stats.items():
+                raw, stored = ns.get("raw_bytes", 0), ns.get("stored_bytes", 0)
+                result[namespace] = {
+                    "encoded": int(ns.get("encoded", 0)),
+                    "decoded": int(ns.get("decoded", 0)),
+                    "legacy_decoded": int(ns.get("legacy_decoded", 0)),
+                    "compressed": int(ns.get("compressed", 0)),
+                    "raw_bytes": int(raw),
+                    "stored_bytes": int(stored),
+                    "compression_ratio": round(raw / stored, 3) if stored else None,
+                    "encode_time_ms": round(ns.get("encode_time_ms", 0), 2),
+                    "decode_time_ms": round(ns.get("decode_time_ms", 0), 2)
+                }
+            return result
+
+
+codec_stats = CodecStats()
+
+
+def namespace_of(cache_key: str) -> str:
+    """cache:area_search:HASH -> area_search"""
+    parts = cache_key.split(":")
+    return parts[1] if len(parts) >= 3 else "default"
+
+
+def encode_value(value: Any, namespace: str = "default") -> bytes:
+    """Сериализует значение в формат кэша с заголовком"""
+    start = time.perf_counter()
+    payload = _serialize(value, _serializer)
+    raw_size = len(payload)
+    compression = COMPRESSION_NONE
+    if _compression == COMPRESSION_ZSTD and raw_size > COMPRESS_THRESHOLD:
+        payload = _zstd_compressor().compress(payload)
+        compression = COMPRESSION_ZSTD
+    data = MAGIC + bytes((VERSION, _serializer, compression)) + payload
+    codec_stats.record(
+        namespace,
+        encoded=1,
+        compressed=1 if compression == COMPRESSION_ZSTD else 0,
+        raw_bytes=raw_size,
+        stored_bytes=len(data),
+        encode_time_ms=(time.perf_counter() - start) * 1000
+    )
+    return data
+
+
+def decode_value(data: bytes, namespace: str = "default") -> Any:
+    """Декодирует запись кэша; записи старого формата (json без заголовка) тоже поддерживаются"""
+    start = time.perf_counter()
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    if not data.startswith(MAGIC):
+        value = json.loads(data)
+        codec_stats.record(namespace, decoded=1, legacy_decoded=1,
+                           decode_time_ms=(time.perf_counter() - start) * 1000)
+        return value
+
+    if len(data) < HEADER_SIZE:
+        raise CacheCodecError("Запись кэша короче заголовка")
+    version, serializer, compression = data[len(MAGIC):HEADER_SIZE]
+    if version != VERSION:
+        raise CacheCodecError(f"Неподдерживаемая версия формата кэша: {version}")
+
+    payload = data[HEADER_SIZE:]
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise CacheCodecError("Запись сжата zstd, но zstandard не установлен")
+        payload = _zstd_decompressor().decompress(payload)
+    elif compression != COMPRESSION_NONE:
+        raise CacheCodecError(f"Неизвестный тип сжатия: {compression}")
+
+    value = _deserialize(payload, serializer)
+    codec_stats.record(namespace, decoded=1, decode_time_ms=(time.perf_counter() - start) * 1000)
+    return value
+
+
+_SERIALIZER_NAMES = {SERIALIZER_JSON: "json", SERIALIZER_ORJSON: "orjson", SERIALIZER_MSGPACK: "msgpack"}
+_COMPRESSION_NAMES = {COMPRESSION_NONE: "none", COMPRESSION_ZSTD: "zstd"}
+
+
+def get_codec_stats() -> Dict[str, Any]:
+    return {
+        "serializer": _SERIALIZER_NAMES[_serializer],
+        "compression": _COMPRESSION_NAMES[_compression],
+        "compress_threshold": COMPRESS_THRESHOLD,
+        "namespaces": codec_stats.snapshot()
+    }
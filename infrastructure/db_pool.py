@@ -0,0 +1,264 @@
+"""
+Пул соединений PostgreSQL, общий для всех сервисов одного воркера gunicorn.
+
+Вместо psycopg2.connect() на каждый запрос сервисы берут соединение из пула
+через get_db_connection(). Пул создается лениво при первом обращении и
+пересоздается после fork, поэтому у каждого воркера он свой.
+
+Свободные соединения пул хранит сам (не больше maxconn) и не закрывает при
+возврате - в отличие от ThreadedConnectionPool, который закрывает все возвращенные
+соединения сверх minconn. Новое соединение открывается, только если свободных нет,
+поэтому параллельные этапы запроса после прогрева не подключаются заново.
+
+Настройки через переменные окружения:
+    DB_POOL_MIN                   - сколько соединений открыть сразу (1)
+    DB_POOL_MAX                   - максимальное число соединений (10)
+    DB_POOL_TIMEOUT               - сколько секунд ждать свободное соединение (5)
+    DB_POOL_HEALTHCHECK_INTERVAL  - после скольких секунд простоя проверять
+                                    соединение через SELECT 1 (30)
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+def get_db_config() -> Dict[str, str]:
+    """Параметры подключения к БД из переменных окружения"""
+    return {
+        "dbname": os.getenv("DB_NAME", "eco"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "Fdf78yh0a4b!"),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432")
+    }
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведенное время"""
+
+
+class DatabasePool:
+    def __init__(
+        self,
+        db_config: Dict[str, str],
+        minconn: int = 1,
+        maxconn: int = 10,
+        checkout_timeout: float = 5.0,
+        healthcheck_interval: float = 30.0
+    ):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._db_config = db_config
+
+        # Выданных соединений не больше maxconn: ожидание свободного слота - семафором
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # Свободные соединения: (соединение, время возврата), последнее возвращенное - в конце
+        # (только под self._lock)
+        self._idle: List[Tuple[Any, float]] = []
+
+        self._opened = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+        for _ in range(min(minconn, maxconn)):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        """Новое соединение; строки - словари, как у прежнего psycopg2.connect(..., cursor_factory=RealDictCursor)"""
+        conn = psycopg2.connect(cursor_factory=RealDictCursor, **self._db_config)
+        with self._lock:
+            self._opened += 1
+        return conn
+
+    @staticmethod
+    def _close(conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """Берет соединение из пула, при необходимости ожидая освобождения"""
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            with self._lock:
+                self._waits += 1
+                self._waiting += 1
+            acquired = self._slots.acquire(timeout=self.checkout_timeout)
+            waited = time.perf_counter() - start
+            with self._lock:
+                self._waiting -= 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+                if not acquired:
+                    self._timeouts += 1
+            if not acquired:
+                raise PoolTimeoutError(
+                    f"Нет свободных соединений в пуле за {self.checkout_timeout} с (max={self.maxconn})"
+                )
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return conn
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        """Возвращает соединение в пул; сломанные соединения закрываются"""
+        try:
+            if not broken and not conn.closed:
+                try:
+                    # Сбрасываем открытую транзакцию и SET LOCAL настройки
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            broken = broken or bool(conn.closed)
+            if not broken:
+                with self._lock:
+                    # Выдано не больше maxconn, так что предел сработает только при лишнем putconn
+                    if len(self._idle) < self.maxconn:
+                        self._idle.append((conn, time.monotonic()))
+                        conn = None
+            if conn is not None:
+                if broken:
+                    with self._lock:
+                        self._discarded += 1
+                self._close(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _checkout_healthy(self):
+        """
+        Последнее возвращенное свободное соединение (проверяется, если долго простаивало);
+        если свободных нет - новое, без проверки
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, idle_since = self._idle.pop()
+            if self._is_healthy(conn, idle_since):
+                return conn
+            with self._lock:
+                self._discarded += 1
+            self._close(conn)
+        return self._connect()
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Соединение из пула не прошло проверку: {e}")
+            return False
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "opened": self._opened,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total_ms": round(self._wait_time_total * 1000, 2),
+                "wait_time_avg_ms": round(self._wait_time_total * 1000 / self._waits, 2) if self._waits else 0.0,
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 2),
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "checkout_timeout_s": self.checkout_timeout
+            }
+
+    def closeall(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+_pool: Optional[DatabasePool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> DatabasePool:
+    """Возвращает пул текущего процесса, создавая его при первом обращении"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # После fork соединения родителя использовать нельзя - просто забываем их
+            _pool = DatabasePool(
+                get_db_config(),
+                minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                checkout_timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+                healthcheck_interval=float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30"))
+            )
+            _pool_pid = pid
+            logger.info(f"Создан пул соединений PostgreSQL (pid={pid}, min={_pool.minconn}, max={_pool.maxconn})")
+    return _pool
+
+
+@contextmanager
+def get_db_connection() -> Iterator[Any]:
+    """Контекстный менеджер: соединение из пула с автоматическим возвратом"""
+    with get_db_pool().connection() as conn:
+        yield conn
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Метрики пула текущего воркера"""
+    if _pool is None or _pool_pid != os.getpid():
+        return {"initialized": False, "pid": os.getpid()}
+    return {"initialized": True, **_pool.stats()}
@@ -1,33 +1,44 @@
-import psycopg2
+import json
+import base64
+from typing import Optional
+
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
-import os
+
+from infrastructure.db_pool import get_db_config, get_db_connection
 
 load_dotenv()
 
+
+def encode_title_cursor(title: str) -> str:
+    """Непрозрачный курсор страницы: последний заголовок в base64"""
+    payload = json.dumps({"after": title}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_title_cursor(cursor: str) -> str:
+    """Последний заголовок из курсора; ValueError для некорректного значения"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return str(json.loads(base64.urlsafe_b64decode(padded))["after"])
+    except Exception as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+
 class Slot_validator:
     def __init__(self):
-        self.db_config = {
-            "dbname": os.getenv("DB_NAME", "eco"),
-            "user": os.getenv("DB_USER", "postgres"),
-            "password": os.getenv("DB_PASSWORD", "Fdf78yh0a4b!"),
-            "host": os.getenv("DB_HOST", "localhost"),
-            "port": os.getenv("DB_PORT", "5432")
-        }
+        self.db_config = get_db_config()
     
     def is_known_object(self, object_name: str) -> dict:
 
-        conn = psycopg2.connect(**self.db_config)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
+        # ILIKE по name_ru использует триграммный индекс (LOWER(name_ru) LIKE - нет)
         query = """
         SELECT name_ru FROM resource_identifiers
-        WHERE LOWER(name_ru) LIKE %s
+        WHERE name_ru ILIKE %s
         """
-        cursor.execute(query, (f'%{object_name.lower()}%',))
-        
-        results = cursor.fetchall()
-        conn.close()
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, (f'%{object_name.lower()}%',))
+            results = cursor.fetchall()
 
         matches = [row['name_ru'] for row in results]
 
@@ -38,46 +49,53 @@ class Slot_validator:
         else:
             return {"known": "ambiguous", "matches": matches}
         
-    def find_species_with_description(self, object_name: str, limit: int = 5, offset: int = 0) -> dict:
-        conn = psycopg2.connect(**self.db_config)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+    def find_species_with_description(
+        self,
+        object_name: str,
+        limit: int = 5,
+        offset: int = 0,
+        cursor: Optional[str] = None
+    ) -> dict:
+        """
+        Постраничный поиск заголовков описаний по keyset-курсору.
+        Курсор хранит последний заголовок страницы; выбирается limit+1 строк,
+        лишняя строка только показывает, есть ли следующая страница.
+        offset поддерживается для старых клиентов, если курсор не передан.
+        """
+        after_title = None
+        if cursor:
+            try:
+                after_title = decode_title_cursor(cursor)
+            except ValueError as e:
+                return {"status": "error", "message": str(e), "matches": [], "has_more": False}
 
-        # Запрос для получения текущей "страницы" результатов
         query = """
         SELECT DISTINCT title FROM text_content
         WHERE 
-            title ~* %s
+            title ~* %(pattern)s
             AND (content IS NOT NULL AND content != '' OR structured_data IS NOT NULL AND structured_data::text != '{}'::text)
+            AND (%(after_title)s::text IS NULL OR title > %(after_title)s::text)
         ORDER BY title
-        LIMIT %s OFFSET %s;
-        """
-        
-        # Запрос для проверки, есть ли еще результаты (проверяем наличие хотя бы одной записи после текущего offset+limit)
-        check_more_query = """
-        SELECT 1 FROM text_content
-        WHERE title ~* %s
-        AND (content IS NOT NULL AND content != '' OR structured_data IS NOT NULL AND structured_data::text != '{}'::text)
-        OFFSET %s LIMIT 1;
+        LIMIT %(fetch_limit)s OFFSET %(offset)s;
         """
+        params = {
+            "pattern": rf'\y{object_name.lower()}\y',
+            "after_title": after_title,
+            "fetch_limit": limit + 1,
+            "offset": 0 if cursor else offset
+        }
 
-        try:
-            search_pattern = rf'\y{object_name.lower()}\y'
-            
-            # Выполняем основной запрос
-            cursor.execute(query, (search_pattern, limit, offset))
-            results = cursor.fetchall()
-            matches = [row['title'] for row in results]
-
-            # Выполняем запрос для проверки наличия следующих страниц
-            cursor.execute(check_more_query, (search_pattern, offset + limit))
-            has_more = cursor.fetchone() is not None
+        with get_db_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as db_cursor:
+            db_cursor.execute(query, params)
+            results = db_cursor.fetchall()
 
-            if not matches:
-                return {"status": "not_found", "matches": [], "has_more": False}
-            elif len(matches) == 1:
-                return {"status": "found", "matches": matches, "has_more": False}
-            else:
-                return {"status": "ambiguous", "matches": matches, "has_more": has_more}
+        matches = [row['title'] for row in results[:limit]]
+        has_more = len(results) > limit
+        next_cursor = encode_title_cursor(matches[-1]) if has_more else None
 
-        finally:
-            conn.close()
\ No newline at end of file
+        if not matches:
+            return {"status": "not_found", "matches": [], "has_more": False, "next_cursor": None}
+        elif len(matches) == 1 and not has_more:
+            return {"status": "found", "matches": matches, "has_more": False, "next_cursor": None}
+        else:
+            return {"status": "ambiguous", "matches": matches, "has_more": has_more, "next_cursor": next_cursor}
@@ -0,0 +1,152 @@
+"""
+Двухуровневый кэш эмбеддингов запросов перед HuggingFaceEmbeddings.embed_query.
+
+L1 - LRU-словарь в памяти процесса, L2 - Redis (значения хранятся как float32 байты).
+Ключ строится из нормализованного текста запроса и имени модели, которая реально
+загружена в обертку (model_name передается при создании). Переключение
+active_model.json без перезапуска воркеров не меняет загруженную модель, поэтому
+и ключи не меняются - векторы одной модели не попадают под ключи другой.
+
+Настройки через переменные окружения:
+    EMBEDDING_CACHE_SIZE  - размер L1 (1024 записи)
+    EMBEDDING_CACHE_TTL   - время жизни записи в Redis, секунд (7 дней)
+"""
+import os
+import re
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import numpy as np
+
+import utils
+from embedding_config import get_model_dimension
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Нормализация текста запроса: Unicode NFC и схлопывание пробелов"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+class CachedEmbeddings:
+    """
+    Обертка над моделью эмбеддингов с кэшированием embed_query.
+    Остальные методы (embed_documents и т.д.) передаются модели без изменений.
+    """
+
+    def __init__(self, embeddings: Any, model_name: str, max_size: int = None, ttl: int = None):
+        self.embeddings = embeddings
+        self.max_size = max_size or int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+        self.ttl = ttl or int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+
+        self._l1: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Имя загруженной модели: от него зависят ключи кэша и проверка размерности
+        self._model_name = model_name
+
+        self._l1_hits = 0
+        self._l2_hits = 0
+        self._misses = 0
+        self._errors = 0
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    @staticmethod
+    def _make_key(model_name: str, text: str) -> str:
+        text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return f"cache:embedding:{model_name}:{text_hash}"
+
+    def embed_query(self, text: str) -> List[float]:
+        normalized = normalize_query(text)
+        model_name = self._model_name
+        key = self._make_key(model_name, normalized)
+
+        with self._lock:
+            cached = self._l1.get(key)
+            if cached is not None:
+                self._l1.move_to_end(key)
+                self._l1_hits += 1
+                return list(cached)
+
+        vector = self._get_from_redis(key, model_name)
+        if vector is not None:
+            with self._lock:
+                self._l2_hits += 1
+            self._put_l1(key, vector)
+            return list(vector)
+
+        with self._lock:
+            self._misses += 1
+        raw = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+        # L1 и Redis отдают одинаковые float32 значения, что бы ни вернула модель
+        vector = raw.tolist()
+        self._put_l1(key, vector)
+        self._set_to_redis(key, raw)
+        return list(vector)
+
+    def _put_l1(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._l1[key] = vector
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.max_size:
+                self._l1.popitem(last=False)
+
+    def _get_from_redis(self, key: str, model_name: str):
+        client = utils.get_redis_binary_client()
+        if client is None:
+            return None
+        try:
+            data = client.get(key)
+            if not data:
+                return None
+            vector = np.frombuffer(data, dtype=np.float32)
+            if vector.size != get_model_dimension(model_name):
+                # Запись от модели с другой размерностью - игнорируем
+                return None
+            return vector.tolist()
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            logger.error(f"Redis GET error for embedding key {key}: {e}")
+            return None
+
+    def _set_to_redis(self, key: str, vector: np.ndarray) -> None:
+        client = utils.get_redis_binary_client()
+        if client is None:
+            return
+        try:
+            client.setex(key, self.ttl, vector.tobytes())
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            logger.error(f"Redis SET error for embedding key {key}: {e}")
+
+    def clear(self) -> None:
+        """Очищает L1 (записи в Redis истекают по TTL)"""
+        with self._lock:
+            self._l1.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._l1_hits + self._l2_hits + self._misses
+            return {
+                "model": self._model_name,
+                "l1_size": len(self._l1),
+                "l1_max_size": self.max_size,
+                "l1_hits": self._l1_hits,
+                "l2_hits": self._l2_hits,
+                "misses": self._misses,
+                "hit_rate": round((self._l1_hits + self._l2_hits) / lookups, 4) if lookups else 0.0,
+                "errors": self._errors,
+                "ttl_s": self.ttl
+            }
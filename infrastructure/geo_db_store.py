@@ -6,14 +6,15 @@
 import json
 import os
 import difflib
+import threading
+from collections import defaultdict
 from typing import Any, Dict, Optional
 import re
 
-import pymorphy2
-morph = pymorphy2.MorphAnalyzer()
+from infrastructure.morphology import normalize_phrase
 
 def normalize_morph(text: str) -> str:
-    return ' '.join([morph.parse(word)[0].normal_form for word in text.lower().split()])
+    return normalize_phrase(text)
 
 DB_PATH = "json_files/geodb.json"
 
@@ -30,61 +31,168 @@ def save_db(data: Dict[str, Any]) -> None:
     """Сохраняет словарь в файл базы данных JSON."""
     with open(DB_PATH, "w") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    _index.invalidate()
+
+def normalize_lower(text: str) -> str:
+    return text.strip().lower()
+
+def _tokens(s: str) -> set[str]:
+    # слова ≥3 символов, в нижнем регистре
+    return set(re.findall(r"[а-яёa-z]{3,}", s.lower()))
+
+def _trigrams(s: str) -> set[str]:
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class GeoDbIndex:
+    """
+    Резидентный индекс geodb.json. Файл читается один раз и перечитывается
+    только при изменении mtime/размера. Нормализованные ключи, инвертированный
+    индекс по словам и индекс по триграммам строятся при загрузке, поэтому
+    поиск не перебирает всю базу.
+
+    Возвращаемые записи общие для всех вызовов - изменять их нельзя.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self.db: Dict[str, Any] = {}
+        self.norm2orig: Dict[str, str] = {}
+        self.first_norm2orig: Dict[str, str] = {}
+        self.norm_order: Dict[str, int] = {}
+        self.norm_tokens: Dict[str, set] = {}
+        self.token_index: Dict[str, set] = defaultdict(set)
+        self.trigram_index: Dict[str, set] = defaultdict(set)
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._signature = None
+
+    def _ensure_fresh(self) -> None:
+        signature = self._file_signature()
+        if signature is not None and signature == self._signature:
+            return
+        with self._lock:
+            signature = self._file_signature()
+            if signature is not None and signature == self._signature:
+                return
+            self._build(load_db())
+            self._signature = signature
+
+    def _build(self, db: Dict[str, Any]) -> None:
+        norm2orig: Dict[str, str] = {}
+        first_norm2orig: Dict[str, str] = {}
+        for key in db.keys():
+            nk = normalize_morph(key)
+            # как и раньше: для гибкого поиска побеждает последний ключ, для find_place_key - первый
+            norm2orig[nk] = key
+            first_norm2orig.setdefault(nk, key)
+
+        norm_order: Dict[str, int] = {}
+        norm_tokens: Dict[str, set] = {}
+        token_index: Dict[str, set] = defaultdict(set)
+        trigram_index: Dict[str, set] = defaultdict(set)
+        for order, nk in enumerate(norm2orig):
+            norm_order[nk] = order
+            norm_tokens[nk] = _tokens(nk)
+            for token in norm_tokens[nk]:
+                token_index[token].add(nk)
+            for trigram in _trigrams(nk):
+                trigram_index[trigram].add(nk)
+
+        self.db = db
+        self.norm2orig = norm2orig
+        self.first_norm2orig = first_norm2orig
+        self.norm_order = norm_order
+        self.norm_tokens = norm_tokens
+        self.token_index = token_index
+        self.trigram_index = trigram_index
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        self._ensure_fresh()
+        return self.db.get(name.lower())
+
+    def find_by_normalized(self, user_norm: str) -> Optional[str]:
+        """Первый исходный ключ с таким же нормализованным видом"""
+        self._ensure_fresh()
+        return self.first_norm2orig.get(user_norm)
+
+    def find_flexible(self, user_input: str, cutoff: float) -> dict:
+        self._ensure_fresh()
+        db, norm2orig = self.db, self.norm2orig
+        user_norm = normalize_morph(user_input)
+
+        # 1) точное совпадение в нормализованном пространстве
+        if user_norm in norm2orig:
+            orig = norm2orig[user_norm]
+            return {"name": orig, "record": db[orig]}
+
+        # 2) "подстрока", но по словам и с порогом покрытия;
+        #    кандидаты - только ключи, у которых есть хотя бы одно общее слово
+        u_tokens = _tokens(user_norm)
+        candidates = set()
+        for token in u_tokens:
+            candidates |= self.token_index.get(token, set())
+
+        best = None
+        best_score = 0.0
+        for nk in sorted(candidates, key=self.norm_order.__getitem__):
+            c_tokens = self.norm_tokens[nk]
+            inter = len(u_tokens & c_tokens)
+            # доля общих слов относительно большего набора
+            score = inter / max(len(u_tokens), len(c_tokens))
+            if score >= 0.8 and score > best_score:
+                best = norm2orig[nk]
+                best_score = score
+
+        if best:
+            return {"name": best, "record": db[best]}
+
+        # 3) fuzzy только по НОРМАЛИЗОВАННЫМ ключам: difflib оценивает все ключи,
+        #    у которых есть общая триграмма и длина допускает ratio >= cutoff
+        #    (ratio не больше 2*min(len)/(сумма len)). Ключ без единой общей триграммы
+        #    набирает cutoff лишь из совпадений по 1-2 символа - такие ключи не проверяются
+        candidates = set()
+        for trigram in _trigrams(user_norm):
+            candidates |= self.trigram_index.get(trigram, set())
+        user_len = len(user_norm)
+        candidates = [
+            nk for nk in candidates
+            if 2 * min(user_len, len(nk)) / (user_len + len(nk)) >= cutoff
+        ]
+        close = difflib.get_close_matches(user_norm, candidates, n=1, cutoff=cutoff)
+        if close:
+            orig = norm2orig[close[0]]
+            return {"name": orig, "record": db[orig]}
+
+        return {"name": "not_found", "record": "not_found"}
+
+
+_index = GeoDbIndex(DB_PATH)
+
+def get_geodb_index() -> GeoDbIndex:
+    return _index
 
 def get_place(name: str) -> Optional[Dict[str, Any]]:
     """Возвращает данные по месту, если оно есть в базе."""
-    db = load_db()
-    return db.get(name.lower())
+    return _index.get(name)
 
 def add_place(name: str, data: Dict[str, Any]) -> None:
     """Добавляет или обновляет данные по месту в базе."""
+    # Читаем файл заново: его могли обновить другие воркеры
     db = load_db()
     db[name.lower()] = data
     save_db(db)
 
-def normalize_lower(text: str) -> str:
-    return text.strip().lower()
-
-def _tokens(s: str) -> set[str]:
-    # слова ≥3 символов, в нижнем регистре
-    return set(re.findall(r"[а-яёa-z]{3,}", s.lower()))
-
 def find_place_flexible(user_input: str, cutoff: float = 0.80) -> dict:
-    db = load_db()
-    user_norm = normalize_morph(user_input)
-
-    # индекс: нормализованный ключ -> исходный ключ
-    norm2orig = {normalize_morph(k): k for k in db.keys()}
-
-    # 1) точное совпадение в нормализованном пространстве
-    if user_norm in norm2orig:
-        orig = norm2orig[user_norm]
-        return {"name": orig, "record": db[orig]}
-
-    # 2) "подстрока", но по словам и с порогом покрытия
-    u_tokens = _tokens(user_norm)
-    best = None
-    best_score = 0.0
-
-    for nk, orig in norm2orig.items():
-        c_tokens = _tokens(nk)
-        inter = len(u_tokens & c_tokens)
-        if inter == 0:
-            continue
-        # доля общих слов относительно большего набора
-        score = inter / max(len(u_tokens), len(c_tokens))
-        if score >= 0.8 and score > best_score:
-            best = orig
-            best_score = score
-
-    if best:
-        return {"name": best, "record": db[best]}
-
-    # 3) fuzzy только по НОРМАЛИЗОВАННЫМ ключам
-    keys_norm = list(norm2orig.keys())
-    close = difflib.get_close_matches(user_norm, keys_norm, n=1, cutoff=cutoff)
-    if close:
-        orig = norm2orig[close[0]]
-        return {"name": orig, "record": db[orig]}
-
-    return {"name": "not_found", "record": "not_found"}
+    return _index.find_flexible(user_input, cutoff)
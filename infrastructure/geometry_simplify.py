@@ -0,0 +1,86 @@
+"""
+Упрощение геометрий в ответах API.
+
+Крупные полигоны map_content хранятся в нескольких разрешениях (таблица
+map_content_simplified, допуски SIMPLIFY_LEVELS_M, заполняется при импорте).
+Для запроса с допуском берется самый грубый сохраненный вариант с допуском не больше
+запрошенного и доупрощается до запрошенного - это дешево, т.к. точек в нем уже мало.
+Геометрии без сохраненных вариантов (небольшие) упрощаются на лету.
+
+Допуск задается в метрах (simplify_tolerance) или зумом карты (zoom - размер
+пикселя тайла 256x256 на этом зуме). precision - число знаков после запятой
+в координатах GeoJSON.
+"""
+from typing import Any, Dict, Optional
+
+# Допуски сохраненных вариантов, м (по ним же recreate_script заполняет map_content_simplified)
+SIMPLIFY_LEVELS_M = (10, 100, 1000)
+METERS_PER_DEGREE = 111320.0
+WORLD_SIZE_M = 40075016.685578488
+
+DEFAULT_PRECISION = 9
+MAX_ZOOM = 22
+
+
+def resolve_tolerance_m(simplify_tolerance: Any = None, zoom: Any = None) -> Optional[float]:
+    """Допуск упрощения в метрах; None - геометрии в полном разрешении"""
+    if simplify_tolerance is not None and simplify_tolerance != "":
+        try:
+            tolerance = float(simplify_tolerance)
+        except (TypeError, ValueError):
+            raise ValueError("simplify_tolerance должен быть числом (метры)")
+        if tolerance < 0:
+            raise ValueError("simplify_tolerance не может быть отрицательным")
+        return tolerance or None
+    if zoom is not None and zoom != "":
+        try:
+            zoom = int(zoom)
+        except (TypeError, ValueError):
+            raise ValueError("zoom должен быть целым числом")
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom должен быть от 0 до {MAX_ZOOM}")
+        return WORLD_SIZE_M / (256 * 2 ** zoom)
+    return None
+
+
+def parse_precision(precision: Any = None) -> int:
+    """Число знаков координат в GeoJSON (0-15)"""
+    if precision is None or precision == "":
+        return DEFAULT_PRECISION
+    try:
+        value = int(precision)
+    except (TypeError, ValueError):
+        raise ValueError("precision должен быть целым числом")
+    if not 0 <= value <= 15:
+        raise ValueError("precision должен быть от 0 до 15")
+    return value
+
+
+def geojson_sql(geometry_expr: str, map_content_id_expr: str, tolerance_m: Optional[float]) -> str:
+    """
+    SQL-выражение GeoJSON геометрии с учетом допуска и точности.
+    Использует параметры %(simplify_tolerance_m)s и %(geojson_precision)s (simplify_params).
+    """
+    if tolerance_m is None:
+        return f"ST_AsGeoJSON({geometry_expr}, %(geojson_precision)s)::json"
+    return f"""ST_AsGeoJSON(
+        ST_SimplifyPreserveTopology(
+            COALESCE(
+                (
+                    SELECT mcs.geometry
+                    FROM map_content_simplified mcs
+                    WHERE mcs.map_content_id = {map_content_id_expr}
+                    AND mcs.tolerance_m <= %(simplify_tolerance_m)s
+                    ORDER BY mcs.tolerance_m DESC
+                    LIMIT 1
+                ),
+                {geometry_expr}
+            ),
+            %(simplify_tolerance_m)s / {METERS_PER_DEGREE}
+        ),
+        %(geojson_precision)s
+    )::json"""
+
+
+def simplify_params(tolerance_m: Optional[float], precision: int = DEFAULT_PRECISION) -> Dict[str, Any]:
+    return {"simplify_tolerance_m": tolerance_m, "geojson_precision": precision}
@@ -0,0 +1,155 @@
+"""
+Кэш результатов вызовов GigaChat (фильтрация описаний, генерация ответов).
+
+Вызовы идут с temperature 0.0, поэтому результат для одних и тех же входных
+данных фактически детерминирован. Ключ - тип промпта, модель, версия шаблона
+промпта и хэш точных входных данных (запрос + тексты описаний / контекст):
+cache:llm_<prompt_type>:<sha256>. Значения хранятся в Redis в формате
+cache_codec (orjson + zstd для крупных значений). При изменении текста
+промпта нужно увеличить его версию - старые записи перестанут читаться.
+
+Настройки через переменные окружения:
+    LLM_CACHE_ENABLED  - true/false (true)
+    LLM_CACHE_TTL      - время жизни записи, секунд (604800)
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import utils
+from infrastructure.cache_codec import decode_value, encode_value
+
+logger = logging.getLogger(__name__)
+
+
+def model_name(llm: Any) -> str:
+    """Имя модели клиента LLM для ключа кэша"""
+    return str(getattr(llm, "model", None) or type(llm).__name__)
+
+
+class LLMResultCache:
+    def __init__(self, ttl: Optional[int] = None, enabled: Optional[bool] = None):
+        self.ttl = ttl or int(os.getenv("LLM_CACHE_TTL", "604800"))
+        if enabled is None:
+            enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    @staticmethod
+    def make_key(prompt_type: str, model: str, template_version: int, inputs: Dict[str, Any]) -> str:
+        payload = json.dumps(
+            {"model": model, "template_version": template_version, "inputs": inputs},
+            sort_keys=True, ensure_ascii=False, separators=(",", ":")
+        )
+        return f"cache:llm_{prompt_type}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def _record(self, prompt_type: str, **values: float) -> None:
+        with self._lock:
+            stats = self._stats[prompt_type]
+            for name, value in values.items():
+                stats[name] += value
+
+    def get(self, prompt_type: str, key: str) -> Optional[Any]:
+        client = utils.get_redis_binary_client()
+        if not self.enabled or client is None:
+            return None
+        try:
+            data = client.get(key)
+            return decode_value(data, f"llm_{prompt_type}") if data else None
+        except Exception as e:
+            self._record(prompt_type, errors=1)
+            logger.error(f"Redis GET error для кэша LLM {key}: {e}")
+            return None
+
+    def set(self, prompt_type: str, key: str, value: Any) -> None:
+        client = utils.get_redis_binary_client()
+        if not self.enabled or client is None:
+            return
+        try:
+            client.setex(key, self.ttl, encode_value(value, f"llm_{prompt_type}"))
+        except Exception as e:
+            self._record(prompt_type, errors=1)
+            logger.error(f"Redis SET error для кэша LLM {key}: {e}")
+
+    def get_or_call(
+        self,
+        prompt_type: str,
+        model: str,
+        template_version: int,
+        inputs: Dict[str, Any],
+        call: Callable[[], Any],
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ) -> Any:
+        """
+        Результат из кэша или вызов call(). Исключения call() пробрасываются и не кэшируются;
+        cacheable(result) = False - результат (например, ошибка модели) не сохраняется.
+        """
+        key = self.make_key(prompt_type, model, template_version, inputs)
+        cached = self.get(prompt_type, key)
+        if cached is not None:
+            self._record(prompt_type, hits=1)
+            return cached
+
+        start = time.perf_counter()
+        result = call()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._record(prompt_type, misses=1, call_time_ms=elapsed_ms)
+
+        if result is not None and (cacheable is None or cacheable(result)):
+            self.set(prompt_type, key, result)
+        return result
+
+    def lookup(
+        self,
+        prompt_type: str,
+        model: str,
+        template_version: int,
+        inputs: Dict[str, Any]
+    ) -> Tuple[str, Optional[Any]]:
+        """
+        Ключ и значение из кэша для вызовов, результат которых собирается вне
+        get_or_call (потоковая генерация); после вызова результат сохраняется через store().
+        """
+        key = self.make_key(prompt_type, model, template_version, inputs)
+        cached = self.get(prompt_type, key)
+        if cached is not None:
+            self._record(prompt_type, hits=1)
+        return key, cached
+
+    def store(self, prompt_type: str, key: str, value: Any, call_time_ms: float, cacheable: bool = True) -> None:
+        """Учитывает промах lookup() и сохраняет собранный результат"""
+        self._record(prompt_type, misses=1, call_time_ms=call_time_ms)
+        if value is not None and cacheable:
+            self.set(prompt_type, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for prompt_type, stats in self._stats.items():
+                hits, misses = int(stats.get("hits", 0)), int(stats.get("misses", 0))
+                lookups = hits + misses
+                result[prompt_type] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                    "errors": int(stats.get("errors", 0)),
+                    "call_time_avg_ms": round(stats.get("call_time_ms", 0) / misses, 1) if misses else 0.0
+                }
+            return {"enabled": self.enabled, "ttl": self.ttl, "prompt_types": result}
+
+
+_llm_cache: Optional[LLMResultCache] = None
+
+
+def get_llm_cache() -> LLMResultCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMResultCache()
+    return _llm_cache
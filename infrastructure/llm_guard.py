@@ -0,0 +1,205 @@
+"""
+Ограничение одновременных вызовов GigaChat и автоматический выключатель (circuit breaker).
+
+Клиент get_gigachat общий для процесса и ждет ответа до 120 секунд. Чтобы при
+медленном GigaChat все потоки воркера не зависали в вызовах LLM, каждый вызов
+идет через LLMGuard:
+
+- семафор ограничивает число одновременных вызовов в процессе; ожидание места
+  не дольше LLM_QUEUE_TIMEOUT, иначе вызов отклоняется;
+- после LLM_BREAKER_FAILURES ошибок подряд (медленный вызов дольше
+  LLM_SLOW_CALL_SECONDS тоже считается ошибкой) цепь размыкается (open) и вызовы
+  сразу отклоняются. Через LLM_BREAKER_RESET_SECONDS пропускается один пробный
+  вызов (half_open): успех замыкает цепь, ошибка снова размыкает.
+
+Отклоненный вызов поднимает LLMUnavailable; вызывающий код переходит на путь без
+LLM (нефильтрованные описания, описания вместо ответа). Ответы из кэша LLM
+через LLMGuard не идут.
+
+Настройки через переменные окружения:
+    LLM_MAX_CONCURRENT         - одновременных вызовов LLM на процесс (4)
+    LLM_QUEUE_TIMEOUT          - максимальное ожидание места, секунд (10)
+    LLM_BREAKER_FAILURES       - ошибок подряд до размыкания (5)
+    LLM_SLOW_CALL_SECONDS      - вызов дольше считается ошибкой, секунд (60)
+    LLM_BREAKER_RESET_SECONDS  - время до пробного вызова, секунд (30)
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class LLMUnavailable(RuntimeError):
+    """Вызов LLM отклонен: цепь разомкнута или нет места в очереди"""
+
+
+class LLMGuard:
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        failure_threshold: Optional[int] = None,
+        slow_call_seconds: Optional[float] = None,
+        reset_timeout: Optional[float] = None
+    ):
+        self.max_concurrent = max_concurrent or int(os.getenv("LLM_MAX_CONCURRENT", "4"))
+        self.queue_timeout = queue_timeout or float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+        self.failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv("LLM_SLOW_CALL_SECONDS", "60"))
+        self.reset_timeout = reset_timeout or float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._consecutive_failures = 0
+        self._probe_in_flight = False
+
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.opened = 0
+        self.rejected_open = 0
+        self.rejected_queue = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def _admit(self, name: str) -> bool:
+        """Разрешение на вызов по состоянию цепи; True - это пробный вызов half_open"""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected_open += 1
+                    raise LLMUnavailable(f"GigaChat недоступен (цепь разомкнута), вызов '{name}' отклонен")
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info("🔌 LLMGuard: half_open, пропускаем пробный вызов")
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected_open += 1
+                    raise LLMUnavailable(f"GigaChat проверяется пробным вызовом, вызов '{name}' отклонен")
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def _on_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info("🔌 LLMGuard: пробный вызов успешен, цепь замкнута")
+                self._state = CLOSED
+
+    def _on_failure(self, slow: bool = False) -> None:
+        with self._lock:
+            self.failures += 1
+            if slow:
+                self.slow_calls += 1
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opened += 1
+                    logger.warning(
+                        f"🔌 LLMGuard: цепь разомкнута после {self._consecutive_failures} ошибок подряд "
+                        f"на {self.reset_timeout:.0f} с"
+                    )
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    @contextmanager
+    def call(self, name: str = "llm") -> Iterator[None]:
+        """
+        Вызов LLM внутри блока with. Исключения блока считаются ошибками LLM;
+        прерванный блок (GeneratorExit при обрыве потока клиентом) - нет.
+        """
+        is_probe = self._admit(name)
+        try:
+            with self._lock:
+                self.waiting += 1
+            wait_started = time.perf_counter()
+            acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+            waited = time.perf_counter() - wait_started
+            with self._lock:
+                self.waiting -= 1
+                self.queue_wait_total += waited
+                self.queue_wait_max = max(self.queue_wait_max, waited)
+                if not acquired:
+                    self.rejected_queue += 1
+                else:
+                    self.calls += 1
+                    self.in_flight += 1
+            if not acquired:
+                raise LLMUnavailable(
+                    f"Нет места для вызова GigaChat '{name}' за {self.queue_timeout:.0f} с "
+                    f"(одновременно не больше {self.max_concurrent})"
+                )
+
+            started = time.perf_counter()
+            try:
+                yield
+            except Exception:
+                self._on_failure()
+                raise
+            else:
+                elapsed = time.perf_counter() - started
+                if elapsed > self.slow_call_seconds:
+                    logger.warning(f"🐢 Медленный вызов GigaChat '{name}': {elapsed:.1f} с")
+                    self._on_failure(slow=True)
+                else:
+                    self._on_success()
+            finally:
+                self._semaphore.release()
+                with self._lock:
+                    self.in_flight -= 1
+        finally:
+            if is_probe:
+                with self._lock:
+                    self._probe_in_flight = False
+
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Следующий вызов будет пробным
+                return HALF_OPEN
+            return self._state
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state()
+        with self._lock:
+            admitted = self.calls + self.rejected_queue
+            return {
+                "state": state,
+                "open": state == OPEN,
+                "half_open": state == HALF_OPEN,
+                "max_concurrent": self.max_concurrent,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "calls": self.calls,
+                "failures": self.failures,
+                "slow_calls": self.slow_calls,
+                "consecutive_failures": self._consecutive_failures,
+                "opened": self.opened,
+                "rejected_open": self.rejected_open,
+                "rejected_queue": self.rejected_queue,
+                "queue_wait_avg_ms": round(self.queue_wait_total / admitted * 1000, 1) if admitted else 0.0,
+                "queue_wait_max_ms": round(self.queue_wait_max * 1000, 1)
+            }
+
+
+_llm_guard: Optional[LLMGuard] = None
+
+
+def get_llm_guard() -> LLMGuard:
+    global _llm_guard
+    if _llm_guard is None:
+        _llm_guard = LLMGuard()
+    return _llm_guard
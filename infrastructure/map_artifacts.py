@@ -0,0 +1,210 @@
+"""
+Хранилище артефактов карт с адресацией по содержимому.
+
+Имя карты - хэш нормализованного набора геометрий с подписями и версии стиля
+отрисовки (MAP_STYLE_VERSION), поэтому одинаковые наборы объектов из разных
+запросов дают один файл <name>.jpeg + webapp_<name>.html. После завершения
+отрисовки рядом пишется манифест <name>.json; если он есть, повторная
+отрисовка не запускается.
+
+Ссылки на артефакт - ключи кэша ответов API, в которые попала ссылка на карту.
+Они хранятся в Redis как аренды: ZSET maps:refs:<name> (ключ кэша -> время
+истечения) и общий ZSET maps:artifacts (имя -> время окончания последней
+аренды + MAP_ARTIFACT_GRACE). Сборка мусора (scripts/cleanup_maps.py) берет
+только артефакты с истекшей арендой по индексу ZSET, без сканирования KEYS.
+
+Настройки через переменные окружения:
+    MAP_ARTIFACT_GRACE  - сколько секунд хранить карту после истечения последней ссылки (86400)
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+# Увеличивать при изменении внешнего вида карт (цвета, подложка, разметка popup)
+MAP_STYLE_VERSION = 1
+
+ARTIFACTS_KEY = "maps:artifacts"
+
+
+def _refs_key(name: str) -> str:
+    return f"maps:refs:{name}"
+
+
+def normalize_objects(objects: Iterable[dict]) -> List[str]:
+    """Канонический вид объектов карты: порядок объектов и ключей не влияет на имя"""
+    normalized = []
+    for obj in objects:
+        if not obj.get("geojson"):
+            continue
+        normalized.append(json.dumps(
+            {
+                "geojson": obj.get("geojson"),
+                "tooltip": obj.get("tooltip", obj.get("name")),
+                "popup": obj.get("popup", obj.get("name")),
+                "map_content_id": obj.get("map_content_id")
+            },
+            sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str
+        ))
+    return sorted(normalized)
+
+
+def artifact_name(objects: Iterable[dict]) -> str:
+    """Имя карты по содержимому: map_<sha256>"""
+    digest = hashlib.sha256()
+    digest.update(f"style:{MAP_STYLE_VERSION}\n".encode("utf-8"))
+    for item in normalize_objects(objects):
+        digest.update(item.encode("utf-8"))
+        digest.update(b"\n")
+    return f"map_{digest.hexdigest()[:40]}"
+
+
+class MapArtifactStore:
+    def __init__(self, maps_dir: str, grace: Optional[int] = None):
+        self.maps_dir = maps_dir
+        self.grace = grace or int(os.getenv("MAP_ARTIFACT_GRACE", "86400"))
+
+        self._lock = threading.Lock()
+        self._reused = 0
+        self._submitted = 0
+        self._references = 0
+
+    def paths(self, name: str) -> Dict[str, str]:
+        return {
+            "static": os.path.join(self.maps_dir, f"{name}.jpeg"),
+            "interactive": os.path.join(self.maps_dir, f"webapp_{name}.html"),
+            "manifest": os.path.join(self.maps_dir, f"{name}.json")
+        }
+
+    def is_complete(self, name: str) -> bool:
+        """Карта уже отрисована полностью (манифест пишется последним)"""
+        paths = self.paths(name)
+        return all(os.path.exists(path) for path in paths.values())
+
+    def write_manifest(self, name: str, objects_count: int) -> None:
+        """Вызывается процессом отрисовки после записи картинки и HTML"""
+        path = self.paths(name)["manifest"]
+        manifest = {
+            "name": name,
+            "style_version": MAP_STYLE_VERSION,
+            "objects": objects_count,
+            "rendered_at": time.time()
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def record_submit(self, name: str, reused: bool) -> None:
+        """Учитывает обращение к артефакту и ставит его под сборку мусора с начальной арендой"""
+        with self._lock:
+            if reused:
+                self._reused += 1
+            else:
+                self._submitted += 1
+        if not utils.redis_client:
+            return
+        try:
+            utils.redis_client.zadd(ARTIFACTS_KEY, {name: time.time() + self.grace}, gt=True)
+        except Exception as e:
+            logger.error(f"Redis error при регистрации карты {name}: {e}")
+
+    def add_reference(self, name: str, ref_key: str, ttl: int) -> None:
+        """Ключ кэша ref_key ссылается на карту в течение ttl секунд"""
+        if not utils.redis_client:
+            return
+        expires_at = time.time() + ttl
+        try:
+            pipe = utils.redis_client.pipeline()
+            pipe.zadd(_refs_key(name), {ref_key: expires_at})
+            pipe.expireat(_refs_key(name), int(expires_at + self.grace))
+            pipe.zadd(ARTIFACTS_KEY, {name: expires_at + self.grace}, gt=True)
+            pipe.execute()
+            with self._lock:
+                self._references += 1
+        except Exception as e:
+            logger.error(f"Redis error при добавлении ссылки на карту {name}: {e}")
+
+    def _delete_files(self, name: str) -> int:
+        removed = 0
+        for path in self.paths(name).values():
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.error(f"Не удалось удалить {path}: {e}")
+        return removed
+
+    def collect_garbage(self, dry_run: bool = True, batch: int = 500) -> Dict[str, int]:
+        """
+        Удаляет артефакты без действующих ссылок. Рассматриваются только карты
+        с истекшей арендой в maps:artifacts; у остальных аренда продлевается
+        до последней действующей ссылки.
+        """
+        stats = {"checked": 0, "extended": 0, "deleted": 0, "files_deleted": 0}
+        client = utils.redis_client
+        if not client:
+            logger.error("Redis недоступен, сборка мусора карт невозможна")
+            return stats
+
+        now = time.time()
+        offset = 0
+        while True:
+            names = client.zrangebyscore(ARTIFACTS_KEY, "-inf", now, start=offset, num=batch)
+            if not names:
+                break
+            skipped = 0
+            for name in names:
+                stats["checked"] += 1
+                refs_key = _refs_key(name)
+                with client.pipeline() as pipe:
+                    try:
+                        pipe.watch(refs_key, ARTIFACTS_KEY)
+                        live = pipe.zrangebyscore(refs_key, now, "+inf", withscores=True)
+                        pipe.multi()
+                        pipe.zremrangebyscore(refs_key, "-inf", now)
+                        if live:
+                            pipe.zadd(ARTIFACTS_KEY, {name: max(score for _, score in live) + self.grace})
+                        elif not dry_run:
+                            pipe.zrem(ARTIFACTS_KEY, name)
+                            pipe.delete(refs_key)
+                        if not dry_run:
+                            pipe.execute()
+                    except Exception as e:
+                        # WatchError - ссылка добавлена во время проверки, артефакт живой
+                        logger.info(f"Карта {name} пропущена: {e}")
+                        skipped += 1
+                        continue
+                if live:
+                    stats["extended"] += 1
+                    continue
+                stats["deleted"] += 1
+                if dry_run:
+                    logger.info(f"Карта без ссылок: {name}")
+                else:
+                    stats["files_deleted"] += self._delete_files(name)
+            # Обработанные артефакты уходят из диапазона (удалены или продлены);
+            # в сухом прогоне индекс не меняется - идем дальше по смещению
+            offset += len(names) if dry_run else skipped
+            if len(names) < batch:
+                break
+        return stats
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._reused + self._submitted
+            return {
+                "submitted": self._submitted,
+                "reused": self._reused,
+                "reuse_rate": round(self._reused / total, 4) if total else 0.0,
+                "references_added": self._references
+            }
@@ -0,0 +1,71 @@
+"""
+Общий сервис морфологии на pymorphy2.
+
+Один MorphAnalyzer на процесс (создается лениво при первом обращении), поэтому
+словари загружаются в память воркера один раз. Результаты parse/normal_form/inflect
+кэшируются по словам в ограниченных LRU-кэшах.
+
+Настройки через переменные окружения:
+    MORPH_CACHE_SIZE - размер каждого LRU-кэша (10000 слов)
+"""
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+import pymorphy2
+
+MORPH_CACHE_SIZE = int(os.getenv("MORPH_CACHE_SIZE", "10000"))
+
+_morph = None
+_morph_lock = threading.Lock()
+
+
+def get_morph_analyzer() -> pymorphy2.MorphAnalyzer:
+    """Возвращает общий MorphAnalyzer, создавая его при первом обращении"""
+    global _morph
+    if _morph is None:
+        with _morph_lock:
+            if _morph is None:
+                _morph = pymorphy2.MorphAnalyzer()
+    return _morph
+
+
+@lru_cache(maxsize=MORPH_CACHE_SIZE)
+def parse(word: str) -> Tuple[Any, ...]:
+    """Варианты разбора слова (как morph.parse, но кортеж и с кэшем)"""
+    return tuple(get_morph_analyzer().parse(word))
+
+
+@lru_cache(maxsize=MORPH_CACHE_SIZE)
+def normal_form(word: str) -> str:
+    """Нормальная форма слова по первому варианту разбора"""
+    return parse(word)[0].normal_form
+
+
+@lru_cache(maxsize=MORPH_CACHE_SIZE)
+def inflect(word: str, grammemes: FrozenSet[Optional[str]]) -> Optional[str]:
+    """Слово в нужной форме по первому варианту разбора или None, если склонить нельзя"""
+    inflected = parse(word)[0].inflect(set(grammemes))
+    return inflected.word if inflected else None
+
+
+def normalize_phrase(text: str) -> str:
+    """Нормальные формы всех слов фразы в нижнем регистре"""
+    return " ".join(normal_form(word) for word in text.lower().split())
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Статистика LRU-кэшей морфологии текущего воркера"""
+    stats = {"analyzer_loaded": _morph is not None}
+    for name, func in (("parse", parse), ("normal_form", normal_form), ("inflect", inflect)):
+        info = func.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+            "hit_rate": round(info.hits / lookups, 4) if lookups else 0.0
+        }
+    return stats
@@ -0,0 +1,374 @@
+"""
+Очередь фоновой отрисовки карт.
+
+Отрисовка (matplotlib + подложка contextily + folium) выполняется в отдельных
+процессах ProcessPoolExecutor, а эндпоинты сразу возвращают ссылки на карты
+со статусом "pending". Задачи с одинаковым map_name не дублируются: внутри
+воркера - по словарю активных задач, между воркерами gunicorn - по ключу
+render:<map_name> в Redis (атомарный захват Lua-скриптом: ключа нет или прошлая
+отрисовка завершена). Захват живет MAP_RENDER_TIMEOUT на каждую "волну" очереди
+воркера, чтобы задача, ждущая свободный процесс, не теряла его.
+
+Если процесс отрисовки падает (OOM, segfault в folium/GDAL), пул становится
+BrokenProcessPool: он пересоздается, а задача повторяется один раз на новом пуле.
+Повторная неудача записывает статус "error", что освобождает захват.
+
+Настройки через переменные окружения:
+    MAP_RENDER_WORKERS     - число процессов отрисовки на воркер (2)
+    MAP_RENDER_TIMEOUT     - сколько секунд длится одна отрисовка (120)
+    MAP_RENDER_STATUS_TTL  - сколько секунд хранится итоговый статус (3600)
+"""
+import os
+import json
+import time
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+
+# Локальные статусы нужны, только пока Redis недоступен
+LOCAL_STATUS_MAX = 1024
+
+# Захват задачи: ключа нет или в нем не "pending" (прошлая отрисовка завершена)
+CLAIM_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local ok, status = pcall(cjson.decode, current)
+    if ok and type(status) == 'table' and status['status'] == ARGV[3] then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+return 1
+"""
+
+PLACEHOLDER_HTML = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<meta http-equiv="refresh" content="2">
+<title>Карта готовится</title>
+</head>
+<body style="font-family: sans-serif; text-align: center; padding-top: 20%;">
+<p>Карта готовится, страница обновится автоматически…</p>
+</body>
+</html>
+"""
+
+# GeoProcessor внутри процесса отрисовки создается один раз
+_processor = None
+
+
+def _get_processor(maps_dir: str, domain: str):
+    global _processor
+    if _processor is None or _processor.maps_dir != maps_dir or _processor.domain != domain:
+        from core.coordinates_finder import GeoProcessor
+        _processor = GeoProcessor(maps_dir=maps_dir, domain=domain)
+    return _processor
+
+
+def render_custom_geometries_job(maps_dir: str, domain: str, objects: List[dict], name: str) -> Dict[str, Any]:
+    """Задача для процесса отрисовки: синхронный GeoProcessor.draw_custom_geometries"""
+    return _get_processor(maps_dir, domain).draw_custom_geometries(objects, name)
+
+
+class MapRenderQueue:
+    def __init__(
+        self,
+        maps_dir: str,
+        domain: str,
+        max_workers: Optional[int] = None,
+        render_timeout: Optional[int] = None,
+        status_ttl: Optional[int] = None
+    ):
+        self.maps_dir = maps_dir
+        self.domain = domain
+        self.max_workers = max_workers or int(os.getenv("MAP_RENDER_WORKERS", "2"))
+        self.render_timeout = render_timeout or int(os.getenv("MAP_RENDER_TIMEOUT", "120"))
+        self.status_ttl = status_ttl or int(os.getenv("MAP_RENDER_STATUS_TTL", "3600"))
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Future] = {}
+        self._local_status: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        self._submitted = 0
+        self._deduplicated = 0
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._broken_pools = 0
+        self._render_time_total = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Пул создается лениво в процессе воркера (после fork gunicorn)
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            if self._executor_pid != pid:
+                self._jobs = {}
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            self._executor_pid = pid
+            logger.info(f"Создан пул отрисовки карт (pid={pid}, workers={self.max_workers})")
+        return self._executor
+
+    def _reset_executor(self, broken: ProcessPoolExecutor) -> None:
+        """Сбрасывает сломанный пул (следующий _get_executor создаст новый). Вызывается под self._lock"""
+        if self._executor is not broken:
+            # Пул уже пересоздан другой задачей
+            return
+        logger.warning("Пул отрисовки карт сломан (упал процесс отрисовки), пересоздаем")
+        try:
+            broken.shutdown(wait=False)
+        except Exception as e:
+            logger.debug(f"Ошибка остановки сломанного пула отрисовки: {e}")
+        self._executor = None
+        self._broken_pools += 1
+
+    def _submit_job(self, objects: List[dict], map_name: str) -> Tuple[Future, ProcessPoolExecutor]:
+        """Отправка задачи в пул; сломанный пул пересоздается один раз. Вызывается под self._lock"""
+        executor = self._get_executor()
+        try:
+            return executor.submit(
+                render_custom_geometries_job, self.maps_dir, self.domain, objects, map_name
+            ), executor
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            executor = self._get_executor()
+            return executor.submit(
+                render_custom_geometries_job, self.maps_dir, self.domain, objects, map_name
+            ), executor
+
+    @staticmethod
+    def _status_key(map_name: str) -> str:
+        return f"render:{map_name}"
+
+    def _claim_ttl(self) -> int:
+        """
+        Время жизни захвата: задача может ждать, пока отрисуются задачи перед ней
+        в очереди воркера, поэтому render_timeout умножается на число "волн" до нее.
+        Вызывается под self._lock.
+        """
+        active = sum(1 for f in self._jobs.values() if not f.done())
+        return self.render_timeout * (active // self.max_workers + 1)
+
+    def _claim(self, map_name: str) -> bool:
+        """Захватывает задачу для map_name; False, если ее уже рисует другой воркер"""
+        if not utils.redis_client:
+            return True
+        status = {"status": STATUS_PENDING, "pid": os.getpid(), "submitted_at": time.time()}
+        try:
+            return bool(utils.redis_client.eval(
+                CLAIM_SCRIPT, 1, self._status_key(map_name),
+                json.dumps(status), self._claim_ttl(), STATUS_PENDING
+            ))
+        except Exception as e:
+            logger.error(f"Redis error при захвате задачи отрисовки {map_name}: {e}")
+            return True
+
+    def _read_status(self, map_name: str) -> Optional[Dict[str, Any]]:
+        if not utils.redis_client:
+            return None
+        try:
+            raw = utils.redis_client.get(self._status_key(map_name))
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            logger.error(f"Redis error при чтении статуса отрисовки {map_name}: {e}")
+            return None
+
+    def _set_local_status(self, map_name: str, status: Optional[Dict[str, Any]]) -> None:
+        """Локальный статус (LRU на LOCAL_STATUS_MAX карт); None - удалить. Вызывается под self._lock"""
+        if status is None:
+            self._local_status.pop(map_name, None)
+            return
+        self._local_status[map_name] = status
+        self._local_status.move_to_end(map_name)
+        while len(self._local_status) > LOCAL_STATUS_MAX:
+            self._local_status.popitem(last=False)
+
+    def _write_status(self, map_name: str, status: Dict[str, Any]) -> None:
+        stored = False
+        if utils.redis_client:
+            try:
+                utils.redis_client.set(self._status_key(map_name), json.dumps(status), ex=self.status_ttl)
+                stored = True
+            except Exception as e:
+                logger.error(f"Redis error при записи статуса отрисовки {map_name}: {e}")
+        # Статус в Redis общий для воркеров - локальная копия больше не нужна
+        with self._lock:
+            self._set_local_status(map_name, None if stored else status)
+
+    def _write_placeholder(self, map_name: str) -> None:
+        """Заглушка для интерактивной карты, если ее еще ни разу не рисовали"""
+        filepath_html = os.path.join(self.maps_dir, f"webapp_{map_name}.html")
+        if os.path.exists(filepath_html):
+            return
+        try:
+            with open(filepath_html, "w", encoding="utf-8") as f:
+                f.write(PLACEHOLDER_HTML)
+        except OSError as e:
+            logger.warning(f"Не удалось записать заглушку карты {map_name}: {e}")
+
+    def submit_custom_geometries(self, objects: List[dict], map_name: str) -> str:
+        """
+        Ставит отрисовку в очередь и сразу возвращает статус.
+        Повторные задачи для того же map_name, пока первая не завершилась, не создаются.
+        """
+        with self._lock:
+            existing = self._jobs.get(map_name)
+            if existing is not None and not existing.done():
+                self._deduplicated += 1
+                return STATUS_PENDING
+
+            if not self._claim(map_name):
+                self._deduplicated += 1
+                return STATUS_PENDING
+
+            self._write_placeholder(map_name)
+            submitted_at = time.time()
+            self._submitted += 1
+            try:
+                future, executor = self._submit_job(objects, map_name)
+            except BrokenProcessPool as e:
+                future, executor = None, None
+                submit_error = str(e) or "Пул отрисовки недоступен"
+            else:
+                self._jobs[map_name] = future
+                self._set_local_status(
+                    map_name, {"status": STATUS_PENDING, "pid": os.getpid(), "submitted_at": submitted_at}
+                )
+
+        if future is None:
+            logger.error(f"Не удалось поставить отрисовку карты {map_name} в очередь: {submit_error}")
+            with self._lock:
+                self._failed += 1
+            # Статус "error" освобождает захват в Redis
+            self._write_status(map_name, {
+                "status": STATUS_ERROR,
+                "message": submit_error,
+                "finished_at": time.time(),
+                "render_time_s": 0.0
+            })
+            return STATUS_ERROR
+
+        future.add_done_callback(lambda f: self._on_done(map_name, f, submitted_at, objects, executor))
+        return STATUS_PENDING
+
+    def _retry_on_new_pool(
+        self,
+        map_name: str,
+        future: Future,
+        submitted_at: float,
+        objects: List[dict],
+        executor: ProcessPoolExecutor
+    ) -> bool:
+        """Повтор задачи, упавшей вместе с пулом; False - повторить не удалось"""
+        with self._lock:
+            self._reset_executor(executor)
+            try:
+                new_future, new_executor = self._submit_job(objects, map_name)
+            except BrokenProcessPool as e:
+                logger.error(f"Повтор отрисовки карты {map_name} не удался: {e}")
+                return False
+            if self._jobs.get(map_name) is future:
+                self._jobs[map_name] = new_future
+            self._retried += 1
+            claim_ttl = self._claim_ttl()
+        if utils.redis_client:
+            # Отрисовка начинается заново - продлеваем захват
+            try:
+                utils.redis_client.expire(self._status_key(map_name), claim_ttl)
+            except Exception as e:
+                logger.error(f"Redis error при продлении захвата отрисовки {map_name}: {e}")
+        logger.warning(f"Отрисовка карты {map_name} повторяется на новом пуле")
+        new_future.add_done_callback(
+            lambda f: self._on_done(map_name, f, submitted_at, objects, new_executor, retried=True)
+        )
+        return True
+
+    def _on_done(
+        self,
+        map_name: str,
+        future: Future,
+        submitted_at: float,
+        objects: List[dict],
+        executor: ProcessPoolExecutor,
+        retried: bool = False
+    ) -> None:
+        elapsed = time.time() - submitted_at
+        status: Dict[str, Any] = {"finished_at": time.time(), "render_time_s": round(elapsed, 3)}
+        try:
+            result = future.result()
+            if isinstance(result, dict) and result.get("status") == "ok":
+                status["status"] = STATUS_DONE
+            else:
+                status["status"] = STATUS_ERROR
+                status["message"] = (result or {}).get("message", "Неизвестная ошибка отрисовки")
+        except BrokenProcessPool as e:
+            if not retried and self._retry_on_new_pool(map_name, future, submitted_at, objects, executor):
+                return
+            with self._lock:
+                self._reset_executor(executor)
+            logger.error(f"Процесс отрисовки карты {map_name} упал: {e}")
+            status["status"] = STATUS_ERROR
+            status["message"] = str(e) or "Процесс отрисовки упал"
+        except Exception as e:
+            logger.error(f"Ошибка фоновой отрисовки карты {map_name}: {e}")
+            status["status"] = STATUS_ERROR
+            status["message"] = str(e)
+
+        with self._lock:
+            if self._jobs.get(map_name) is future:
+                del self._jobs[map_name]
+            if status["status"] == STATUS_DONE:
+                self._completed += 1
+            else:
+                self._failed += 1
+            self._render_time_total += elapsed
+        self._write_status(map_name, status)
+
+    def get_status(self, map_name: str) -> Dict[str, Any]:
+        """Статус отрисовки: сначала Redis (общий для воркеров), затем локальный, затем файлы на диске"""
+        status = self._read_status(map_name)
+        if status is None:
+            with self._lock:
+                status = self._local_status.get(map_name)
+        if status is None:
+            image_path = os.path.join(self.maps_dir, f"{map_name}.jpeg")
+            status = {"status": STATUS_DONE if os.path.exists(image_path) else "unknown"}
+        return {
+            "map_name": map_name,
+            "static_map": f"{self.domain}/maps/{map_name}.jpeg",
+            "interactive_map": f"{self.domain}/maps/webapp_{map_name}.html",
+            **status
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "workers": self.max_workers,
+                "started": self._executor is not None and self._executor_pid == os.getpid(),
+                "active_jobs": sum(1 for f in self._jobs.values() if not f.done()),
+                "submitted": self._submitted,
+                "deduplicated": self._deduplicated,
+                "completed": self._completed,
+                "failed": self._failed,
+                "retried": self._retried,
+                "broken_pools": self._broken_pools,
+                "render_time_avg_s": round(self._render_time_total / finished, 3) if finished else 0.0
+            }
@@ -0,0 +1,184 @@
+"""
+Оркестрация этапов обработки запроса с общим дедлайном.
+
+Эндпоинты описаний (/object/description/, /species/description/) состоят из
+этапов: разрешение синонимов, эмбеддинг запроса, поиск в БД, фильтрация и
+генерация ответа GigaChat. Независимые этапы (например, синонимы и эмбеддинг)
+запускаются параллельно в общем пуле потоков процесса, зависимые - по очереди.
+Каждое ожидание ограничено остатком дедлайна запроса; по его истечении
+поднимается DeadlineExceeded, а сам этап дорабатывает в фоне (результат
+отбрасывается). Время каждого этапа пишется в переданный словарь timings
+(обычно debug_info["stage_timings_ms"]).
+
+Вызовы LLM, которые сами распараллеливаются внутри этапа (фильтрация описаний
+частями), идут в отдельный пул "llm", чтобы этап, ожидающий свои части, не
+занимал потоки, нужные этим частям.
+
+Настройки через переменные окружения:
+    PIPELINE_MAX_WORKERS         - размер пула потоков этапов на процесс (16)
+    PIPELINE_LLM_MAX_WORKERS     - размер пула потоков вызовов LLM на процесс (8)
+    DESCRIPTION_DEADLINE_SECONDS - дедлайн эндпоинтов описаний, секунд (90)
+"""
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTION_DEADLINE_SECONDS = float(os.getenv("DESCRIPTION_DEADLINE_SECONDS", "90"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """Дедлайн запроса истек до завершения этапа"""
+
+    def __init__(self, stage: str, deadline: float):
+        super().__init__(f"Этап '{stage}' не завершился за дедлайн запроса ({deadline:.1f} с)")
+        self.stage = stage
+
+
+class _PipelineStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.requests = 0
+        self.deadline_exceeded = 0
+
+    def record_stage(self, stage: str, elapsed_ms: float, failed: bool) -> None:
+        with self._lock:
+            stats = self._stages[stage]
+            stats["calls"] += 1
+            stats["time_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            if failed:
+                stats["errors"] += 1
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record_deadline(self, stage: str) -> None:
+        with self._lock:
+            self.deadline_exceeded += 1
+            self._stages[stage]["deadline_exceeded"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for stage, stats in self._stages.items():
+                calls = int(stats.get("calls", 0))
+                stages[stage] = {
+                    "calls": calls,
+                    "errors": int(stats.get("errors", 0)),
+                    "deadline_exceeded": int(stats.get("deadline_exceeded", 0)),
+                    "avg_ms": round(stats.get("time_ms", 0) / calls, 1) if calls else 0.0,
+                    "max_ms": round(stats.get("max_ms", 0), 1)
+                }
+            return {
+                "requests": self.requests,
+                "deadline_exceeded": self.deadline_exceeded,
+                "stages": stages
+            }
+
+
+_stats = _PipelineStats()
+# Пул -> (переменная окружения с размером, размер по умолчанию)
+_POOL_SIZES = {
+    "stages": ("PIPELINE_MAX_WORKERS", "16"),
+    "llm": ("PIPELINE_LLM_MAX_WORKERS", "8")
+}
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
+
+def get_executor(pool: str = "stages") -> ThreadPoolExecutor:
+    """Общий пул потоков процесса (создается лениво - после fork воркера gunicorn)"""
+    executor = _executors.get(pool)
+    if executor is None:
+        with _executor_lock:
+            executor = _executors.get(pool)
+            if executor is None:
+                env_name, default = _POOL_SIZES[pool]
+                executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv(env_name, default)),
+                    thread_name_prefix=f"pipeline-{pool}"
+                )
+                _executors[pool] = executor
+    return executor
+
+
+class RequestPipeline:
+    def __init__(self, deadline: Optional[float] = None, timings: Optional[Dict[str, float]] = None):
+        self.deadline = deadline or DESCRIPTION_DEADLINE_SECONDS
+        self.timings = timings if timings is not None else {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        _stats.record_request()
+
+    def remaining(self) -> float:
+        """Остаток дедлайна, секунд (не меньше 0)"""
+        return max(0.0, self.deadline - (time.perf_counter() - self._started))
+
+    def _record(self, stage: str, start: float, failed: bool) -> None:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.timings[stage] = round(elapsed_ms, 1)
+        _stats.record_stage(stage, elapsed_ms, failed)
+
+    def _check(self, stage: str) -> None:
+        if self.remaining() <= 0:
+            _stats.record_deadline(stage)
+            raise DeadlineExceeded(stage, self.deadline)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Синхронный этап в потоке запроса: замер времени и проверка дедлайна перед стартом"""
+        self._check(name)
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self._record(name, start, failed)
+
+    def submit(self, name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """Запуск этапа в пуле потоков; результат - через result()"""
+        self._check(name)
+
+        def run():
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self._record(name, start, failed)
+
+        future = get_executor().submit(run)
+        future.stage_name = name
+        return future
+
+    def result(self, future: Future) -> Any:
+        """Результат этапа; ожидание не дольше остатка дедлайна"""
+        stage = getattr(future, "stage_name", "stage")
+        try:
+            return future.result(timeout=self.remaining())
+        except FutureTimeoutError:
+            _stats.record_deadline(stage)
+            logger.warning(f"⏱️ Этап '{stage}' превысил дедлайн запроса ({self.deadline:.1f} с)")
+            raise DeadlineExceeded(stage, self.deadline)
+
+    def run(self, name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Этап в пуле с ожиданием результата в пределах дедлайна"""
+        return self.result(self.submit(name, fn, *args, **kwargs))
+
+
+def get_pipeline_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
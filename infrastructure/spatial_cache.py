@@ -0,0 +1,306 @@
+"""
+Общий кэш результатов пространственных запросов (поиск объектов поблизости).
+
+Точка запроса привязывается к ячейке сетки размером SPATIAL_CACHE_CELL_M метров,
+и запрос выполняется от центра ячейки, поэтому запросы в пределах ~10 м
+получают один и тот же результат во всех воркерах. L1 - небольшой LRU в памяти
+процесса, L2 - Redis (формат cache_codec).
+
+Инвалидация по областям: территория разбита на крупные регионы
+SPATIAL_CACHE_REGION_DEG x SPATIAL_CACHE_REGION_DEG градусов, у каждого региона
+есть счетчик поколения spatial:gen:<lat>:<lon> в Redis. Ключ результата включает
+поколения всех регионов, которые пересекает круг поиска, поэтому после
+invalidate_bbox (INCR поколений) старые записи больше не читаются и истекают по TTL.
+Каждая инвалидация увеличивает и глобальное поколение spatial:gen:global - им
+ключуются кэши по областям больше SPATIAL_CACHE_MAX_REGIONS регионов (тайлы мелких
+зумов), чтобы не читать сотни тысяч счетчиков на один запрос.
+
+Настройки через переменные окружения:
+    SPATIAL_CACHE_CELL_M      - размер ячейки для ключа, м (10)
+    SPATIAL_CACHE_REGION_DEG  - размер региона инвалидации, градусы (0.25)
+    SPATIAL_CACHE_TTL         - время жизни записи в Redis, секунд (3600)
+    SPATIAL_CACHE_L1_SIZE     - размер L1 (512 записей)
+    SPATIAL_CACHE_L1_TTL      - время жизни записи в L1, секунд (60)
+    SPATIAL_CACHE_GEN_TTL     - сколько секунд L1 доверяет прочитанным поколениям (1)
+    SPATIAL_CACHE_MAX_REGIONS - больше регионов в области - глобальное поколение (64)
+"""
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import utils
+from infrastructure.cache_codec import decode_value, encode_value
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE = 111320.0
+GLOBAL_GENERATION_KEY = "spatial:gen:global"
+# Сколько прочитанных поколений хранится в памяти процесса
+GENERATIONS_CACHE_MAX = 4096
+
+Region = Tuple[int, int]
+
+
+class SpatialResultCache:
+    def __init__(
+        self,
+        namespace: str,
+        cell_m: Optional[float] = None,
+        region_deg: Optional[float] = None,
+        ttl: Optional[int] = None,
+        l1_size: Optional[int] = None,
+        l1_ttl: Optional[float] = None,
+        gen_ttl: Optional[float] = None,
+        max_regions: Optional[int] = None
+    ):
+        self.namespace = namespace
+        self.cell_m = cell_m or float(os.getenv("SPATIAL_CACHE_CELL_M", "10"))
+        self.region_deg = region_deg or float(os.getenv("SPATIAL_CACHE_REGION_DEG", "0.25"))
+        self.ttl = ttl or int(os.getenv("SPATIAL_CACHE_TTL", "3600"))
+        self.l1_size = l1_size or int(os.getenv("SPATIAL_CACHE_L1_SIZE", "512"))
+        self.l1_ttl = l1_ttl or float(os.getenv("SPATIAL_CACHE_L1_TTL", "60"))
+        self.gen_ttl = gen_ttl if gen_ttl is not None else float(os.getenv("SPATIAL_CACHE_GEN_TTL", "1"))
+        self.max_regions = max_regions or int(os.getenv("SPATIAL_CACHE_MAX_REGIONS", "64"))
+
+        self._lock = threading.Lock()
+        self._l1: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        # Ключ поколения в Redis -> (время чтения, значение), LRU на GENERATIONS_CACHE_MAX записей
+        self._generations: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+
+        self._l1_hits = 0
+        self._l2_hits = 0
+        self._misses = 0
+        self._errors = 0
+        self._invalidated_regions = 0
+
+    # --- Геометрия сетки ---
+
+    def snap(self, latitude: float, longitude: float) -> Tuple[float, float]:
+        """Центр ячейки сетки, в которую попадает точка"""
+        lat_step = self.cell_m / METERS_PER_DEGREE
+        lat_index = math.floor(latitude / lat_step)
+        snapped_lat = (lat_index + 0.5) * lat_step
+        # Шаг по долготе зависит от широты ряда ячеек, а не от самой точки
+        lon_step = lat_step / max(math.cos(math.radians(snapped_lat)), 0.01)
+        lon_index = math.floor(longitude / lon_step)
+        return round(snapped_lat, 7), round((lon_index + 0.5) * lon_step, 7)
+
+    def _region_of(self, latitude: float, longitude: float) -> Region:
+        return math.floor(latitude / self.region_deg), math.floor(longitude / self.region_deg)
+
+    def regions_for_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> List[Region]:
+        """Регионы инвалидации, которые пересекает прямоугольник"""
+        south, west = self._region_of(min_lat, min_lon)
+        north, east = self._region_of(max_lat, max_lon)
+        return [(r_lat, r_lon) for r_lat in range(south, north + 1) for r_lon in range(west, east + 1)]
+
+    def count_regions_for_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> int:
+        """Число регионов прямоугольника без построения списка"""
+        south, west = self._region_of(min_lat, min_lon)
+        north, east = self._region_of(max_lat, max_lon)
+        return (north - south + 1) * (east - west + 1)
+
+    def regions_for_circle(self, latitude: float, longitude: float, radius_km: float) -> List[Region]:
+        dlat = radius_km * 1000 / METERS_PER_DEGREE
+        dlon = dlat / max(math.cos(math.radians(latitude)), 0.01)
+        return self.regions_for_bbox(longitude - dlon, latitude - dlat, longitude + dlon, latitude + dlat)
+
+    @staticmethod
+    def _generation_key(region: Region) -> str:
+        return f"spatial:gen:{region[0]}:{region[1]}"
+
+    # --- Поколения регионов ---
+
+    def _get_generations(self, keys: List[str]) -> List[int]:
+        """Значения счетчиков поколений по ключам Redis"""
+        now = time.monotonic()
+        result: Dict[str, int] = {}
+        missing: List[str] = []
+        with self._lock:
+            for key in keys:
+                cached = self._generations.get(key)
+                if cached and now - cached[0] < self.gen_ttl:
+                    result[key] = cached[1]
+                else:
+                    missing.append(key)
+
+        if missing:
+            values = [0] * len(missing)
+            if utils.redis_client:
+                try:
+                    raw = utils.redis_client.mget(missing)
+                    values = [int(v) if v else 0 for v in raw]
+                except Exception as e:
+                    with self._lock:
+                        self._errors += 1
+                    logger.error(f"Redis error при чтении поколений пространственного кэша: {e}")
+            with self._lock:
+                for key, value in zip(missing, values):
+                    self._generations[key] = (now, value)
+                    self._generations.move_to_end(key)
+                    result[key] = value
+                while len(self._generations) > GENERATIONS_CACHE_MAX:
+                    self._generations.popitem(last=False)
+        return [result[key] for key in keys]
+
+    def generations_for_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> List[int]:
+        """
+        Поколения регионов прямоугольника - для ключей других кэшей по той же области.
+        Если регионов больше max_regions, возвращается одно глобальное поколение: ключ
+        меняется при любой инвалидации, зато читается одним GET.
+        """
+        if self.count_regions_for_bbox(min_lon, min_lat, max_lon, max_lat) > self.max_regions:
+            return self._get_generations([GLOBAL_GENERATION_KEY])
+        regions = self.regions_for_bbox(min_lon, min_lat, max_lon, max_lat)
+        return self._get_generations([self._generation_key(region) for region in regions])
+
+    def invalidate_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> int:
+        """Сбрасывает результаты всех запросов, круг которых пересекает прямоугольник"""
+        regions = self.regions_for_bbox(min_lon, min_lat, max_lon, max_lat)
+        keys = [self._generation_key(region) for region in regions] + [GLOBAL_GENERATION_KEY]
+        if utils.redis_client:
+            try:
+                pipe = utils.redis_client.pipeline()
+                for key in keys:
+                    pipe.incr(key)
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Redis error при инвалидации пространственного кэша: {e}")
+                return 0
+        with self._lock:
+            for key in keys:
+                self._generations.pop(key, None)
+            self._invalidated_regions += len(regions)
+        return len(regions)
+
+    # --- Чтение и запись ---
+
+    def _make_key(self, cell: Tuple[float, float], radius_km: float, params: Dict[str, Any], generations: List[int]) -> str:
+        payload = json.dumps(
+            {"cell": cell, "radius_km": radius_km, "params": params, "gen": generations},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return f"cache:spatial_{self.namespace}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+    def get_or_compute(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_km: float,
+        params: Dict[str, Any],
+        compute: Callable[[float, float], Any]
+    ) -> Any:
+        """
+        Результат для ячейки точки и параметров; при промахе вызывает
+        compute(lat, lon) от центра ячейки и сохраняет результат в L1 и Redis.
+        """
+        cell = self.snap(latitude, longitude)
+        generations = self._get_generations(
+            [self._generation_key(region) for region in self.regions_for_circle(cell[0], cell[1], radius_km)]
+        )
+        key = self._make_key(cell, radius_km, params, generations)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None and now - entry[0] < self.l1_ttl:
+                self._l1.move_to_end(key)
+                self._l1_hits += 1
+                return entry[1]
+
+        value = self._get_from_redis(key)
+        if value is not None:
+            with self._lock:
+                self._l2_hits += 1
+            self._put_l1(key, value)
+            return value
+
+        with self._lock:
+            self._misses += 1
+        value = compute(cell[0], cell[1])
+        self._put_l1(key, value)
+        self._set_to_redis(key, value)
+        return value
+
+    def _put_l1(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._l1[key] = (time.monotonic(), value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def _get_from_redis(self, key: str) -> Optional[Any]:
+        client = utils.get_redis_binary_client()
+        if client is None:
+            return None
+        try:
+            data = client.get(key)
+            return decode_value(data, f"spatial_{self.namespace}") if data else None
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            logger.error(f"Redis GET error для пространственного кэша {key}: {e}")
+            return None
+
+    def _set_to_redis(self, key: str, value: Any) -> None:
+        client = utils.get_redis_binary_client()
+        if client is None:
+            return
+        try:
+            client.setex(key, self.ttl, encode_value(value, f"spatial_{self.namespace}"))
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            logger.error(f"Redis SET error для пространственного кэша {key}: {e}")
+
+    def clear(self) -> None:
+        """Очищает L1 текущего процесса (для Redis используйте invalidate_bbox)"""
+        with self._lock:
+            self._l1.clear()
+            self._generations.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._l1_hits + self._l2_hits + self._misses
+            return {
+                "namespace": self.namespace,
+                "cell_m": self.cell_m,
+                "region_deg": self.region_deg,
+                "l1_size": len(self._l1),
+                "l1_max_size": self.l1_size,
+                "l1_hits": self._l1_hits,
+                "l2_hits": self._l2_hits,
+                "misses": self._misses,
+                "hit_rate": round((self._l1_hits + self._l2_hits) / lookups, 4) if lookups else 0.0,
+                "errors": self._errors,
+                "invalidated_regions": self._invalidated_regions
+            }
+
+
+_caches: Dict[str, SpatialResultCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_spatial_cache(namespace: str = "nearby") -> SpatialResultCache:
+    """Общий для процесса экземпляр кэша (GeoService создается в нескольких местах)"""
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            cache = _caches[namespace] = SpatialResultCache(namespace)
+        return cache
+
+
+def invalidate_bbox(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> int:
+    """Инвалидация регионов для всех пространств имен (поколения общие)"""
+    return get_spatial_cache().invalidate_bbox(min_lon, min_lat, max_lon, max_lat)
+
+
+def get_spatial_cache_stats() -> Dict[str, Any]:
+    with _caches_lock:
+        return {namespace: cache.stats() for namespace, cache in _caches.items()}
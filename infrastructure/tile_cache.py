@@ -0,0 +1,277 @@
+"""
+Локальный дисковый кэш тайлов подложки для статических карт.
+
+Тайлы хранятся как <TILE_CACHE_DIR>/<provider>/<z>/<x>/<y>.tile. При чтении
+у файла обновляется mtime, и при превышении лимита размера удаляются тайлы,
+к которым дольше всего не обращались (LRU по mtime).
+В офлайн-режиме сеть не используется: если нужного зума нет в кэше, берется
+ближайший меньший зум, полностью присутствующий в кэше.
+
+Настройки через переменные окружения:
+    TILE_CACHE_DIR      - каталог кэша (tile_cache рядом с проектом)
+    TILE_CACHE_MAX_MB   - максимальный размер кэша, МБ (2048)
+    TILE_CACHE_OFFLINE  - true: не ходить в сеть, только кэш (false)
+    TILE_CACHE_MAX_TILES - максимум тайлов на одну карту (64)
+"""
+import io
+import os
+import math
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import mercantile
+import requests
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Провайдеры в порядке предпочтения (как раньше в GeoProcessor.add_basemap)
+TILE_PROVIDERS: Dict[str, Dict] = {
+    "esri_world_imagery": {
+        "url": "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        "max_zoom": 18
+    },
+    "carto_positron": {
+        "url": "https://a.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png",
+        "max_zoom": 20
+    },
+    "esri_world_physical": {
+        "url": "https://server.arcgisonline.com/ArcGIS/rest/services/World_Physical_Map/MapServer/tile/{z}/{y}/{x}",
+        "max_zoom": 8
+    }
+}
+
+DEFAULT_CACHE_DIR = str(Path(__file__).parent.parent / "tile_cache")
+TILE_SIZE = 256
+
+
+class TileNotAvailable(Exception):
+    """Тайл не найден в кэше и не может быть загружен"""
+
+
+class TileCache:
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        offline: Optional[bool] = None,
+        max_tiles_per_map: Optional[int] = None
+    ):
+        self.cache_dir = Path(cache_dir or os.getenv("TILE_CACHE_DIR", DEFAULT_CACHE_DIR))
+        self.max_bytes = max_bytes or int(os.getenv("TILE_CACHE_MAX_MB", "2048")) * 1024 * 1024
+        if offline is None:
+            offline = os.getenv("TILE_CACHE_OFFLINE", "false").lower() == "true"
+        self.offline = offline
+        self.max_tiles_per_map = max_tiles_per_map or int(os.getenv("TILE_CACHE_MAX_TILES", "64"))
+
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "BaikalGeo/1.0"
+
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.evicted = 0
+
+    def tile_path(self, provider: str, z: int, x: int, y: int) -> Path:
+        return self.cache_dir / provider / str(z) / str(x) / f"{y}.tile"
+
+    def has_tile(self, provider: str, z: int, x: int, y: int) -> bool:
+        return self.tile_path(provider, z, x, y).exists()
+
+    def get_tile(self, provider: str, z: int, x: int, y: int) -> bytes:
+        """Тайл из кэша; при отсутствии (и не в офлайн-режиме) загружается и сохраняется"""
+        path = self.tile_path(provider, z, x, y)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            self.hits += 1
+            return data
+        except FileNotFoundError:
+            pass
+
+        self.misses += 1
+        if self.offline:
+            raise TileNotAvailable(f"{provider}/{z}/{x}/{y} нет в кэше (офлайн-режим)")
+        data = self._download(provider, z, x, y)
+        self._store(path, data)
+        return data
+
+    def _download(self, provider: str, z: int, x: int, y: int) -> bytes:
+        url = TILE_PROVIDERS[provider]["url"].format(z=z, x=x, y=y)
+        try:
+            response = self._session.get(url, timeout=10)
+        except requests.RequestException as e:
+            raise TileNotAvailable(f"{provider}/{z}/{x}/{y}: {e}")
+        if response.status_code != 200 or not response.content:
+            raise TileNotAvailable(f"{provider}/{z}/{x}/{y}: HTTP {response.status_code}")
+        self.downloads += 1
+        return response.content
+
+    def _store(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(data)
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def _iter_tiles(self):
+        if not self.cache_dir.exists():
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tile"):
+                    yield os.path.join(root, name)
+
+    def _scan_size(self) -> int:
+        total = 0
+        for path in self._iter_tiles():
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                continue
+        return total
+
+    def evict(self) -> int:
+        """Удаляет самые давно использованные тайлы, пока кэш не уменьшится до 90% лимита"""
+        with self._lock:
+            entries = []
+            for path in self._iter_tiles():
+                try:
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+                except OSError:
+                    continue
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    continue
+            self._total_bytes = total
+            self.evicted += removed
+        if removed:
+            logger.info(f"Кэш тайлов: удалено {removed} тайлов, размер {total / 1024 / 1024:.1f} МБ")
+        return removed
+
+    @staticmethod
+    def auto_zoom(west: float, south: float, east: float, north: float, max_zoom: int) -> int:
+        """Зум по размеру области, как zoom='auto' в contextily"""
+        lon_length = max(east - west, 1e-9)
+        lat_length = max(north - south, 1e-9)
+        zoom_lon = math.ceil(math.log2(360 * 2.0 / lon_length))
+        zoom_lat = math.ceil(math.log2(360 * 2.0 / lat_length))
+        return int(min(max(zoom_lon, zoom_lat), max_zoom))
+
+    def _tiles_for(self, bounds: Tuple[float, float, float, float], zoom: int) -> List[mercantile.Tile]:
+        return list(mercantile.tiles(*bounds, zooms=zoom))
+
+    def _pick_zoom(self, provider: str, bounds: Tuple[float, float, float, float]) -> int:
+        zoom = self.auto_zoom(*bounds, TILE_PROVIDERS[provider]["max_zoom"])
+        # Ограничиваем количество тайлов на карту
+        while zoom > 0 and len(self._tiles_for(bounds, zoom)) > self.max_tiles_per_map:
+            zoom -= 1
+        if not self.offline:
+            return zoom
+        # Офлайн: ближайший зум, полностью присутствующий в кэше
+        for candidate in range(zoom, -1, -1):
+            if all(self.has_tile(provider, t.z, t.x, t.y) for t in self._tiles_for(bounds, candidate)):
+                return candidate
+        raise TileNotAvailable(f"Для области нет тайлов {provider} в кэше")
+
+    def render(self, ax, provider: str) -> None:
+        """
+        Рисует подложку на осях matplotlib в EPSG:3857 (текущие пределы осей сохраняются).
+        Бросает TileNotAvailable, если подложку собрать не удалось.
+        """
+        xmin, xmax = ax.get_xlim()
+        ymin, ymax = ax.get_ylim()
+        west, south = mercantile.lnglat(xmin, ymin)
+        east, north = mercantile.lnglat(xmax, ymax)
+        bounds = (
+            max(west, -180.0), max(south, -85.0511),
+            min(east, 180.0), min(north, 85.0511)
+        )
+
+        zoom = self._pick_zoom(provider, bounds)
+        tiles = self._tiles_for(bounds, zoom)
+        if not tiles:
+            raise TileNotAvailable("Пустая область для подложки")
+
+        min_x = min(t.x for t in tiles)
+        min_y = min(t.y for t in tiles)
+        max_x = max(t.x for t in tiles)
+        max_y = max(t.y for t in tiles)
+
+        mosaic = Image.new("RGB", ((max_x - min_x + 1) * TILE_SIZE, (max_y - min_y + 1) * TILE_SIZE))
+        for tile in tiles:
+            data = self.get_tile(provider, tile.z, tile.x, tile.y)
+            with Image.open(io.BytesIO(data)) as img:
+                img = img.convert("RGB")
+                if img.size != (TILE_SIZE, TILE_SIZE):
+                    img = img.resize((TILE_SIZE, TILE_SIZE))
+                mosaic.paste(img, ((tile.x - min_x) * TILE_SIZE, (tile.y - min_y) * TILE_SIZE))
+
+        top_left = mercantile.xy_bounds(mercantile.Tile(min_x, min_y, zoom))
+        bottom_right = mercantile.xy_bounds(mercantile.Tile(max_x, max_y, zoom))
+        ax.imshow(
+            mosaic,
+            extent=(top_left.left, bottom_right.right, bottom_right.bottom, top_left.top),
+            interpolation="bilinear",
+            zorder=0
+        )
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+
+    def seed(self, provider: str, bounds: Tuple[float, float, float, float], zooms: List[int]) -> Dict[str, int]:
+        """Предзагрузка тайлов области (west, south, east, north) для указанных зумов"""
+        stats = {"cached": 0, "downloaded": 0, "failed": 0}
+        for zoom in zooms:
+            if zoom > TILE_PROVIDERS[provider]["max_zoom"]:
+                continue
+            for tile in self._tiles_for(bounds, zoom):
+                if self.has_tile(provider, tile.z, tile.x, tile.y):
+                    stats["cached"] += 1
+                    continue
+                try:
+                    self.get_tile(provider, tile.z, tile.x, tile.y)
+                    stats["downloaded"] += 1
+                except TileNotAvailable as e:
+                    logger.warning(f"Не удалось загрузить тайл: {e}")
+                    stats["failed"] += 1
+        return stats
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "downloads": self.downloads,
+            "evicted": self.evicted,
+            "offline": self.offline
+        }
+
+
+_tile_cache: Optional[TileCache] = None
+
+
+def get_tile_cache() -> TileCache:
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = TileCache()
+    return _tile_cache
@@ -1,10 +1,9 @@
-import pymorphy2
-from infrastructure.geo_db_store import load_db
-morph = pymorphy2.MorphAnalyzer()
+from infrastructure.geo_db_store import get_geodb_index
+from infrastructure.morphology import inflect, normalize_phrase, parse
 
 def to_prepositional_phrase(text):
     words = text.split()
-    parsed_words = [morph.parse(w)[0] for w in words]
+    parsed_words = [parse(w)[0] for w in words]
 
     # Найдём первое существительное
     for i, pw in enumerate(parsed_words):
@@ -22,24 +21,20 @@ def to_prepositional_phrase(text):
 
     # Преобразуем все слова с учётом согласования
     result = []
-    for i, pw in enumerate(parsed_words):
+    for i, (w, pw) in enumerate(zip(words, parsed_words)):
         if i == noun_index:
-            inflected = pw.inflect({case})
+            inflected = inflect(w, frozenset({case}))
         elif i < noun_index and ('ADJF' in pw.tag or 'PRTF' in pw.tag):  # прилагательное перед существительным
-            inflected = pw.inflect({case, gender, number})
+            inflected = inflect(w, frozenset({case, gender, number}))
         else:
-            inflected = pw.inflect({case})
-        result.append(inflected.word if inflected else pw.word)
+            inflected = inflect(w, frozenset({case}))
+        result.append(inflected if inflected else pw.word)
 
     return " ".join(result)
 
 def normalize_text(text: str) -> str:
-    return " ".join([morph.parse(w)[0].normal_form for w in text.strip().split()]).lower()
+    return normalize_phrase(text)
 
 def find_place_key(user_input):
-    db = load_db()
-    input_normalized = normalize_text(user_input)
-    for key in db:
-        if normalize_text(key) == input_normalized:
-            return key
-    return None
\ No newline at end of file
+    # Нормализованные ключи посчитаны заранее в индексе geodb
+    return get_geodb_index().find_by_normalized(normalize_text(user_input))
\ No newline at end of file
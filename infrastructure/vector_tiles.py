@@ -0,0 +1,217 @@
+"""
+Векторные тайлы (Mapbox Vector Tile) по геометриям map_content.
+
+Тайл строится в PostGIS (ST_AsMVTGeom + ST_AsMVT) с упрощением под зум:
+допуск ST_SimplifyPreserveTopology равен размеру VECTOR_TILE_SIMPLIFY_PX пикселей
+экрана на данном зуме, поэтому на мелких масштабах крупные полигоны весят
+килобайты вместо мегабайт. Интерактивные карты подгружают тайлы по мере
+навигации вместо встроенного в HTML полного GeoJSON.
+
+Готовые тайлы кэшируются в Redis. Ключ включает поколения регионов
+пространственного кэша (infrastructure.spatial_cache), которые импорт увеличивает
+для измененных областей, так что устаревшие тайлы перестают читаться сразу.
+Тайлы мелких зумов (больше SPATIAL_CACHE_MAX_REGIONS регионов) ключуются одним
+глобальным поколением.
+
+Настройки через переменные окружения:
+    VECTOR_TILE_TTL          - время жизни тайла в Redis, секунд (86400)
+    VECTOR_TILE_EXTENT       - размер сетки координат тайла (4096)
+    VECTOR_TILE_BUFFER       - буфер вокруг тайла в единицах сетки (64)
+    VECTOR_TILE_SIMPLIFY_PX  - допуск упрощения в пикселях экрана (1.0)
+    VECTOR_TILE_MAX_IDS      - максимум id map_content в одном запросе (500)
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import mercantile
+
+import utils
+from infrastructure.db_pool import get_db_connection
+from infrastructure.spatial_cache import get_spatial_cache
+
+logger = logging.getLogger(__name__)
+
+LAYER_NAME = "map_content"
+MAX_ZOOM = 22
+# Длина экватора в EPSG:3857, м
+WORLD_SIZE_M = 40075016.685578488
+
+VECTOR_TILE_MAX_IDS = int(os.getenv("VECTOR_TILE_MAX_IDS", "500"))
+
+TILE_QUERY = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom
+    ),
+    features AS (
+        SELECT
+            mc.id,
+            mc.title,
+            ST_AsMVTGeom(
+                ST_SimplifyPreserveTopology(ST_Transform(mc.geometry, 3857), %(tolerance)s),
+                b.geom,
+                %(extent)s,
+                %(buffer)s,
+                true
+            ) AS geom
+        FROM map_content mc
+        CROSS JOIN bounds b
+        WHERE mc.geometry && ST_Transform(b.geom, 4326)
+        {ids_filter}
+    )
+    SELECT ST_AsMVT(features, %(layer)s, %(extent)s, 'geom', 'id') AS tile
+    FROM features
+    WHERE geom IS NOT NULL
+"""
+
+
+class InvalidTileRequest(ValueError):
+    """Некорректные координаты тайла или список id"""
+
+
+def normalize_ids(ids: Optional[Iterable]) -> Optional[List[int]]:
+    """Отсортированный список уникальных id map_content; None - все геометрии"""
+    if ids is None:
+        return None
+    try:
+        normalized = sorted({int(i) for i in ids})
+    except (TypeError, ValueError):
+        raise InvalidTileRequest("ids должны быть целыми числами")
+    if len(normalized) > VECTOR_TILE_MAX_IDS:
+        raise InvalidTileRequest(f"Слишком много ids (максимум {VECTOR_TILE_MAX_IDS})")
+    return normalized
+
+
+def parse_ids_param(value: Optional[str]) -> Optional[List[int]]:
+    """Параметр запроса ids=1,2,3"""
+    if not value:
+        return None
+    return normalize_ids(part for part in value.split(",") if part.strip())
+
+
+def tile_url_template(domain: str, ids: Optional[Iterable] = None) -> str:
+    """Шаблон URL тайлов для Leaflet ({z}/{x}/{y} подставляет клиент)"""
+    url = f"{domain}/tiles/{{z}}/{{x}}/{{y}}.mvt"
+    normalized = normalize_ids(ids)
+    if normalized:
+        url += "?ids=" + ",".join(str(i) for i in normalized)
+    return url
+
+
+class VectorTileService:
+    def __init__(
+        self,
+        ttl: Optional[int] = None,
+        extent: Optional[int] = None,
+        buffer: Optional[int] = None,
+        simplify_px: Optional[float] = None
+    ):
+        self.ttl = ttl or int(os.getenv("VECTOR_TILE_TTL", "86400"))
+        self.extent = extent or int(os.getenv("VECTOR_TILE_EXTENT", "4096"))
+        self.buffer = buffer or int(os.getenv("VECTOR_TILE_BUFFER", "64"))
+        self.simplify_px = simplify_px or float(os.getenv("VECTOR_TILE_SIMPLIFY_PX", "1.0"))
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.bytes_served = 0
+        self.render_time_total = 0.0
+
+    @staticmethod
+    def validate(z: int, x: int, y: int) -> None:
+        if not 0 <= z <= MAX_ZOOM:
+            raise InvalidTileRequest(f"Зум должен быть от 0 до {MAX_ZOOM}")
+        size = 2 ** z
+        if not (0 <= x < size and 0 <= y < size):
+            raise InvalidTileRequest(f"Тайл {z}/{x}/{y} вне сетки")
+
+    def tolerance_m(self, z: int) -> float:
+        """Допуск упрощения в метрах EPSG:3857: simplify_px пикселей тайла 256x256"""
+        return WORLD_SIZE_M / (256 * 2 ** z) * self.simplify_px
+
+    def _cache_key(self, z: int, x: int, y: int, ids: Optional[List[int]]) -> str:
+        bounds = mercantile.bounds(x, y, z)
+        generations = get_spatial_cache().generations_for_bbox(bounds.west, bounds.south, bounds.east, bounds.north)
+        ids_part = hashlib.sha1(",".join(map(str, ids)).encode("ascii")).hexdigest()[:16] if ids else "all"
+        gen_part = hashlib.sha1(",".join(map(str, generations)).encode("ascii")).hexdigest()[:12]
+        return f"cache:mvt:{z}:{x}:{y}:{ids_part}:{gen_part}"
+
+    def _render(self, z: int, x: int, y: int, ids: Optional[List[int]]) -> bytes:
+        params: Dict[str, Any] = {
+            "z": z, "x": x, "y": y,
+            "tolerance": self.tolerance_m(z),
+            "extent": self.extent,
+            "buffer": self.buffer,
+            "layer": LAYER_NAME
+        }
+        ids_filter = ""
+        if ids is not None:
+            ids_filter = "AND mc.id = ANY(%(ids)s)"
+            params["ids"] = ids
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(TILE_QUERY.format(ids_filter=ids_filter), params)
+            row = cursor.fetchone()
+        tile = row["tile"] if row else None
+        return bytes(tile) if tile else b""
+
+    def get_tile(self, z: int, x: int, y: int, ids: Optional[Iterable] = None) -> bytes:
+        """MVT-тайл (пустые байты - в тайле нет геометрий)"""
+        self.validate(z, x, y)
+        ids = normalize_ids(ids)
+        cache_key = self._cache_key(z, x, y, ids)
+
+        client = utils.get_redis_binary_client()
+        if client is not None:
+            try:
+                cached = client.get(cache_key)
+                if cached is not None:
+                    with self._lock:
+                        self.hits += 1
+                        self.bytes_served += len(cached)
+                    return cached
+            except Exception as e:
+                logger.error(f"Redis GET error для векторного тайла {cache_key}: {e}")
+
+        start = time.perf_counter()
+        try:
+            tile = self._render(z, x, y, ids)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.misses += 1
+            self.bytes_served += len(tile)
+            self.render_time_total += elapsed
+
+        if client is not None:
+            try:
+                client.setex(cache_key, self.ttl, tile)
+            except Exception as e:
+                logger.error(f"Redis SET error для векторного тайла {cache_key}: {e}")
+        return tile
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "bytes_served": self.bytes_served,
+                "render_time_avg_ms": round(self.render_time_total / self.misses * 1000, 2) if self.misses else 0.0
+            }
+
+
+_vector_tiles: Optional[VectorTileService] = None
+
+
+def get_vector_tiles() -> VectorTileService:
+    global _vector_tiles
+    if _vector_tiles is None:
+        _vector_tiles = VectorTileService()
+    return _vector_tiles
@@ -15,6 +15,8 @@ load_dotenv()
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from embedding_config import embedding_config, get_model_dimension
+import utils
+from infrastructure.spatial_cache import invalidate_bbox
 
 class NewResourceImporter:
     def __init__(self):
@@ -26,6 +28,14 @@ class NewResourceImporter:
             "port": os.getenv("DB_PORT", "5432")
         }
         self.missing_geometry_objects = set()
+        # id географических сущностей, чьи привязки изменились в текущем ресурсе
+        self.touched_geo_ids = set()
+        self.entity_geometry_enabled = False
+        self.nearby_grid_enabled = False
+        self.simplified_geometry_enabled = False
+        # Охваты (min_lon, min_lat, max_lon, max_lat) геометрий, для которых после commit
+        # нужно сбросить пространственный кэш API
+        self.pending_cache_bboxes = []
         current_model = os.getenv("EMBEDDING_MODEL", embedding_config.current_model)
         embedding_dimension = os.getenv("EMBEDDING_DIMENSION")
         
@@ -123,6 +133,72 @@ class NewResourceImporter:
     def connect(self):
         self.conn = psycopg2.connect(**self.db_config)
         self.cur = self.conn.cursor()
+        self.cur.execute("SELECT to_regprocedure('refresh_entity_geometry(integer[])') IS NOT NULL")
+        self.entity_geometry_enabled = self.cur.fetchone()[0]
+        self.cur.execute("SELECT to_regclass('nearby_grid_candidates') IS NOT NULL")
+        self.nearby_grid_enabled = self.cur.fetchone()[0]
+        self.cur.execute("SELECT to_regprocedure('refresh_map_content_simplified(integer[])') IS NOT NULL")
+        self.simplified_geometry_enabled = self.cur.fetchone()[0]
+        self.conn.commit()
+        if not self.entity_geometry_enabled:
+            print("⚠️  Функция refresh_entity_geometry не найдена, entity_geometry не обновляется")
+        utils.init_redis(host='localhost', port=6379, db=1, decode_responses=True)
+        if not utils.redis_client:
+            print("⚠️  Redis недоступен, пространственный кэш API не инвалидируется")
+
+    def refresh_entity_geometry(self):
+        """Обновляет строки entity_geometry для географических сущностей, затронутых ресурсом"""
+        if self.entity_geometry_enabled and self.touched_geo_ids:
+            geo_ids = sorted(self.touched_geo_ids)
+            self.cur.execute("SELECT refresh_entity_geometry(%s)", (geo_ids,))
+            self.cur.execute("""
+                SELECT DISTINCT ST_XMin(geometry), ST_YMin(geometry), ST_XMax(geometry), ST_YMax(geometry)
+                FROM entity_geometry
+                WHERE geographical_entity_id = ANY(%s)
+            """, (geo_ids,))
+            self.pending_cache_bboxes.extend(self.cur.fetchall())
+            if self.simplified_geometry_enabled:
+                # Упрощенные варианты геометрий, привязанных к затронутым сущностям
+                self.cur.execute("""
+                    SELECT refresh_map_content_simplified(ARRAY(
+                        SELECT DISTINCT map_content_id FROM entity_geometry
+                        WHERE geographical_entity_id = ANY(%s)
+                    ))
+                """, (geo_ids,))
+            if self.nearby_grid_enabled:
+                # Ячейки сетки, до которых дотягиваются новые геометрии, больше не полны -
+                # удаляем их, до следующего прогона precompute_nearby_grid поиск идет напрямую.
+                # Сначала отбор по индексу ячеек: bbox геометрии, расширенный на
+                # максимальный радиус в градусах (по долготе - на широте дальнего от экватора края),
+                # затем точная проверка расстояния
+                self.cur.execute("SELECT MAX(radius_km) FROM nearby_grid_candidates")
+                max_radius_km = self.cur.fetchone()[0]
+                if max_radius_km is not None:
+                    self.cur.execute("""
+                        DELETE FROM nearby_grid_candidates g
+                        USING entity_geometry eo
+                        WHERE eo.geographical_entity_id = ANY(%(geo_ids)s)
+                        AND g.cell && ST_Expand(
+                            eo.geometry,
+                            %(radius_deg)s / GREATEST(
+                                cos(radians(GREATEST(abs(ST_YMin(eo.geometry)), abs(ST_YMax(eo.geometry))))),
+                                0.01
+                            ),
+                            %(radius_deg)s
+                        )
+                        AND ST_DWithin(eo.geography, g.cell::geography, g.radius_km * 1000)
+                    """, {"geo_ids": geo_ids, "radius_deg": float(max_radius_km) / 111.32})
+        self.touched_geo_ids.clear()
+
+    def invalidate_spatial_cache(self):
+        """Сбрасывает кэш поиска объектов поблизости в регионах, где изменились геометрии"""
+        invalidated = 0
+        for bbox in self.pending_cache_bboxes:
+            if all(v is not None for v in bbox):
+                invalidated += invalidate_bbox(*bbox)
+        if invalidated:
+            print(f"Пространственный кэш: инвалидировано регионов {invalidated}")
+        self.pending_cache_bboxes = []
 
     def disconnect(self):
         if self.cur:
@@ -243,6 +319,7 @@ class NewResourceImporter:
                     "ON CONFLICT (entity_id, entity_type, geographical_entity_id) DO NOTHING",
                     (source_id, source_type, geo_id)
                 )
+                self.touched_geo_ids.add(geo_id)
 
             return geo_id
 
@@ -687,6 +764,7 @@ class NewResourceImporter:
                 "VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
                 (entity_id, entity_type, geo_id)
             )
+            self.touched_geo_ids.add(geo_id)
 
             return geo_id
             
@@ -1029,6 +1107,7 @@ class NewResourceImporter:
                 """,
                 (map_id, 'map_content', entity_id)
             )
+            self.touched_geo_ids.add(entity_id)
             
             return map_id
             
@@ -1173,6 +1252,7 @@ class NewResourceImporter:
                     "VALUES (%s, %s, %s)",
                     (map_id, 'map_content', geo_id)
                 )
+                self.touched_geo_ids.add(geo_id)
                 has_geometry = True
             
             # 5. Только если нет геометрии вообще - добавляем в missing_geometry_objects
@@ -1705,6 +1785,7 @@ class NewResourceImporter:
                     """,
                     (map_id, full_geo_id)
                 )
+                self.touched_geo_ids.add(full_geo_id)
                 
                 # Связываем биологическую сущность с географической
                 if bio_id:
@@ -1823,9 +1904,14 @@ class NewResourceImporter:
                     result = None
                 
                 if result:
+                    self.refresh_entity_geometry()
                     self.conn.commit()
+                    # Кэш сбрасывается после commit, чтобы API не закэшировал старые данные заново
+                    self.invalidate_spatial_cache()
                     success_count += 1
                 else:
+                    self.touched_geo_ids.clear()
+                    self.pending_cache_bboxes = []
                     self.conn.rollback()
                     error_count += 1
                 
@@ -1835,6 +1921,8 @@ class NewResourceImporter:
                 traceback.print_exc()
                 self.conn.rollback()
                 error_count += 1
+                self.touched_geo_ids.clear()
+                self.pending_cache_bboxes = []
                 # Сброс кэшей при ошибке
                 self.entity_cache = {}
                 self.author_cache = {}
@@ -11,6 +11,7 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 from embedding_config import embedding_config, get_model_dimension
+from infrastructure.geometry_simplify import SIMPLIFY_LEVELS_M
 
 class DatabaseRecreator:
     def __init__(self):
@@ -38,6 +39,10 @@ class DatabaseRecreator:
             
         self.embedding_model_path = embedding_config.get_model_path(current_model)
         
+        # Параметры HNSW-индекса по text_content.embedding
+        self.hnsw_m = int(os.getenv("HNSW_M", "16"))
+        self.hnsw_ef_construction = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+        
         print(f"📏 Размерность эмбеддингов: {self.embedding_dimension}")
         print(f"🎯 Активная модель: {current_model}")
         print(f"📁 Путь к модели: {self.embedding_model_path}")
@@ -112,6 +117,7 @@ class DatabaseRecreator:
             public.entity_author,
             public.entity_ecological,
             public.entity_geo,
+            public.entity_geometry,
             public.entity_identifier,
             public.entity_identifier_link,
             public.entity_park,
@@ -123,7 +129,9 @@ class DatabaseRecreator:
             public.geographical_entity,
             public.image_content,
             public.map_content,
+            public.map_content_simplified,
             public.modern_human_made,
+            public.nearby_grid_candidates,
             public.organization,
             public.park_reference,
             public.reliability,
@@ -490,12 +498,347 @@ class DatabaseRecreator:
         CREATE INDEX idx_map_content_geometry_gist ON map_content USING GIST(geometry);
         CREATE INDEX idx_entity_geo_entity ON entity_geo(entity_type, entity_id);
         CREATE INDEX idx_text_content_structured_data ON text_content USING GIN (structured_data);
-        
-        CREATE INDEX idx_text_content_embedding ON text_content 
-        USING ivfflat (embedding vector_cosine_ops)
-        WITH (lists = 100);
         """
         self.execute_script(create_script)
+        self.create_vector_index()
+        self.create_search_views()
+        self.create_stoplist_columns()
+        self.create_name_search()
+        self.create_entity_geometry()
+        self.create_nearby_grid()
+        self.create_simplified_geometry()
+
+    def create_vector_index(self):
+        """
+        (Пере)создает HNSW-индекс по text_content.embedding.
+        В отличие от ivfflat, HNSW не требует обучения на данных, поэтому индекс,
+        созданный на пустой таблице, остается корректным после импорта.
+        Используется запросами вида ORDER BY embedding <=> q LIMIT k.
+        """
+        index_script = f"""
+        DROP INDEX IF EXISTS idx_text_content_embedding;
+        CREATE INDEX idx_text_content_embedding ON text_content 
+        USING hnsw (embedding vector_cosine_ops)
+        WITH (m = {self.hnsw_m}, ef_construction = {self.hnsw_ef_construction});
+        """
+        self.execute_script(index_script)
+        print(f"HNSW-индекс создан (m={self.hnsw_m}, ef_construction={self.hnsw_ef_construction})")
+
+    def create_search_views(self):
+        """
+        Представление entity_text_description: текстовое описание -> объект любого типа.
+        Позволяет выполнять один векторный запрос сразу по всем типам объектов.
+        """
+        views_script = """
+        CREATE OR REPLACE VIEW entity_text_description AS
+        SELECT er.source_id AS text_content_id, be.id AS entity_id,
+               'biological_entity'::varchar(30) AS entity_type, be.common_name_ru::varchar(500) AS object_name
+        FROM entity_relation er
+        JOIN biological_entity be ON be.id = er.target_id
+        WHERE er.source_type = 'text_content' AND er.target_type = 'biological_entity'
+          AND er.relation_type = 'описание объекта'
+        UNION ALL
+        SELECT er.source_id, ge.id, 'geographical_entity', ge.name_ru
+        FROM entity_relation er
+        JOIN geographical_entity ge ON ge.id = er.target_id
+        WHERE er.source_type = 'text_content' AND er.target_type = 'geographical_entity'
+          AND er.relation_type = 'описание объекта'
+        UNION ALL
+        SELECT er.source_id, mh.id, 'modern_human_made', mh.name_ru
+        FROM entity_relation er
+        JOIN modern_human_made mh ON mh.id = er.target_id
+        WHERE er.source_type = 'text_content' AND er.target_type = 'modern_human_made'
+          AND er.relation_type = 'описание объекта'
+        UNION ALL
+        SELECT er.source_id, ah.id, 'ancient_human_made', ah.name_ru
+        FROM entity_relation er
+        JOIN ancient_human_made ah ON ah.id = er.target_id
+        WHERE er.source_type = 'text_content' AND er.target_type = 'ancient_human_made'
+          AND er.relation_type = 'описание объекта'
+        UNION ALL
+        SELECT er.source_id, o.id, 'organization', o.name_ru
+        FROM entity_relation er
+        JOIN organization o ON o.id = er.target_id
+        WHERE er.source_type = 'text_content' AND er.target_type = 'organization'
+          AND er.relation_type = 'описание объекта'
+        UNION ALL
+        SELECT er.source_id, rp.id, 'research_project', rp.title
+        FROM entity_relation er
+        JOIN research_project rp ON rp.id = er.target_id
+        WHERE er.source_type = 'text_content' AND er.target_type = 'research_project'
+          AND er.relation_type = 'описание объекта'
+        UNION ALL
+        SELECT er.source_id, vi.id, 'volunteer_initiative', vi.name_ru
+        FROM entity_relation er
+        JOIN volunteer_initiative vi ON vi.id = er.target_id
+        WHERE er.source_type = 'text_content' AND er.target_type = 'volunteer_initiative'
+          AND er.relation_type = 'описание объекта';
+        """
+        self.execute_script(views_script)
+
+    # Таблицы с типизированной колонкой in_stoplist
+    STOPLIST_TABLES = ['text_content', 'image_content', 'biological_entity']
+
+    def create_stoplist_columns(self):
+        """
+        Колонка in_stoplist SMALLINT, вычисляемая из feature_data->>'in_stoplist'
+        (импортер пишет туда число через safe_convert_in_stoplist).
+        Колонка генерируемая, поэтому заполняется при каждой вставке/обновлении,
+        а на существующей базе ADD COLUMN сразу пересчитывает все строки.
+        Частичный индекс покрывает только записи с уровнем - их немного.
+        """
+        statements = []
+        for table in self.STOPLIST_TABLES:
+            statements.append(f"""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS in_stoplist SMALLINT
+            GENERATED ALWAYS AS (
+                CASE WHEN feature_data->>'in_stoplist' ~ '^[0-9]+$'
+                THEN (feature_data->>'in_stoplist')::smallint END
+            ) STORED;
+        CREATE INDEX IF NOT EXISTS idx_{table}_in_stoplist ON {table} (in_stoplist)
+            WHERE in_stoplist IS NOT NULL;
+        ANALYZE {table};""")
+        self.execute_script("\n".join(statements))
+        print(f"Колонки in_stoplist созданы: {', '.join(self.STOPLIST_TABLES)}")
+
+    # Источники имен для поиска: (тип сущности, таблица, поле названия)
+    NAME_SEARCH_SOURCES = [
+        ('biological_entity', 'biological_entity', 'common_name_ru'),
+        ('biological_entity', 'biological_entity', 'scientific_name'),
+        ('geographical_entity', 'geographical_entity', 'name_ru'),
+        ('modern_human_made', 'modern_human_made', 'name_ru'),
+        ('ancient_human_made', 'ancient_human_made', 'name_ru'),
+        ('organization', 'organization', 'name_ru'),
+        ('research_project', 'research_project', 'title'),
+        ('volunteer_initiative', 'volunteer_initiative', 'name_ru'),
+    ]
+
+    def create_name_search(self):
+        """
+        Триграммные GIN-индексы (pg_trgm) по названиям и представление entity_name_search.
+        Индексы gin_trgm_ops работают для ILIKE '%x%', ~* и оператора похожести %,
+        которые не могут использовать обычные btree-индексы по этим полям.
+        """
+        indexed_columns = sorted({(table, column) for _, table, column in self.NAME_SEARCH_SOURCES})
+        indexed_columns.append(('text_content', 'title'))
+        indexed_columns.append(('entity_identifier', 'name_ru'))
+
+        statements = ["CREATE EXTENSION IF NOT EXISTS pg_trgm;"]
+        for table, column in indexed_columns:
+            statements.append(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_{column}_trgm "
+                f"ON {table} USING GIN ({column} gin_trgm_ops);"
+            )
+        # resource_identifiers (Slot_validator.is_known_object) есть не во всех базах
+        statements.append("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'resource_identifiers' AND relkind = 'r') THEN
+                CREATE INDEX IF NOT EXISTS idx_resource_identifiers_name_ru_trgm
+                ON resource_identifiers USING GIN (name_ru gin_trgm_ops);
+            END IF;
+        END $$;""")
+
+        # Поля названий - VARCHAR(500) без приведения типа, чтобы условия по name
+        # проталкивались в ветви UNION ALL и использовали триграммные индексы
+        source_parts = [
+            f"""
+        SELECT {table}.id AS entity_id, '{entity_type}'::varchar(30) AS entity_type,
+               {table}.{column} AS name
+        FROM {table}
+        WHERE {table}.{column} IS NOT NULL"""
+            for entity_type, table, column in self.NAME_SEARCH_SOURCES
+        ]
+        statements.append(
+            "CREATE OR REPLACE VIEW entity_name_search AS" + " UNION ALL".join(source_parts) + ";"
+        )
+        self.execute_script("\n".join(statements))
+        print(f"Триграммные индексы созданы: {len(indexed_columns)}")
+
+    # Сущности, привязанные к геометриям через entity_geo: (тип, таблица, поле названия)
+    ENTITY_GEOMETRY_SOURCES = [
+        ('biological_entity', 'biological_entity', 'common_name_ru'),
+        ('image_content', 'image_content', 'title'),
+        ('text_content', 'text_content', 'title'),
+        ('modern_human_made', 'modern_human_made', 'name_ru'),
+        ('ancient_human_made', 'ancient_human_made', 'name_ru'),
+        ('organization', 'organization', 'name_ru'),
+        ('research_project', 'research_project', 'title'),
+        ('volunteer_initiative', 'volunteer_initiative', 'name_ru'),
+    ]
+
+    def create_entity_geometry(self):
+        """
+        Плоская таблица entity_geometry: сущность -> геометрия map_content.
+        Заменяет в пространственных запросах коррелированные подзапросы через entity_geo.
+        Заполняется из представления entity_geometry_source функцией
+        refresh_entity_geometry(geo_ids): NULL - полное обновление, массив id
+        географических сущностей - только затронутые импортом строки.
+        """
+        in_stoplist_expr = (
+            "CASE WHEN {alias}.feature_data->>'in_stoplist' ~ '^[0-9]+$' "
+            "THEN ({alias}.feature_data->>'in_stoplist')::smallint END"
+        )
+        source_parts = []
+        for entity_type, table, name_column in self.ENTITY_GEOMETRY_SOURCES:
+            source_parts.append(f"""
+        SELECT e.id AS entity_id, '{entity_type}'::varchar(30) AS entity_type,
+               e.{name_column}::varchar(500) AS name, e.description, e.feature_data,
+               {in_stoplist_expr.format(alias='e')} AS in_stoplist,
+               eg.geographical_entity_id, mc.id AS map_content_id, mc.geometry
+        FROM {table} e
+        JOIN entity_geo eg ON eg.entity_id = e.id AND eg.entity_type = '{entity_type}'
+        JOIN entity_geo eg_map ON eg_map.geographical_entity_id = eg.geographical_entity_id
+            AND eg_map.entity_type = 'map_content'
+        JOIN map_content mc ON mc.id = eg_map.entity_id""")
+        source_parts.append(f"""
+        SELECT ge.id, 'geographical_entity'::varchar(30), ge.name_ru::varchar(500), ge.description,
+               ge.feature_data, {in_stoplist_expr.format(alias='ge')},
+               ge.id, mc.id, mc.geometry
+        FROM geographical_entity ge
+        JOIN entity_geo eg_map ON eg_map.geographical_entity_id = ge.id
+            AND eg_map.entity_type = 'map_content'
+        JOIN map_content mc ON mc.id = eg_map.entity_id""")
+
+        entity_geometry_script = f"""
+        CREATE TABLE IF NOT EXISTS entity_geometry (
+            entity_id INT NOT NULL,
+            entity_type VARCHAR(30) NOT NULL,
+            name VARCHAR(500),
+            description TEXT,
+            feature_data JSONB,
+            in_stoplist SMALLINT,
+            geographical_entity_id INT NOT NULL,
+            map_content_id INT NOT NULL,
+            geometry GEOMETRY(Geometry, 4326) NOT NULL,
+            geography GEOGRAPHY NOT NULL,
+            centroid GEOGRAPHY(Point, 4326) NOT NULL,
+            PRIMARY KEY (entity_type, entity_id, map_content_id)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_entity_geometry_geometry ON entity_geometry USING GIST(geometry);
+        CREATE INDEX IF NOT EXISTS idx_entity_geometry_geography ON entity_geometry USING GIST(geography);
+        CREATE INDEX IF NOT EXISTS idx_entity_geometry_centroid ON entity_geometry USING GIST(centroid);
+        CREATE INDEX IF NOT EXISTS idx_entity_geometry_geo_id ON entity_geometry(geographical_entity_id);
+
+        CREATE OR REPLACE VIEW entity_geometry_source AS
+        SELECT src.*, src.geometry::geography AS geography, ST_Centroid(src.geometry)::geography AS centroid
+        FROM ({" UNION ALL ".join(source_parts)}
+        ) src;
+
+        CREATE OR REPLACE FUNCTION refresh_entity_geometry(geo_ids INT[] DEFAULT NULL)
+        RETURNS INTEGER AS $$
+        DECLARE
+            affected INTEGER;
+        BEGIN
+            IF geo_ids IS NULL THEN
+                TRUNCATE entity_geometry;
+                INSERT INTO entity_geometry
+                SELECT * FROM entity_geometry_source
+                ON CONFLICT DO NOTHING;
+            ELSE
+                DELETE FROM entity_geometry WHERE geographical_entity_id = ANY(geo_ids);
+                INSERT INTO entity_geometry
+                SELECT * FROM entity_geometry_source
+                WHERE geographical_entity_id = ANY(geo_ids)
+                ON CONFLICT DO NOTHING;
+            END IF;
+            GET DIAGNOSTICS affected = ROW_COUNT;
+            RETURN affected;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        SELECT refresh_entity_geometry(NULL);
+        ANALYZE entity_geometry;
+
+        -- Предрасчитанные кандидаты сетки построены по старой entity_geometry
+        DO $$
+        BEGIN
+            IF to_regclass('nearby_grid_candidates') IS NOT NULL THEN
+                TRUNCATE nearby_grid_candidates;
+            END IF;
+        END
+        $$;
+        """
+        self.execute_script(entity_geometry_script)
+        print("Таблица entity_geometry заполнена")
+
+    # Варианты хранятся только для геометрий крупнее стольких точек
+    SIMPLIFY_MIN_POINTS = 1000
+
+    def create_simplified_geometry(self):
+        """
+        Таблица map_content_simplified: упрощенные варианты крупных геометрий map_content
+        для ответов API с simplify_tolerance/zoom. Заполняется функцией
+        refresh_map_content_simplified(mc_ids): NULL - все геометрии, массив id - только указанные.
+        """
+        levels = ", ".join(str(level) for level in SIMPLIFY_LEVELS_M)
+        simplified_script = f"""
+        CREATE TABLE IF NOT EXISTS map_content_simplified (
+            map_content_id INT NOT NULL REFERENCES map_content(id) ON DELETE CASCADE,
+            tolerance_m REAL NOT NULL,
+            geometry GEOMETRY(Geometry, 4326) NOT NULL,
+            npoints INT NOT NULL,
+            PRIMARY KEY (map_content_id, tolerance_m)
+        );
+
+        CREATE OR REPLACE FUNCTION refresh_map_content_simplified(mc_ids INT[] DEFAULT NULL)
+        RETURNS INTEGER AS $$
+        DECLARE
+            affected INTEGER;
+        BEGIN
+            IF mc_ids IS NULL THEN
+                TRUNCATE map_content_simplified;
+            ELSE
+                DELETE FROM map_content_simplified WHERE map_content_id = ANY(mc_ids);
+            END IF;
+            INSERT INTO map_content_simplified (map_content_id, tolerance_m, geometry, npoints)
+            SELECT s.id, s.tolerance_m, s.geometry, ST_NPoints(s.geometry)
+            FROM (
+                SELECT mc.id, lvl.tolerance_m,
+                       ST_SimplifyPreserveTopology(mc.geometry, lvl.tolerance_m / 111320.0) AS geometry,
+                       ST_NPoints(mc.geometry) AS original_points
+                FROM map_content mc
+                CROSS JOIN unnest(ARRAY[{levels}]::REAL[]) AS lvl(tolerance_m)
+                WHERE (mc_ids IS NULL OR mc.id = ANY(mc_ids))
+                AND ST_NPoints(mc.geometry) > {self.SIMPLIFY_MIN_POINTS}
+            ) s
+            -- Вариант, почти не отличающийся от оригинала, не нужен
+            WHERE ST_NPoints(s.geometry) < s.original_points * 0.8;
+            GET DIAGNOSTICS affected = ROW_COUNT;
+            RETURN affected;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        SELECT refresh_map_content_simplified(NULL);
+        ANALYZE map_content_simplified;
+        """
+        self.execute_script(simplified_script)
+        print("Таблица map_content_simplified заполнена")
+
+    def create_nearby_grid(self):
+        """
+        Таблица nearby_grid_candidates: для ячейки сетки и радиуса - список сущностей,
+        до которых от какой-либо точки ячейки не дальше радиуса. Заполняется
+        scripts/precompute_nearby_grid.py; поиск поблизости для точки внутри ячейки
+        уточняет расстояния только по этим кандидатам.
+        """
+        nearby_grid_script = """
+        CREATE TABLE IF NOT EXISTS nearby_grid_candidates (
+            radius_km REAL NOT NULL,
+            cell_row INT NOT NULL,
+            cell_col INT NOT NULL,
+            cell GEOMETRY(Polygon, 4326) NOT NULL,
+            entity_types VARCHAR(30)[] NOT NULL,
+            entity_ids INT[] NOT NULL,
+            computed_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (radius_km, cell_row, cell_col)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_nearby_grid_candidates_cell ON nearby_grid_candidates USING GIST(cell);
+        """
+        self.execute_script(nearby_grid_script)
+        print("Таблица nearby_grid_candidates создана")
 
     def recreate_database(self):
         """Основной метод для пересоздания базы данных"""
@@ -511,4 +854,54 @@ class DatabaseRecreator:
 
 if __name__ == "__main__":
     db_recreator = DatabaseRecreator()
-    db_recreator.recreate_database()
\ No newline at end of file
+    if "--vector-index-only" in sys.argv:
+        # Перестроение только векторного индекса без пересоздания таблиц
+        try:
+            db_recreator.connect()
+            db_recreator.create_vector_index()
+        finally:
+            db_recreator.disconnect()
+    elif "--entity-geometry-only" in sys.argv:
+        # Создание/полное обновление entity_geometry на существующей базе
+        try:
+            db_recreator.connect()
+            db_recreator.create_entity_geometry()
+        finally:
+            db_recreator.disconnect()
+    elif "--simplified-geometry-only" in sys.argv:
+        # Упрощенные варианты крупных геометрий map_content на существующей базе
+        try:
+            db_recreator.connect()
+            db_recreator.create_simplified_geometry()
+        finally:
+            db_recreator.disconnect()
+    elif "--nearby-grid-only" in sys.argv:
+        # Таблица предрасчитанных кандидатов поиска поблизости на существующей базе
+        try:
+            db_recreator.connect()
+            db_recreator.create_nearby_grid()
+        finally:
+            db_recreator.disconnect()
+    elif "--stoplist-columns-only" in sys.argv:
+        # Добавление колонок in_stoplist на существующей базе (значения пересчитываются сразу)
+        try:
+            db_recreator.connect()
+            db_recreator.create_stoplist_columns()
+        finally:
+            db_recreator.disconnect()
+    elif "--name-search-only" in sys.argv:
+        # Триграммные индексы и представление для поиска по названиям на существующей базе
+        try:
+            db_recreator.connect()
+            db_recreator.create_name_search()
+        finally:
+            db_recreator.disconnect()
+    elif "--views-only" in sys.argv:
+        # Пересоздание представлений для поиска на существующей базе
+        try:
+            db_recreator.connect()
+            db_recreator.create_search_views()
+        finally:
+            db_recreator.disconnect()
+    else:
+        db_recreator.recreate_database()
\ No newline at end of file
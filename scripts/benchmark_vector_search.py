@@ -0,0 +1,150 @@
+# /scripts/benchmark_vector_search.py
+"""
+Бенчмарк векторного поиска по эмбеддингам: p50/p95 задержки в зависимости от размера корпуса.
+
+Для каждого размера корпуса создается временная таблица со случайными векторами
+(размерность активной модели эмбеддингов) и HNSW-индексом с теми же параметрами,
+что и в recreate_script. Сравниваются три варианта запроса:
+    legacy  - WHERE 1 - (embedding <=> q) > threshold ORDER BY similarity (seq scan)
+    exact   - ORDER BY embedding <=> q LIMIT k без индекса (точный top-k)
+    hnsw    - ORDER BY embedding <=> q LIMIT k по индексу с заданным ef_search
+Для hnsw дополнительно считается recall@k относительно exact.
+
+Пример:
+    python scripts/benchmark_vector_search.py --sizes 1000 10000 50000 --queries 50 --ef-search 40 100
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_config import embedding_config, get_model_dimension
+from infrastructure.db_pool import get_db_config
+
+LEGACY_QUERY = """
+    SELECT id, 1 - (embedding <=> %s::vector) AS similarity
+    FROM bench_embedding
+    WHERE 1 - (embedding <=> %s::vector) > %s
+    ORDER BY similarity DESC
+    LIMIT %s
+"""
+
+KNN_QUERY = """
+    SELECT id, 1 - (embedding <=> %s::vector) AS similarity
+    FROM bench_embedding
+    ORDER BY embedding <=> %s::vector
+    LIMIT %s
+"""
+
+
+def to_vector_literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(f"{x:.6f}" for x in vector) + "]"
+
+
+def random_unit_vectors(count: int, dimension: int, rng: np.random.Generator) -> np.ndarray:
+    vectors = rng.standard_normal((count, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def percentile_ms(timings, p: float) -> float:
+    return float(np.percentile(np.array(timings) * 1000, p))
+
+
+def prepare_corpus(cursor, size: int, dimension: int, m: int, ef_construction: int, rng):
+    """Создает временную таблицу нужного размера и строит по ней HNSW-индекс"""
+    cursor.execute("DROP TABLE IF EXISTS bench_embedding")
+    cursor.execute(f"CREATE TEMP TABLE bench_embedding (id SERIAL PRIMARY KEY, embedding vector({dimension}))")
+
+    batch_size = 1000
+    for start in range(0, size, batch_size):
+        batch = random_unit_vectors(min(batch_size, size - start), dimension, rng)
+        args = ",".join(cursor.mogrify("(%s::vector)", (to_vector_literal(v),)).decode() for v in batch)
+        cursor.execute("INSERT INTO bench_embedding (embedding) VALUES " + args)
+
+    build_start = time.perf_counter()
+    cursor.execute(
+        f"CREATE INDEX ON bench_embedding USING hnsw (embedding vector_cosine_ops) "
+        f"WITH (m = {m}, ef_construction = {ef_construction})"
+    )
+    cursor.execute("ANALYZE bench_embedding")
+    return time.perf_counter() - build_start
+
+
+def run_queries(cursor, mode: str, queries, limit: int, threshold: float):
+    timings, results = [], []
+    for q in queries:
+        literal = to_vector_literal(q)
+        start = time.perf_counter()
+        if mode == "legacy":
+            cursor.execute(LEGACY_QUERY, (literal, literal, threshold, limit))
+        else:
+            cursor.execute(KNN_QUERY, (literal, literal, limit))
+        rows = cursor.fetchall()
+        timings.append(time.perf_counter() - start)
+        results.append({row[0] for row in rows})
+    return timings, results
+
+
+def benchmark(sizes, queries_count: int, limit: int, threshold: float, ef_search_values, m: int, ef_construction: int):
+    dimension = int(os.getenv("EMBEDDING_DIMENSION") or get_model_dimension(embedding_config.current_model))
+    rng = np.random.default_rng(42)
+
+    conn = psycopg2.connect(**get_db_config())
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+    print(f"Размерность: {dimension}, запросов на размер: {queries_count}, k={limit}, m={m}, ef_construction={ef_construction}")
+    header = f"{'size':>8} {'mode':>14} {'p50, ms':>9} {'p95, ms':>9} {'recall@k':>9}"
+    print(header)
+    print("-" * len(header))
+
+    try:
+        for size in sizes:
+            build_time = prepare_corpus(cursor, size, dimension, m, ef_construction, rng)
+            queries = random_unit_vectors(queries_count, dimension, rng)
+
+            # Точный поиск: индекс отключен, результат используется как эталон для recall
+            cursor.execute("SET enable_indexscan = off")
+            timings, exact_results = run_queries(cursor, "exact", queries, limit, threshold)
+            print(f"{size:>8} {'exact':>14} {percentile_ms(timings, 50):>9.2f} {percentile_ms(timings, 95):>9.2f} {'1.000':>9}")
+
+            timings, _ = run_queries(cursor, "legacy", queries, limit, threshold)
+            print(f"{size:>8} {'legacy':>14} {percentile_ms(timings, 50):>9.2f} {percentile_ms(timings, 95):>9.2f} {'-':>9}")
+            cursor.execute("SET enable_indexscan = on")
+
+            for ef_search in ef_search_values:
+                cursor.execute("SELECT set_config('hnsw.ef_search', %s, false)", (str(max(ef_search, limit)),))
+                timings, ann_results = run_queries(cursor, "hnsw", queries, limit, threshold)
+                recall = np.mean([
+                    len(ann & exact) / len(exact) if exact else 1.0
+                    for ann, exact in zip(ann_results, exact_results)
+                ])
+                mode = f"hnsw ef={ef_search}"
+                print(f"{size:>8} {mode:>14} {percentile_ms(timings, 50):>9.2f} {percentile_ms(timings, 95):>9.2f} {recall:>9.3f}")
+
+            print(f"{size:>8} {'index build':>14} {build_time:>9.2f} s")
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS bench_embedding")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк HNSW-поиска по эмбеддингам")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Размеры корпуса")
+    parser.add_argument("--queries", type=int, default=50, help="Количество запросов на каждый размер")
+    parser.add_argument("--limit", type=int, default=10, help="k ближайших соседей")
+    parser.add_argument("--threshold", type=float, default=0.05, help="Порог схожести для legacy-запроса")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100], help="Значения hnsw.ef_search")
+    parser.add_argument("--m", type=int, default=int(os.getenv("HNSW_M", "16")))
+    parser.add_argument("--ef-construction", type=int, default=int(os.getenv("HNSW_EF_CONSTRUCTION", "64")))
+    args = parser.parse_args()
+
+    benchmark(args.sizes, args.queries, args.limit, args.threshold, args.ef_search, args.m, args.ef_construction)
@@ -1,19 +1,35 @@
 # /scripts/cleanup_maps.py
+"""
+Сборка мусора файлов карт.
 
+По умолчанию удаляются артефакты infrastructure.map_artifacts, на которые больше
+не ссылается ни один ключ кэша ответов (аренды в Redis), без сканирования KEYS.
+--legacy-scan - старый режим для карт, названных по ключам кэша (map_<namespace>_HASH):
+файл удаляется, если ключа с таким хэшем в Redis больше нет.
+"""
 import os
+import re
+import sys
 import redis
 import logging
 from pathlib import Path
 import argparse # Для добавления --dry-run
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+from infrastructure.map_artifacts import MapArtifactStore
+
 # --- НАСТРОЙКИ ---
 # Используем Path для работы с путями - это удобнее и безопаснее
-MAPS_DIR = Path("/var/www/map_bot/maps")
+MAPS_DIR = Path(os.getenv("MAPS_DIR", "/var/www/map_bot/maps"))
 REDIS_HOST = "localhost"
 REDIS_PORT = 6379
 REDIS_DB = 1
 # Префиксы для поиска ключей в Redis
 REDIS_KEY_PATTERN = "cache:*:*"
+# Файлы хранилища артефактов (map_<sha256>) обслуживает collect_map_artifacts
+ARTIFACT_FILE_RE = re.compile(r"^(webapp_)?map_[0-9a-f]{40}$")
 # -----------------
 
 # Настройка логирования
@@ -69,6 +85,8 @@ def cleanup_orphaned_maps(dry_run: bool = True):
     # Итерируемся по всем файлам в директории
     for file_path in MAPS_DIR.glob('*'):
         if file_path.is_file():
+            if ARTIFACT_FILE_RE.match(file_path.stem):
+                continue
             files_checked += 1
             # Из имени файла 'map_area_search_HASH.jpeg' извлекаем 'HASH'
             # rsplit('_', 1) - делит строку по последнему '_'
@@ -98,6 +116,24 @@ def cleanup_orphaned_maps(dry_run: bool = True):
     else:
         logging.info(f"Итог: Проверено файлов - {files_checked}. Удалено - {files_to_delete}.")
 
+def collect_map_artifacts(dry_run: bool = True):
+    """Удаляет артефакты карт с истекшими арендами (ссылками из кэша ответов)"""
+    if dry_run:
+        logging.warning("--- Запуск в режиме СУХОГО ПРОГОНА (DRY RUN). Файлы не будут удалены. ---")
+    utils.init_redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+    if not utils.redis_client:
+        logging.error("Не удалось подключиться к Redis. Очистка прервана.")
+        return
+
+    stats = MapArtifactStore(str(MAPS_DIR)).collect_garbage(dry_run=dry_run)
+    logging.info(
+        f"Итог: проверено карт с истекшей арендой - {stats['checked']}, "
+        f"продлено - {stats['extended']}, без ссылок - {stats['deleted']}, "
+        f"удалено файлов - {stats['files_deleted']}."
+    )
+    if dry_run:
+        logging.info("Для реального удаления запустите скрипт с флагом --execute")
+
 if __name__ == "__main__":
     # Добавляем парсер аргументов для безопасного запуска
     parser = argparse.ArgumentParser(description="Удаляет старые файлы карт, ключи которых истекли в Redis.")
@@ -106,8 +142,16 @@ if __name__ == "__main__":
         action="store_true",
         help="Запустить скрипт в рабочем режиме (реально удалять файлы)."
     )
+    parser.add_argument(
+        "--legacy-scan",
+        action="store_true",
+        help="Старый режим: сверка имен файлов с ключами Redis (для карт, созданных до хранилища артефактов)."
+    )
     args = parser.parse_args()
 
     # По умолчанию dry_run=True (безопасный режим)
     # Если запустить с флагом --execute, то dry_run станет False
-    cleanup_orphaned_maps(dry_run=not args.execute)
\ No newline at end of file
+    if args.legacy_scan:
+        cleanup_orphaned_maps(dry_run=not args.execute)
+    else:
+        collect_map_artifacts(dry_run=not args.execute)
\ No newline at end of file
@@ -0,0 +1,131 @@
+# /scripts/precompute_nearby_grid.py
+"""
+Предрасчет кандидатов поиска объектов поблизости по сетке (таблица nearby_grid_candidates).
+
+Область разбивается на ячейки примерно cell_km x cell_km. Для каждой ячейки и
+стандартного радиуса сохраняется список сущностей (тип, id), у которых есть
+геометрия не дальше радиуса от какой-либо точки ячейки. Для любой точки внутри
+ячейки этот список - надмножество ответа, поэтому GeoService уточняет точные
+расстояния только по нескольким сотням кандидатов вместо KNN по всей entity_geometry.
+
+Ячейки, где кандидатов больше --max-candidates, не сохраняются (там быстрее обычный запрос).
+Импорт (postgres_adapter) удаляет ячейки, задетые новыми геометриями, - после
+крупных импортов скрипт стоит прогнать повторно.
+
+Пример:
+    python scripts/precompute_nearby_grid.py --radii 10 20 30 --cell-km 2
+    python scripts/precompute_nearby_grid.py --bbox 106.9 52.9 107.8 53.5 --cell-km 1
+"""
+import os
+import sys
+import math
+import time
+import argparse
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from infrastructure.db_pool import get_db_config
+
+# Байкальская природная территория с запасом: (west, south, east, north)
+BAIKAL_BBOX = (103.0, 51.0, 110.5, 56.5)
+KM_PER_DEGREE = 111.32
+
+UPSERT_CELL_QUERY = """
+    WITH cell AS (
+        SELECT ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326) AS geom
+    ),
+    found AS (
+        SELECT DISTINCT eo.entity_type, eo.entity_id
+        FROM entity_geometry eo, cell
+        WHERE ST_DWithin(eo.geography, cell.geom::geography, %(radius_km)s * 1000)
+    ),
+    agg AS (
+        SELECT
+            COALESCE(array_agg(entity_type ORDER BY entity_type, entity_id), '{}') AS entity_types,
+            COALESCE(array_agg(entity_id ORDER BY entity_type, entity_id), '{}') AS entity_ids,
+            COUNT(*) AS candidate_count
+        FROM found
+    )
+    INSERT INTO nearby_grid_candidates (radius_km, cell_row, cell_col, cell, entity_types, entity_ids, computed_at)
+    SELECT %(radius_km)s, %(row)s, %(col)s, cell.geom, agg.entity_types, agg.entity_ids, now()
+    FROM agg, cell
+    WHERE agg.candidate_count <= %(max_candidates)s
+    ON CONFLICT (radius_km, cell_row, cell_col) DO UPDATE SET
+        cell = EXCLUDED.cell,
+        entity_types = EXCLUDED.entity_types,
+        entity_ids = EXCLUDED.entity_ids,
+        computed_at = EXCLUDED.computed_at
+    RETURNING cardinality(entity_ids)
+"""
+
+DELETE_CELL_QUERY = """
+    DELETE FROM nearby_grid_candidates
+    WHERE radius_km = %(radius_km)s AND cell_row = %(row)s AND cell_col = %(col)s
+"""
+
+
+def grid_cells(bbox, cell_km):
+    """Ячейки (row, col, west, south, east, north); шаг по долготе - по средней широте области"""
+    west, south, east, north = bbox
+    lat_step = cell_km / KM_PER_DEGREE
+    lon_step = lat_step / math.cos(math.radians((south + north) / 2))
+    rows = math.ceil((north - south) / lat_step)
+    cols = math.ceil((east - west) / lon_step)
+    for row in range(rows):
+        cell_south = south + row * lat_step
+        for col in range(cols):
+            cell_west = west + col * lon_step
+            yield row, col, cell_west, cell_south, cell_west + lon_step, cell_south + lat_step
+
+
+def precompute(bbox, cell_km, radii, max_candidates):
+    conn = psycopg2.connect(**get_db_config())
+    try:
+        with conn.cursor() as cursor:
+            for radius_km in radii:
+                started = time.time()
+                stored = skipped = total_candidates = 0
+                current_row = None
+                for row, col, west, south, east, north in grid_cells(bbox, cell_km):
+                    if row != current_row:
+                        # Фиксируем по рядам, чтобы прерванный прогон не терял всю работу
+                        conn.commit()
+                        current_row = row
+                    params = {
+                        "west": west, "south": south, "east": east, "north": north,
+                        "radius_km": radius_km, "row": row, "col": col,
+                        "max_candidates": max_candidates
+                    }
+                    cursor.execute(UPSERT_CELL_QUERY, params)
+                    result = cursor.fetchone()
+                    if result is None:
+                        cursor.execute(DELETE_CELL_QUERY, params)
+                        skipped += 1
+                    else:
+                        stored += 1
+                        total_candidates += result[0]
+                conn.commit()
+                avg = total_candidates / stored if stored else 0
+                print(
+                    f"Радиус {radius_km} км: сохранено ячеек {stored}, пропущено {skipped}, "
+                    f"в среднем кандидатов {avg:.0f}, {time.time() - started:.1f} с"
+                )
+            cursor.execute("ANALYZE nearby_grid_candidates")
+            conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Предрасчет кандидатов поиска поблизости по сетке")
+    parser.add_argument("--bbox", type=float, nargs=4, default=list(BAIKAL_BBOX),
+                        metavar=("WEST", "SOUTH", "EAST", "NORTH"), help="Область в градусах")
+    parser.add_argument("--cell-km", type=float, default=2.0, help="Размер ячейки, км")
+    parser.add_argument("--radii", type=float, nargs="+", default=[10, 20, 30], help="Стандартные радиусы, км")
+    parser.add_argument("--max-candidates", type=int, default=1000,
+                        help="Не сохранять ячейки, где кандидатов больше")
+    args = parser.parse_args()
+
+    precompute(tuple(args.bbox), args.cell_km, args.radii, args.max_candidates)
@@ -0,0 +1,52 @@
+# /scripts/seed_tile_cache.py
+"""
+Предзагрузка локального кэша тайлов подложки для Байкальского региона.
+
+После прогона статические карты рисуются без обращения к сети,
+в том числе в офлайн-режиме (TILE_CACHE_OFFLINE=true).
+
+Пример:
+    python scripts/seed_tile_cache.py --zooms 5 6 7 8 9 10 --providers esri_world_imagery
+"""
+import os
+import sys
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from infrastructure.tile_cache import TILE_PROVIDERS, TileCache
+
+# Байкальская природная территория с запасом: (west, south, east, north)
+BAIKAL_BBOX = (103.0, 51.0, 110.5, 56.5)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+
+
+def seed(bbox, zooms, providers, cache_dir=None):
+    # Сид всегда идет в сеть, независимо от TILE_CACHE_OFFLINE
+    cache = TileCache(cache_dir=cache_dir, offline=False)
+    for provider in providers:
+        logging.info(f"Провайдер {provider}: зумы {zooms}, область {bbox}")
+        stats = cache.seed(provider, bbox, zooms)
+        logging.info(
+            f"Провайдер {provider}: уже в кэше {stats['cached']}, "
+            f"загружено {stats['downloaded']}, ошибок {stats['failed']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Предзагрузка кэша тайлов подложки")
+    parser.add_argument("--bbox", type=float, nargs=4, default=list(BAIKAL_BBOX),
+                        metavar=("WEST", "SOUTH", "EAST", "NORTH"), help="Область в градусах")
+    parser.add_argument("--zooms", type=int, nargs="+", default=list(range(5, 11)), help="Уровни зума")
+    parser.add_argument("--providers", nargs="+", default=list(TILE_PROVIDERS),
+                        choices=list(TILE_PROVIDERS), help="Провайдеры тайлов")
+    parser.add_argument("--cache-dir", default=None, help="Каталог кэша (по умолчанию TILE_CACHE_DIR)")
+    args = parser.parse_args()
+
+    seed(tuple(args.bbox), args.zooms, args.providers, args.cache_dir)
@@ -1,19 +1,25 @@
 # utils.py
 import json
+import time
+import uuid
 import hashlib
 import logging
 from typing import Any, Optional, Tuple
 import redis
 
+from infrastructure.cache_codec import decode_value, encode_value, namespace_of
+
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
 # Redis клиент (инициализируется в main приложении)
 redis_client = None
+# Клиент без декодирования ответов - для бинарных значений (эмбеддинги и т.п.)
+redis_binary_client = None
 
 def init_redis(host='localhost', port=6379, db=1, decode_responses=True):
     """Инициализация Redis клиента"""
-    global redis_client
+    global redis_client, redis_binary_client
     redis_client = redis.Redis(
         host=host, 
         port=port, 
@@ -26,6 +32,13 @@ def init_redis(host='localhost', port=6379, db=1, decode_responses=True):
     except redis.ConnectionError:
         logger.error("Failed to connect to Redis")
         redis_client = None
+        redis_binary_client = None
+        return
+    redis_binary_client = redis.Redis(host=host, port=port, db=db, decode_responses=False)
+
+def get_redis_binary_client() -> Optional[redis.Redis]:
+    """Redis клиент для бинарных значений (None, если Redis недоступен)"""
+    return redis_binary_client
 
 def generate_cache_key(params: dict) -> str:
     """
@@ -42,16 +55,17 @@ def get_cached_result(cache_key: str, debug_info: dict = None) -> Tuple[bool, Op
     Returns:
         Tuple[bool, Optional[Any]]: (cache_hit, cached_data)
     """
-    if not redis_client:
+    if not redis_binary_client:
         return False, None
         
     try:
-        cached_result_str = redis_client.get(cache_key)
-        if cached_result_str:
+        cached_data = redis_binary_client.get(cache_key)
+        if cached_data:
+            result = decode_value(cached_data, namespace_of(cache_key))
             logger.info(f"Cache HIT for key: {cache_key}")
             if debug_info:
                 debug_info["cache"] = {"hit": True, "key": cache_key}
-            return True, json.loads(cached_result_str)
+            return True, result
         else:
             logger.info(f"Cache MISS for key: {cache_key}")
             if debug_info:
@@ -70,17 +84,89 @@ def set_cached_result(cache_key: str, result: Any, expire_time: int = 3600) -> b
     Returns:
         bool: True если успешно, False если ошибка
     """
-    if not redis_client:
+    if not redis_binary_client:
         return False
         
     try:
-        redis_client.setex(cache_key, expire_time, json.dumps(result))
+        redis_binary_client.setex(cache_key, expire_time, encode_value(result, namespace_of(cache_key)))
         logger.info(f"Cache SET for key: {cache_key} (expire: {expire_time}s)")
         return True
     except Exception as e:
         logger.error(f"Redis SET error for key {cache_key}: {e}")
         return False
 
+# Удаляет лок, только если он все еще принадлежит нам (сравнение токена атомарно)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def _lock_key(cache_key: str) -> str:
+    return f"lock:{cache_key}"
+
+def acquire_cache_lock(cache_key: str, ttl_ms: int = 60000) -> Optional[str]:
+    """
+    Пытается взять распределенный лок на вычисление значения для cache_key.
+    Лок сам истекает через ttl_ms, если владелец упал.
+    
+    Returns:
+        Optional[str]: токен владельца или None, если лок занят (или Redis недоступен)
+    """
+    if not redis_client:
+        return None
+        
+    token = uuid.uuid4().hex
+    try:
+        if redis_client.set(_lock_key(cache_key), token, nx=True, px=ttl_ms):
+            logger.info(f"Cache LOCK acquired for key: {cache_key}")
+            return token
+        return None
+    except Exception as e:
+        logger.error(f"Redis LOCK error for key {cache_key}: {e}")
+        return None
+
+def release_cache_lock(cache_key: str, token: str) -> bool:
+    """Освобождает лок, если он принадлежит владельцу токена"""
+    if not redis_client:
+        return False
+        
+    try:
+        released = redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, _lock_key(cache_key), token)
+        return bool(released)
+    except Exception as e:
+        logger.error(f"Redis UNLOCK error for key {cache_key}: {e}")
+        return False
+
+def wait_for_cached_result(cache_key: str, timeout: float = 30.0, poll_interval: float = 0.1) -> Tuple[bool, Optional[Any]]:
+    """
+    Ждет, пока владелец лока положит результат в кеш.
+    Возвращается раньше таймаута, если лок исчез без результата
+    (владелец завершился с ошибкой или упал и лок истек).
+    
+    Returns:
+        Tuple[bool, Optional[Any]]: (cache_hit, cached_data)
+    """
+    if not redis_client:
+        return False, None
+        
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        cache_hit, cached_result = get_cached_result(cache_key)
+        if cache_hit:
+            return True, cached_result
+        try:
+            if not redis_client.exists(_lock_key(cache_key)):
+                # Последняя проверка: результат мог появиться между запросами
+                return get_cached_result(cache_key)
+        except Exception as e:
+            logger.error(f"Redis EXISTS error for key {cache_key}: {e}")
+            return False, None
+    logger.warning(f"Timeout waiting for cached result: {cache_key}")
+    return False, None
+
 def clear_cache_pattern(pattern: str = "cache:*") -> Tuple[bool, int]:
     """
     Очищает кеш по паттерну